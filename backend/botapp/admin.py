@@ -3,6 +3,8 @@ from .models import Feedback
 
 class FeedbackAdmin(admin.ModelAdmin):
     list_display = ('id', 'get_message_content', 'feedback_type', 'created_at')
+    # 一次 JOIN 取得訊息，避免每列各查一次
+    list_select_related = ('message',)
 
     def get_message_content(self, obj):
         # 確保引用的是正確的字段或關聯
@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class BotappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'botapp'
+
+    def ready(self):
+        # 僅在伺服器行程設定 QA_ENGINE_WARMUP 時預先初始化 QA 系統，
+        # 一般 manage.py 指令與測試不需負擔初始化成本
+        if settings.QA_ENGINE_WARMUP:
+            from botbackend.views import qa_engine
+            qa_engine.warm_up()
+            # 預先租用訊息 ID 的 worker ID，請求處理時不必存取資料庫租用
+            from botapp.ids import start_worker_lease
+            try:
+                start_worker_lease()
+            except Exception as e:
+                print(f"預先租用 worker ID 失敗，改於第一次寫入訊息時租用: {str(e)}")
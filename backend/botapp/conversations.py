@@ -0,0 +1,154 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from botapp.message_log import message_log
+from botapp.models import Conversation, Message, new_conversation_id
+from rag.memory import DEFAULT_WINDOW_TURNS, split_turns
+
+TURN_FIELDS = ('id', 'content', 'response', 'is_bot_response', 'created_at')
+# 超出視窗的對話累積到此輪數才呼叫 LLM 摘要一次
+SUMMARY_BATCH_TURNS = int(os.getenv("MEMORY_SUMMARY_BATCH_TURNS", "3"))
+
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summarize')
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+
+class ConversationNotFound(Exception):
+    """conversation_id 不存在、不是伺服器發出的，或不屬於目前的使用者"""
+
+
+def _signature(value):
+    return salted_hmac('botapp.conversation', value).hexdigest()[:16]
+
+
+def issue_conversation_id():
+    """新對話的 ID：附上簽章，尚未寫入資料庫時其他行程也能確認是伺服器發出的"""
+    value = new_conversation_id()
+    return f"{value}-{_signature(value)}"
+
+
+def is_issued(conversation_id):
+    value, _, signature = conversation_id.rpartition('-')
+    return bool(value) and constant_time_compare(signature, _signature(value))
+
+
+def resolve_conversation(conversation_id, user_id=None):
+    """取得對話；未提供 conversation_id 時開啟新對話
+
+    新對話不立即寫入資料庫，由 MessageLog 寫入第一批訊息時一併建立（回傳的 Conversation 尚未儲存）。
+    既有對話需屬於 user_id，否則拋出 ConversationNotFound。
+    """
+    if not conversation_id:
+        return Conversation(id=issue_conversation_id(), user_id=user_id)
+    conversation = Conversation.objects.filter(id=conversation_id).first()
+    if conversation is None:
+        # 剛開啟、訊息仍在某個行程 write-behind 緩衝中的對話
+        if not is_issued(conversation_id):
+            raise ConversationNotFound(conversation_id)
+        pending = message_log.pending(conversation_id)
+        owner = pending[0]['user_id'] if pending else user_id
+        conversation = Conversation(id=conversation_id, user_id=owner)
+    if conversation.user_id != user_id:
+        raise ConversationNotFound(conversation_id)
+    return conversation
+
+
+def to_turns(rows):
+    """將依時間排序的訊息配對成 [(問題, 回答, 最後一則訊息 ID)]
+
+    chat 端點分別記錄使用者與機器人訊息；QuestionResponseViewSet 則在同一筆記錄
+    content 與 response。沒有回答的問題以空字串作為回答。
+    """
+    turns = []
+    question = None
+    for row in rows:
+        if row['is_bot_response']:
+            turns.append((question[0] if question else '', row['content'], row['id']))
+            question = None
+        elif row['response']:
+            turns.append((row['content'], row['response'], row['id']))
+        else:
+            if question:
+                turns.append((question[0], '', question[1]))
+            question = (row['content'], row['id'])
+    if question:
+        turns.append((question[0], '', question[1]))
+    return turns
+
+
+def unsummarized_messages(conversation):
+    """尚未併入摘要的訊息，含仍在 write-behind 緩衝中的記錄"""
+    # 先讀緩衝再查資料庫：兩者之間寫入的批次會同時出現在兩邊，以 ID 去重
+    pending = message_log.pending(conversation.id)
+    messages = Message.objects.filter(conversation_id=conversation.id)
+    if conversation.summarized_until is not None:
+        messages = messages.filter(id__gt=conversation.summarized_until)
+        pending = [record for record in pending if record['id'] > conversation.summarized_until]
+    rows = {row['id']: row for row in messages.order_by('created_at', 'id').values(*TURN_FIELDS)}
+    for record in pending:
+        rows.setdefault(record['id'], {name: record[name] for name in TURN_FIELDS})
+    return sorted(rows.values(), key=lambda row: (row['created_at'], row['id']))
+
+
+def load_memory(conversation, window_turns=DEFAULT_WINDOW_TURNS):
+    """讀取對話記憶 {'summary', 'turns'}，不呼叫 LLM
+
+    摘要使用 Conversation 上最後一次存下的版本；尚未併入摘要的對話保留原文，
+    最多 window_turns + SUMMARY_BATCH_TURNS 輪（由 summarize_later 在背景併入摘要）。
+    """
+    if conversation._state.adding and not message_log.pending(conversation.id):
+        return {'summary': '', 'turns': []}
+    turns = to_turns(unsummarized_messages(conversation))
+    return {
+        'summary': conversation.summary,
+        'turns': [(question, answer) for question, answer, _ in turns[-(window_turns + SUMMARY_BATCH_TURNS):]],
+    }
+
+
+def summarize_conversation(conversation_id, summarize, window_turns=DEFAULT_WINDOW_TURNS):
+    """將最近 window_turns 輪以前的對話以 summarize(摘要, 對話) 增量併入摘要
+
+    累積至少 SUMMARY_BATCH_TURNS 輪才摘要一次；摘要與已併入的最後一則訊息 ID 存在 Conversation 上。
+    """
+    conversation = Conversation.objects.filter(id=conversation_id).first()
+    if conversation is None:
+        return False
+    older, _ = split_turns(to_turns(unsummarized_messages(conversation)), window_turns)
+    if len(older) < SUMMARY_BATCH_TURNS:
+        return False
+    summary = summarize(conversation.summary, [(question, answer) for question, answer, _ in older])
+    # 同一對話的並行摘要只保留先寫入的一份
+    return bool(Conversation.objects.filter(
+        id=conversation.id, summarized_until=conversation.summarized_until
+    ).update(summary=summary, summarized_until=older[-1][2], updated_at=timezone.now()))
+
+
+def summarize_later(conversation_id, memory, summarize, window_turns=DEFAULT_WINDOW_TURNS):
+    """回答寫入後在背景更新摘要（請求本身只讀取已存的摘要）"""
+    # 加上這一輪仍放得進視窗時不需要摘要
+    if len(memory['turns']) + 1 < window_turns + SUMMARY_BATCH_TURNS:
+        return
+    with _summarizing_lock:
+        if conversation_id in _summarizing:
+            return
+        _summarizing.add(conversation_id)
+
+    def run():
+        try:
+            close_old_connections()
+            # 確保這一輪的訊息（與對話本身）已寫入資料庫
+            message_log.flush()
+            summarize_conversation(conversation_id, summarize, window_turns)
+        except Exception as e:
+            print(f"對話摘要失敗: {str(e)}")
+        finally:
+            with _summarizing_lock:
+                _summarizing.discard(conversation_id)
+
+    _summary_executor.submit(run)
@@ -0,0 +1,64 @@
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from botapp.models import FeedbackDailyStat
+
+COUNTER_FIELDS = {'like': 'likes', 'dislike': 'dislikes'}
+GROUP_FIELDS = {'day': 'date', 'path': 'answer_path', 'source': 'source'}
+
+
+def stat_keys(message):
+    """回饋要累加的 (answer_path, source) 組合：路徑合計一列，加上每個來源文件各一列"""
+    path = (message.answer_path if message else None) or ''
+    sources = (message.source_documents if message else None) or []
+    names = sorted({source[:255] for source in sources if isinstance(source, str) and source})
+    return [(path, '')] + [(path, name) for name in names]
+
+
+def record_feedback(feedback):
+    """寫入回饋後更新當日彙總（與寫入回饋放在同一個 transaction 中呼叫）"""
+    field = COUNTER_FIELDS.get(feedback.feedback_type)
+    if field is None:
+        return
+    date = timezone.localdate(feedback.created_at)
+    with transaction.atomic():
+        for path, source in stat_keys(feedback.message):
+            stat, _ = FeedbackDailyStat.objects.get_or_create(date=date, answer_path=path, source=source)
+            # 以 F() 在資料庫端累加，並行寫入不會互相覆蓋
+            FeedbackDailyStat.objects.filter(pk=stat.pk).update(**{field: F(field) + 1})
+
+
+def like_rate(likes, dislikes):
+    total = likes + dislikes
+    return round(likes / total, 4) if total else None
+
+
+def feedback_summary(start=None, end=None, group_by='day'):
+    """只讀取彙總表統計讚／倒讚，成本與天數（及路徑、文件數）成正比，與回饋筆數無關
+
+    group_by 為 'day'、'path' 或 'source'；totals 以合計列計算，不會重複計入多來源的回答。
+    """
+    field = GROUP_FIELDS[group_by]
+    stats = FeedbackDailyStat.objects.all()
+    if start:
+        stats = stats.filter(date__gte=start)
+    if end:
+        stats = stats.filter(date__lte=end)
+    totals = stats.filter(source='').aggregate(likes=Sum('likes'), dislikes=Sum('dislikes'))
+    stats = stats.exclude(source='') if group_by == 'source' else stats.filter(source='')
+    rows = []
+    for row in stats.values(field).annotate(likes=Sum('likes'), dislikes=Sum('dislikes')).order_by(field):
+        key = row[field]
+        rows.append({
+            group_by: key.isoformat() if group_by == 'day' else key,
+            'likes': row['likes'],
+            'dislikes': row['dislikes'],
+            'like_rate': like_rate(row['likes'], row['dislikes']),
+        })
+    likes, dislikes = totals['likes'] or 0, totals['dislikes'] or 0
+    return {
+        'group_by': group_by,
+        'totals': {'likes': likes, 'dislikes': dislikes, 'like_rate': like_rate(likes, dislikes)},
+        'rows': rows,
+    }
@@ -0,0 +1,169 @@
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+# 2025-01-01 00:00:00 UTC（毫秒）
+ID_EPOCH_MS = 1735689600000
+WORKER_BITS = 5
+SEQUENCE_BITS = 5
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+def message_id_time(message_id):
+    """訊息 ID 中記錄的產生時間（UNIX 秒）"""
+    return ((message_id >> (WORKER_BITS + SEQUENCE_BITS)) + ID_EPOCH_MS) / 1000
+
+
+class IdGenerator:
+    """以時間排序的 64 位元 ID：(毫秒 << 10) | (worker << 5) | 序號
+
+    毫秒部分有 43 位元（可用約 278 年），整體小於 2^53，前端 JavaScript 可精確表示。
+    同一毫秒內每個 worker 最多 32 個 ID，用完時等到下一毫秒。
+    ID 在寫入資料庫之前就能確定，write-behind 的訊息可以立即回傳 ID。
+    """
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id 需介於 0 與 {MAX_WORKER_ID} 之間")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now = int(time.time() * 1000) - ID_EPOCH_MS
+            # 時鐘倒退時沿用上一個時間，避免產生重複 ID
+            if now <= self._last_ms:
+                now = self._last_ms
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    now += 1
+                    while int(time.time() * 1000) - ID_EPOCH_MS < now:
+                        time.sleep(0.0002)
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+class WorkerLease:
+    """在資料庫租用 worker ID，保證同時執行的行程（含不同主機）各自使用不同的 ID
+
+    租約每 lease_seconds / 4 秒由背景執行緒續約；超過 lease_seconds 未續約視為持有的行程已結束，
+    可由其他行程接手。本行程超過 lease_seconds / 2 未成功續約時，產生 ID 前會先同步續約，
+    確保不會在租約可能已被接手後繼續使用同一個 worker ID。
+    """
+
+    def __init__(self, lease_seconds):
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.worker_id = acquire_worker_id(self.owner, lease_seconds)
+        self.renewed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def renew(self):
+        """續約；租約已被接手時改租另一個 worker ID，回傳目前的 worker ID"""
+        from botapp.models import WorkerLease as Lease
+        with self._lock:
+            renewed = Lease.objects.filter(worker_id=self.worker_id, owner=self.owner).update(heartbeat=timezone.now())
+            if not renewed:
+                print(f"worker ID {self.worker_id} 的租約已失效，重新租用")
+                self.worker_id = acquire_worker_id(self.owner, self.lease_seconds)
+            self.renewed_at = time.monotonic()
+            return self.worker_id
+
+    def is_fresh(self):
+        return time.monotonic() - self.renewed_at < self.lease_seconds / 2
+
+    def release(self):
+        from botapp.models import WorkerLease as Lease
+        try:
+            Lease.objects.filter(worker_id=self.worker_id, owner=self.owner).delete()
+        except Exception as e:
+            print(f"釋放 worker ID 租約失敗: {str(e)}")
+
+    def keep_alive(self, on_change):
+        """啟動續約的背景執行緒，worker ID 改變時呼叫 on_change(新 ID)"""
+        def run():
+            while True:
+                time.sleep(self.lease_seconds / 4)
+                try:
+                    close_old_connections()
+                    previous = self.worker_id
+                    if self.renew() != previous:
+                        on_change(self.worker_id)
+                except Exception as e:
+                    print(f"worker ID 續約失敗: {str(e)}")
+        threading.Thread(target=run, name='worker-lease', daemon=True).start()
+        atexit.register(self.release)
+
+
+def acquire_worker_id(owner, lease_seconds):
+    """租用一個未被使用（或租約已過期）的 worker ID，全部被佔用時拋出 RuntimeError"""
+    from botapp.models import WorkerLease as Lease
+    now = timezone.now()
+    expired_before = now - timedelta(seconds=lease_seconds)
+    active = set(Lease.objects.filter(heartbeat__gte=expired_before).values_list('worker_id', flat=True))
+    for worker_id in range(MAX_WORKER_ID + 1):
+        if worker_id in active:
+            continue
+        # 條件式更新：多個行程同時接手同一個過期租約時只有一個會成功
+        if Lease.objects.filter(worker_id=worker_id, heartbeat__lt=expired_before).update(owner=owner, heartbeat=now):
+            return worker_id
+        try:
+            with transaction.atomic():
+                Lease.objects.create(worker_id=worker_id, owner=owner, heartbeat=now)
+            return worker_id
+        except IntegrityError:
+            continue
+    raise RuntimeError(f"沒有可用的 worker ID（{MAX_WORKER_ID + 1} 個都已被其他行程租用），"
+                       f"無法產生不重複的訊息 ID")
+
+
+_generator = None
+_generator_pid = None
+_lease = None
+_generator_lock = threading.Lock()
+
+
+def _set_worker_id(worker_id):
+    global _generator
+    with _generator_lock:
+        _generator = IdGenerator(worker_id)
+
+
+def start_worker_lease():
+    """租用本行程的 worker ID 並啟動續約（已租用時不做事；fork 出的子行程會重新租用）
+
+    伺服器行程由 BotappConfig.ready 預先呼叫，請求處理時（包含 async view）不必再存取資料庫租用。
+    """
+    global _generator, _generator_pid, _lease
+    if _generator is None or _generator_pid != os.getpid():
+        with _generator_lock:
+            if _generator is None or _generator_pid != os.getpid():
+                from django.conf import settings
+                _lease = WorkerLease(settings.MESSAGE_WORKER_LEASE_SECONDS)
+                _generator = IdGenerator(_lease.worker_id)
+                _generator_pid = os.getpid()
+                _lease.keep_alive(_set_worker_id)
+
+
+def next_message_id():
+    """Message 主鍵的預設值（尚未租用 worker ID 時先租用，會存取資料庫）"""
+    start_worker_lease()
+    if not _lease.is_fresh():
+        # 背景續約停滯時同步續約，避免與接手同一 ID 的行程重複
+        worker_id = _lease.worker_id
+        if _lease.renew() != worker_id:
+            _set_worker_id(_lease.worker_id)
+    return _generator.next_id()
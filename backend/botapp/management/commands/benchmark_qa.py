@@ -0,0 +1,155 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import urllib.request
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from rag.benchmark import (DEFAULT_QUESTIONS, benchmark_http, benchmark_ingestion, benchmark_retrieval,
+                           compare_results)
+from rag.cache_backends import CACHE_BACKENDS
+from rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+from rag.fakes import FakeChatModel, HashEmbeddings
+from rag.vector_backends import BACKENDS
+
+STAGES = ('ingest', 'retrieval', 'http')
+
+class Command(BaseCommand):
+    help = ('Offline QA benchmark with the hash embedder and fake chat model: ingestion docs/s and chunks/s, '
+            'retrieval QPS/p99 and end-to-end /api/chat/ latency under concurrent clients')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--docs', default=settings.DOCUMENTS_DIR, help='文件目錄')
+        parser.add_argument('--backend', default=settings.VECTOR_BACKEND, choices=list(BACKENDS))
+        parser.add_argument('--stages', default=','.join(STAGES), help='以逗號分隔：ingest、retrieval、http')
+        parser.add_argument('--questions', help='問題檔（每行一題），預設使用內建問題')
+        parser.add_argument('--dim', type=int, default=256, help='雜湊嵌入的維度')
+        parser.add_argument('--embed-ms', type=float, default=0.0, help='每次嵌入呼叫的模擬延遲')
+        parser.add_argument('--llm-first-token-ms', type=float, default=300.0)
+        parser.add_argument('--llm-tokens-per-second', type=float, default=50.0)
+        parser.add_argument('--queries', type=int, default=200, help='檢索測試的查詢數')
+        parser.add_argument('--concurrency', type=int, default=4, help='檢索測試的並行執行緒數')
+        parser.add_argument('--clients', type=int, default=8, help='端到端測試的並行用戶端數')
+        parser.add_argument('--requests', type=int, default=10, help='每個用戶端的請求數')
+        parser.add_argument('--url', help='對執行中的伺服器（以 QA_MODELS=fake 啟動）測試，如 '
+                                          'http://127.0.0.1:8000/api/chat/；未指定時在本行程內呼叫'
+                                          '（對話記錄會寫入目前設定的資料庫）')
+        parser.add_argument('--answer-cache', action='store_true', help='端到端測試啟用答案與檢索結果快取')
+        parser.add_argument('--cache-backend', default='memory', choices=list(CACHE_BACKENDS),
+                            help='QA 快取後端（sqlite 的檔案放在暫存目錄，redis 使用 REDIS_URL）')
+        parser.add_argument('--output', help='將結果寫入 JSON 檔')
+        parser.add_argument('--compare', help='與先前的結果 JSON 比較')
+
+    def handle(self, *args, **kwargs):
+        stages = [stage.strip() for stage in kwargs['stages'].split(',') if stage.strip()]
+        unknown = [stage for stage in stages if stage not in STAGES]
+        if unknown:
+            print(f"未知的測試階段: {', '.join(unknown)}")
+            return
+        questions = DEFAULT_QUESTIONS
+        if kwargs['questions']:
+            with open(kwargs['questions'], 'r', encoding='utf-8') as f:
+                questions = [line.strip() for line in f if line.strip()]
+
+        llm = FakeChatModel(
+            first_token_latency=kwargs['llm_first_token_ms'] / 1000,
+            tokens_per_second=kwargs['llm_tokens_per_second']
+        )
+        results = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'backend': kwargs['backend'],
+                'docs': kwargs['docs'],
+                'dim': kwargs['dim'],
+                'embed_ms': kwargs['embed_ms'],
+                'llm_first_token_ms': kwargs['llm_first_token_ms'],
+                'llm_tokens_per_second': kwargs['llm_tokens_per_second'],
+                'cache_backend': kwargs['cache_backend'],
+            }
+        }
+
+        # 索引與嵌入快取都放在暫存目錄，每次都從空索引開始，不影響正式索引
+        workdir = tempfile.mkdtemp(prefix='bench-qa-')
+        try:
+            embeddings = CachedEmbeddings(
+                HashEmbeddings(kwargs['dim'], latency=kwargs['embed_ms'] / 1000),
+                cache=EmbeddingCache(os.path.join(workdir, 'embedding_cache'))
+            )
+            index_dir = os.path.join(workdir, 'index')
+            if 'ingest' in stages or 'retrieval' in stages or ('http' in stages and not kwargs['url']):
+                print("匯入文件...")
+                index, results['ingest'] = benchmark_ingestion(kwargs['docs'], kwargs['backend'], embeddings, index_dir)
+                print(f"  {results['ingest']}")
+
+            if 'retrieval' in stages or ('http' in stages and not kwargs['url']):
+                from botbackend.views import qa_engine
+                qa_engine.configure(
+                    docs_dir=kwargs['docs'],
+                    vector_backend=kwargs['backend'],
+                    embeddings=embeddings,
+                    llm=llm,
+                    index_dir=index_dir,
+                    cache_backend=kwargs['cache_backend'],
+                    cache_options={'path': os.path.join(workdir, 'qa_cache.sqlite3')}
+                    if kwargs['cache_backend'] == 'sqlite' else {}
+                )
+                qa_engine.reload()
+                if not kwargs['answer_cache']:
+                    qa_engine.answer_cache.max_entries = 0
+                    qa_engine.retrieval_cache_entries = 0
+
+            if 'retrieval' in stages:
+                print("測試檢索...")
+                results['retrieval'] = benchmark_retrieval(
+                    qa_engine.get_chain().retriever, questions, kwargs['queries'], kwargs['concurrency']
+                )
+                print(f"  {results['retrieval']}")
+
+            if 'http' in stages:
+                print(f"測試端到端（{kwargs['clients']} 個用戶端）...")
+                post = self._remote_post(kwargs['url']) if kwargs['url'] else self._local_post()
+                results['http'] = benchmark_http(post, questions, kwargs['clients'], kwargs['requests'])
+                if not kwargs['url']:
+                    results['http']['answer_paths'] = qa_engine.path_stats()
+                print(f"  {results['http']}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if kwargs['compare']:
+            with open(kwargs['compare'], 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            print(f"\n{'metric':<28} {'baseline':>12} {'current':>12} {'change%':>9}")
+            for name, old, new, change in compare_results(baseline, results):
+                if name.startswith('meta.'):
+                    continue
+                print(f"{name:<28} {old:>12} {new:>12} {change if change is not None else '-':>9}")
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"結果已寫入 {kwargs['output']}")
+
+    @staticmethod
+    def _check(status, body):
+        if status != 200 or body.get('status') != 'success':
+            raise RuntimeError(f"HTTP {status}: {body.get('message')}")
+
+    def _local_post(self):
+        from django.test import Client
+
+        def post(question):
+            response = Client().post('/api/chat/', data={'question': question}, content_type='application/json')
+            self._check(response.status_code, response.json())
+        return post
+
+    def _remote_post(self, url):
+        def post(question):
+            request = urllib.request.Request(
+                url,
+                data=json.dumps({'question': question}).encode('utf-8'),
+                headers={'Content-Type': 'application/json'}
+            )
+            with urllib.request.urlopen(request, timeout=60) as response:
+                self._check(response.status, json.load(response))
+        return post
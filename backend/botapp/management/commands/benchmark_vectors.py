@@ -0,0 +1,50 @@
+import json
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from rag.benchmark import run_vector_benchmark
+from rag.vector_backends import BACKENDS
+
+class Command(BaseCommand):
+    help = 'Benchmark vector backends: build/load time, recall@k against exact search, p50/p99 latency and index size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default=','.join(BACKENDS),
+                            help='以逗號分隔的後端名稱')
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='以逗號分隔的 chunk 數量')
+        parser.add_argument('--dim', type=int, default=256,
+                            help='向量維度（OpenAI 嵌入為 1536，記憶體需求較高）')
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--output', help='將結果寫入 JSON 檔')
+
+    def handle(self, *args, **kwargs):
+        backends = [name.strip() for name in kwargs['backends'].split(',') if name.strip()]
+        unknown = [name for name in backends if name not in BACKENDS]
+        if unknown:
+            print(f"未知的向量後端: {', '.join(unknown)}")
+            return
+
+        sizes = [int(size) for size in kwargs['sizes'].split(',')]
+        # 目前設定中的後端套用 settings.VECTOR_BACKEND_OPTIONS
+        options = {settings.VECTOR_BACKEND: settings.VECTOR_BACKEND_OPTIONS}
+        results = run_vector_benchmark(
+            backends,
+            sizes=sizes,
+            dim=kwargs['dim'],
+            k=kwargs['k'],
+            num_queries=kwargs['queries'],
+            options=options
+        )
+
+        recall_key = f"recall@{kwargs['k']}"
+        print(f"\n{'backend':<12} {'size':>9} {'build_s':>9} {'load_s':>8} {'p50_ms':>8} "
+              f"{'p99_ms':>8} {recall_key:>10} {'index_mb':>9}")
+        for r in results:
+            print(f"{r['backend']:<12} {r['size']:>9} {r['build_s']:>9} {r['load_s']:>8} {r['p50_ms']:>8} "
+                  f"{r['p99_ms']:>8} {r[recall_key]:>10} {r['index_mb']:>9}")
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"結果已寫入 {kwargs['output']}")
@@ -0,0 +1,82 @@
+import itertools
+import json
+import shutil
+import tempfile
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from rag.benchmark import sweep_chunking
+from rag.chunking import PARENT_CHUNK_SIZE, SEPARATOR_SETS, STRATEGIES, chunking_config
+from rag.embedding_cache import CachedEmbeddings
+from rag.evaluation import DEFAULT_QUESTIONS_FILE, load_questions
+from rag.qa_system import MODELS, create_models
+from rag.vector_backends import BACKENDS
+
+class Command(BaseCommand):
+    help = ('Sweep chunk size, overlap and separator sets: chunks, index bytes, build time, '
+            'query latency and recall@k on a labelled question set')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--docs', default=settings.DOCUMENTS_DIR, help='文件目錄')
+        parser.add_argument('--sizes', default='150,250,400', help='以逗號分隔的 chunk_size')
+        parser.add_argument('--overlaps', default='0,50,125', help='以逗號分隔的 chunk_overlap')
+        parser.add_argument('--separators', default=','.join(SEPARATOR_SETS),
+                            help=f"以逗號分隔的分隔符組合（{'、'.join(SEPARATOR_SETS)}）")
+        parser.add_argument('--strategies', default=','.join(STRATEGIES),
+                            help=f"以逗號分隔的分割方式（{'、'.join(STRATEGIES)}）")
+        parser.add_argument('--parent-sizes', default=str(PARENT_CHUNK_SIZE), help='以逗號分隔的父段落大小')
+        parser.add_argument('--backend', default=settings.VECTOR_BACKEND, choices=list(BACKENDS))
+        parser.add_argument('--models', default=settings.QA_MODELS, choices=MODELS,
+                            help='嵌入模型（fake 為離線的雜湊嵌入）')
+        parser.add_argument('--questions', default=DEFAULT_QUESTIONS_FILE, help='標註條款的問題檔（JSON lines）')
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--workers', type=int, default=4, help='並行建立索引的數量')
+        parser.add_argument('--output', help='將結果寫入 JSON 檔')
+
+    def handle(self, *args, **kwargs):
+        names = lambda value: [x.strip() for x in value.split(',') if x.strip()]
+        ints = lambda value: [int(x) for x in names(value)]
+        configs = []
+        for strategy, size, overlap, separators, parent_size in itertools.product(
+                names(kwargs['strategies']), ints(kwargs['sizes']), ints(kwargs['overlaps']),
+                names(kwargs['separators']), ints(kwargs['parent_sizes'])):
+            if overlap >= size:
+                continue
+            try:
+                configs.append(chunking_config(size, overlap, parent_size, separators, strategy))
+            except ValueError as e:
+                print(e)
+                return
+        items = load_questions(kwargs['questions'])
+        if not any(item['clauses'] for item in items):
+            print("問題檔沒有標註條款（clauses），無法計算 recall")
+            return
+
+        # 共用磁碟嵌入快取：不同設定切出的相同文字、以及先前執行過的設定都不需重新嵌入
+        embeddings = CachedEmbeddings(create_models(kwargs['models'])[0])
+        workdir = tempfile.mkdtemp(prefix='sweep-chunking-')
+        print(f"共 {len(configs)} 組設定，{len(items)} 個問題")
+        try:
+            results = sweep_chunking(configs, kwargs['docs'], kwargs['backend'], embeddings, items, workdir,
+                                     k=kwargs['k'], workers=kwargs['workers'])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        recall_key = f"recall@{kwargs['k']}"
+        # 以 recall、MRR 為主，相同時選索引較小者
+        results.sort(key=lambda r: (-(r[recall_key] or 0), -(r['mrr'] or 0), r['index_bytes']))
+        print(f"\n{'strategy':<9} {'size':>5} {'overlap':>7} {'parent':>6} {'sep':<9} {'chunks':>7} {'index_kb':>9} "
+              f"{'build_s':>8} {'p50_ms':>7} {'p99_ms':>7} {recall_key:>9} {'mrr':>6}")
+        for r in results:
+            print(f"{r['strategy']:<9} {r['chunk_size']:>5} {r['chunk_overlap']:>7} {r['parent_chunk_size']:>6} {r['separators']:<9} "
+                  f"{r['chunks']:>7} {r['index_bytes'] // 1024:>9} {r['build_s']:>8} {r['p50_ms']:>7} "
+                  f"{r['p99_ms']:>7} {r[recall_key]:>9} {r['mrr']:>6}")
+        best = results[0]
+        print("\n建議設定（寫入 .env 後重新執行 process_documents 或重啟伺服器即生效）：")
+        print(f"CHUNK_SIZE={best['chunk_size']}\nCHUNK_OVERLAP={best['chunk_overlap']}\n"
+              f"PARENT_CHUNK_SIZE={best['parent_chunk_size']}\nCHUNK_SEPARATORS={best['separators']}\n"
+              f"CHUNK_STRATEGY={best['strategy']}")
+
+        if kwargs['output']:
+            with open(kwargs['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"結果已寫入 {kwargs['output']}")
@@ -0,0 +1,284 @@
+import atexit
+import glob
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from botapp.ids import message_id_time, next_message_id
+from botapp.models import Conversation, Message
+from rag.tracing import span
+
+MESSAGE_FIELDS = ('id', 'content', 'response', 'source_documents', 'is_bot_response',
+                  'answer_path', 'latency_ms', 'created_at', 'user_id', 'conversation_id')
+# 判斷補寫的記錄是否已在資料庫中（相同 ID 且內容相同）
+CONTENT_FIELDS = ('content', 'response', 'is_bot_response', 'user_id', 'conversation_id')
+RECOVERING_PATTERN = re.compile(r'\.recovering-(\d+)$')
+# ensure_saved 等待其他 worker 寫入時，在對方的寫入間隔之外多等的秒數與查詢間隔
+SAVE_WAIT_GRACE = 1.0
+SAVE_POLL_INTERVAL = 0.05
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def create_conversations(records):
+    """建立記錄所屬、尚未寫入資料庫的對話（新對話在第一批訊息寫入時才建立，見 botapp.conversations）"""
+    owners = {}
+    for record in records:
+        if record['conversation_id']:
+            owners.setdefault(record['conversation_id'], record['user_id'])
+    if not owners:
+        return
+    existing = set(Conversation.objects.filter(id__in=owners).values_list('id', flat=True))
+    # 多個行程可能同時建立同一個對話（ID 相同即為同一個對話）
+    Conversation.objects.bulk_create(
+        [Conversation(id=conversation_id, user_id=user_id)
+         for conversation_id, user_id in owners.items() if conversation_id not in existing],
+        ignore_conflicts=True
+    )
+
+
+class MessageLog:
+    """對話記錄的 write-behind 緩衝
+
+    log() 先產生 ID 與 created_at、附加寫入本機 spool 檔（JSON lines）後立即回傳，
+    背景執行緒在累積 batch_size 筆或經過 flush_interval 秒時以 bulk_create 寫入資料庫。
+    每個行程有自己的 spool 檔（messages-<pid>-<隨機碼>.jsonl，容器重啟後 PID 重複也不會共用同一個檔案）；
+    寫入資料庫前先將其改名為 .flushing，成功後才刪除。
+    已結束行程留下的 spool 檔由之後啟動的行程改名為 .recovering-<pid> 取得後重新寫入
+    （ID 固定，已寫入的相同記錄會略過）。
+    """
+
+    def __init__(self, spool_dir, batch_size=100, flush_interval=1.0, fsync=False):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.spool_path = os.path.join(spool_dir, f"messages-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+        if os.path.exists(self.spool_path):
+            # 不附加到其他行程的檔案：改名後由背景執行緒第一次 recover 時補寫
+            os.replace(self.spool_path, f"{self.spool_path}.{time.time_ns()}.orphaned")
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = []
+        # 已從緩衝取出、正在寫入資料庫的批次
+        self._inflight = []
+        self._pending_ids = set()
+        # 寫入失敗、記錄已放回緩衝的 .flushing 檔
+        self._retry_paths = []
+        self._spool = None
+        self._worker = None
+        self.stats = {'logged': 0, 'flushed': 0, 'batches': 0, 'recovered': 0, 'errors': 0}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.MESSAGE_SPOOL_DIR,
+            batch_size=settings.MESSAGE_LOG_BATCH_SIZE,
+            flush_interval=settings.MESSAGE_LOG_FLUSH_INTERVAL,
+            fsync=settings.MESSAGE_SPOOL_FSYNC,
+        )
+
+    def _start(self):
+        """第一次寫入時啟動背景執行緒（執行緒啟動後會先補寫遺留的 spool）"""
+        self._worker = threading.Thread(target=self._run, name='message-log', daemon=True)
+        self._worker.start()
+        atexit.register(self.flush)
+
+    def log(self, **fields):
+        """記錄一則訊息，回傳（尚未寫入資料庫的）Message，其 id 與 created_at 已確定"""
+        fields.setdefault('id', next_message_id())
+        fields.setdefault('created_at', timezone.now())
+        # 經由模型補上未指定欄位的預設值
+        message = Message(**fields)
+        record = {name: getattr(message, name) for name in MESSAGE_FIELDS}
+        line = json.dumps(dict(record, created_at=record['created_at'].isoformat()), ensure_ascii=False)
+
+        with self._lock:
+            if self._worker is None:
+                self._start()
+            if self._spool is None:
+                self._spool = open(self.spool_path, 'a', encoding='utf-8')
+            self._spool.write(line + '\n')
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            self._buffer.append(record)
+            self._pending_ids.add(record['id'])
+            self.stats['logged'] += 1
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+        return message
+
+    def is_pending(self, message_id):
+        """訊息是否仍在緩衝中、尚未寫入資料庫"""
+        with self._lock:
+            return message_id in self._pending_ids
+
+    def pending(self, conversation_id):
+        """某個對話中尚未寫入資料庫的訊息記錄（供讀取對話記憶時與資料庫的結果合併）"""
+        with self._lock:
+            return [record for record in self._inflight + self._buffer
+                    if record['conversation_id'] == conversation_id]
+
+    def ensure_saved(self, message_id):
+        """確保訊息已寫入資料庫（例如回饋要引用剛回傳的訊息 ID）
+
+        訊息在本行程的緩衝中時立即寫入。由其他 worker 產生的訊息可能還在該 worker 的緩衝中：
+        ID 記錄的產生時間仍在寫入間隔（flush_interval，加上 SAVE_WAIT_GRACE）內時，
+        短暫等待到資料庫中出現該訊息或超過時限為止。
+        """
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return
+        if self.is_pending(message_id):
+            self.flush()
+            return
+        now = time.time()
+        deadline = min(message_id_time(message_id), now) + self.flush_interval + SAVE_WAIT_GRACE
+        while now < deadline and not Message.objects.filter(id=message_id).exists():
+            time.sleep(SAVE_POLL_INTERVAL)
+            now = time.time()
+
+    def _run(self):
+        needs_recover = True
+        while True:
+            try:
+                if needs_recover:
+                    self.recover()
+                    needs_recover = False
+                self.flush()
+            except Exception as e:
+                # 寫入失敗的批次已放回緩衝，下一輪重試
+                self.stats['errors'] += 1
+                needs_recover = True
+                print(f"對話記錄寫入資料庫失敗: {str(e)}")
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+    def flush(self):
+        """將緩衝中的訊息寫入資料庫
+
+        寫入失敗時這一批放回緩衝最前面、仍視為待寫入（ensure_saved 會再次嘗試），
+        其 .flushing 檔保留到之後某次寫入成功為止。
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                records, self._buffer = self._buffer, []
+                self._inflight = records
+                # 切換 spool 檔：之後的記錄寫入新檔，這一批寫入成功後才刪除舊檔
+                if self._spool is not None:
+                    self._spool.close()
+                    self._spool = None
+                    flushing_path = f"{self.spool_path}.{time.time_ns()}.flushing"
+                    os.replace(self.spool_path, flushing_path)
+                    self._retry_paths.append(flushing_path)
+                retry_paths = list(self._retry_paths)
+
+            close_old_connections()
+            try:
+                # 背景執行緒沒有請求追蹤，只計入 db_flush 的耗時分佈
+                with span("db_flush", messages=len(records)):
+                    with transaction.atomic():
+                        create_conversations(records)
+                        Message.objects.bulk_create([Message(**record) for record in records])
+            except Exception:
+                with self._lock:
+                    self._inflight = []
+                    self._buffer = records + self._buffer
+                raise
+            with self._lock:
+                self._inflight = []
+                self._pending_ids.difference_update(record['id'] for record in records)
+                self._retry_paths = [path for path in self._retry_paths if path not in retry_paths]
+            for path in retry_paths:
+                os.remove(path)
+            self.stats['flushed'] += len(records)
+            self.stats['batches'] += 1
+            return len(records)
+
+    def recover(self):
+        """補寫已結束行程遺留的 spool 檔"""
+        with self._flush_lock:
+            self._recover()
+
+    def _claim(self, path):
+        """將 spool 檔改名為 .recovering-<pid> 取得處理權，其他行程已取得時回傳 None"""
+        match = RECOVERING_PATTERN.search(path)
+        owner = int(match.group(1)) if match else int(os.path.basename(path).split('-')[1].split('.')[0])
+        if owner != os.getpid() and _pid_alive(owner):
+            return None
+        if path == self.spool_path or path in self._retry_paths:
+            return None
+        claimed = f"{RECOVERING_PATTERN.sub('', path)}.recovering-{os.getpid()}"
+        if claimed != path:
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                return None
+        return claimed
+
+    def _recover(self):
+        for path in glob.glob(os.path.join(self.spool_dir, 'messages-*.jsonl*')):
+            claimed = self._claim(path)
+            if claimed is None:
+                continue
+            records = []
+            with open(claimed, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 當掉時寫到一半的最後一行
+                        continue
+                    record['created_at'] = parse_datetime(record['created_at'])
+                    records.append(record)
+            close_old_connections()
+            records = self._unsaved(records)
+            with transaction.atomic():
+                create_conversations(records)
+                Message.objects.bulk_create([Message(**record) for record in records], batch_size=self.batch_size)
+            os.remove(claimed)
+            self.stats['recovered'] += len(records)
+            if records:
+                print(f"已補寫 {len(records)} 則遺留的對話記錄: {os.path.basename(path)}")
+
+    def _unsaved(self, records):
+        """去除已寫入資料庫的記錄（寫入後、刪除 spool 前當掉）
+
+        ID 已存在但內容不同時表示 ID 重複，改用新的 ID 寫入並提出警告，不丟棄訊息。
+        """
+        existing = Message.objects.in_bulk([record['id'] for record in records])
+        unsaved = []
+        for record in records:
+            saved = existing.get(record['id'])
+            if saved is None:
+                unsaved.append(record)
+            elif any(getattr(saved, field) != record[field] for field in CONTENT_FIELDS):
+                new_id = next_message_id()
+                print(f"警告: 訊息 ID {record['id']} 已被其他內容使用，改以 {new_id} 寫入")
+                unsaved.append(dict(record, id=new_id))
+        return unsaved
+
+
+message_log = MessageLog.from_settings()
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-17 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0006_message_is_bot_response'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='answer_path',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='latency_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
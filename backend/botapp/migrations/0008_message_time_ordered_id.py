@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-17 15:36
+
+import botapp.ids
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0007_message_answer_path_message_latency_ms'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='id',
+            field=models.BigIntegerField(default=botapp.ids.next_message_id, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.15 on 2026-10-17 16:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import botapp.models
+
+
+def create_conversations(apps, schema_editor):
+    """為既有訊息中出現過的 conversation_id 建立對應的 Conversation"""
+    Conversation = apps.get_model('botapp', 'Conversation')
+    Message = apps.get_model('botapp', 'Message')
+    seen = set()
+    rows = (Message.objects.exclude(conversation__isnull=True)
+            .order_by('created_at', 'id').values_list('conversation', 'user_id'))
+    conversations = []
+    for conversation_id, user_id in rows.iterator():
+        if conversation_id in seen:
+            continue
+        seen.add(conversation_id)
+        conversations.append(Conversation(id=conversation_id, user_id=user_id))
+    Conversation.objects.bulk_create(conversations, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0009_message_user_conversation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.CharField(default=botapp.models.new_conversation_id, editable=False, max_length=64, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('summarized_until', models.BigIntegerField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='conversations', to='botapp.user')),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_conv_created_idx',
+        ),
+        migrations.RenameField(
+            model_name='message',
+            old_name='conversation_id',
+            new_name='conversation',
+        ),
+        migrations.RunPython(create_conversations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='botapp.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at', 'id'], name='message_conv_created_idx'),
+        ),
+    ]
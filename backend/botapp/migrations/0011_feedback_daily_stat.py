@@ -0,0 +1,55 @@
+# Generated by Django 5.1.15 on 2026-10-17 15:47
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_stats(apps, schema_editor):
+    """以既有回饋建立彙總（之後由 botapp.feedback_stats 增量更新）"""
+    Feedback = apps.get_model('botapp', 'Feedback')
+    FeedbackDailyStat = apps.get_model('botapp', 'FeedbackDailyStat')
+    counters = {'like': Counter(), 'dislike': Counter()}
+    for feedback in Feedback.objects.select_related('message').iterator():
+        if feedback.feedback_type not in counters:
+            continue
+        message = feedback.message
+        date = timezone.localdate(feedback.created_at)
+        path = (message.answer_path if message else None) or ''
+        sources = (message.source_documents if message else None) or []
+        names = {source[:255] for source in sources if isinstance(source, str) and source}
+        for source in [''] + sorted(names):
+            counters[feedback.feedback_type][(date, path, source)] += 1
+    keys = set(counters['like']) | set(counters['dislike'])
+    FeedbackDailyStat.objects.bulk_create([
+        FeedbackDailyStat(date=date, answer_path=path, source=source,
+                          likes=counters['like'][(date, path, source)],
+                          dislikes=counters['dislike'][(date, path, source)])
+        for date, path, source in keys
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0010_conversation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedbackDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('answer_path', models.CharField(blank=True, default='', max_length=20)),
+                ('source', models.CharField(blank=True, default='', max_length=255)),
+                ('likes', models.PositiveIntegerField(default=0)),
+                ('dislikes', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'answer_path', 'source'), name='feedback_stat_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
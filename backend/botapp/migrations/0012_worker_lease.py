@@ -0,0 +1,21 @@
+# Generated by Django 5.1.15 on 2026-10-17 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('botapp', '0011_feedback_daily_stat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerLease',
+            fields=[
+                ('worker_id', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('owner', models.CharField(max_length=128)),
+                ('heartbeat', models.DateTimeField()),
+            ],
+        ),
+    ]
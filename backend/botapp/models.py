@@ -1,4 +1,9 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+
+from botapp.ids import next_message_id
 
 
 class User(models.Model):
@@ -8,17 +13,75 @@ class User(models.Model):
     def __str__(self):
         return self.user_acc
 
+def new_conversation_id():
+    return uuid.uuid4().hex
+
+class Conversation(models.Model):
+    id = models.CharField(primary_key=True, max_length=64, default=new_conversation_id, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name='conversations',
+        null=True,
+        blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # 較舊對話的增量摘要，summarized_until 為已併入摘要的最後一則訊息 ID（見 botapp.conversations）
+    summary = models.TextField(blank=True, default='')
+    summarized_until = models.BigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return self.id
+
 class Message(models.Model):
+    # 以時間排序的 ID 於應用程式端產生，寫入資料庫前即可回傳給前端（見 botapp.message_log）
+    id = models.BigIntegerField(primary_key=True, default=next_message_id, editable=False)
     content = models.TextField()  # 訊息內容
     response = models.TextField(null=True, blank=True)  # 保留此欄位以維護向後兼容性
-    created_at = models.DateTimeField(auto_now_add=True)
+    # 由 write-behind 批次寫入時保留請求當下的時間，而非寫入資料庫的時間
+    created_at = models.DateTimeField(default=timezone.now)
     source_documents = models.JSONField(null=True, blank=True)
     is_bot_response = models.BooleanField(default=False)  # 用於區分是否為機器人回答
+    # 回答的服務路徑（clause、faq、cache、llm）與耗時，用於比較直接查詢與 LLM 的成本
+    answer_path = models.CharField(max_length=20, null=True, blank=True)
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name='messages',
+        null=True,
+        blank=True
+    )
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.SET_NULL,
+        related_name='messages',
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        # 歷史記錄以 (created_at, id) 做 keyset 分頁，依使用者／對話篩選時也走索引
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='message_created_id_idx'),
+            models.Index(fields=['user', 'created_at', 'id'], name='message_user_created_idx'),
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_conv_created_idx'),
+        ]
 
     def __str__(self):
         prefix = "Bot: " if self.is_bot_response else "User: "
         return f"{prefix}{self.content[:50]}..."
 
+class WorkerLease(models.Model):
+    """訊息 ID 產生器的 worker ID 租約（見 botapp.ids），每個執行中的行程持有一個"""
+    worker_id = models.PositiveSmallIntegerField(primary_key=True)
+    owner = models.CharField(max_length=128)
+    heartbeat = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.worker_id}: {self.owner}"
+
 class Feedback(models.Model):
     message = models.ForeignKey(
         Message,
@@ -38,3 +101,23 @@ class Feedback(models.Model):
             response = self.message.response or "No response"
             return f"{self.feedback_type} - {response[:30]}"
         return f"{self.feedback_type} - No message"
+
+class FeedbackDailyStat(models.Model):
+    """回饋的每日彙總，於寫入回饋時增量更新（見 botapp.feedback_stats）
+
+    source 為空字串的列是該日、該回答路徑的合計；其餘每個來源文件各一列，
+    一則回答引用多份文件時會計入每一份文件。
+    """
+    date = models.DateField()
+    answer_path = models.CharField(max_length=20, blank=True, default='')
+    source = models.CharField(max_length=255, blank=True, default='')
+    likes = models.PositiveIntegerField(default=0)
+    dislikes = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'answer_path', 'source'], name='feedback_stat_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.answer_path or '-'} {self.source or '合計'}: {self.likes}/{self.dislikes}"
@@ -1,3 +1,345 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from botapp import ids
+from botapp.conversations import (SUMMARY_BATCH_TURNS, ConversationNotFound, issue_conversation_id, load_memory,
+                                  resolve_conversation, summarize_conversation)
+from botapp.ids import MAX_WORKER_ID, IdGenerator, acquire_worker_id
+from botapp.message_log import MessageLog
+from botapp.models import Conversation, Message, User, WorkerLease
+from botbackend import views
+from botbackend.pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_page
+from rag.fakes import FakeChatModel
+from rag.memory import DEFAULT_WINDOW_TURNS
+
+
+class IdGeneratorTests(TestCase):
+    def test_ids_are_strictly_increasing(self):
+        generator = IdGenerator(3)
+        ids = [generator.next_id() for _ in range(500)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(all((value >> 5) & MAX_WORKER_ID == 3 for value in ids))
+
+    def test_clock_going_backwards_keeps_ids_increasing(self):
+        generator = IdGenerator(0)
+        first = generator.next_id()
+        with mock.patch('botapp.ids.time.time', return_value=0):
+            second = generator.next_id()
+        self.assertGreater(second, first)
+
+    def test_rejects_out_of_range_worker(self):
+        with self.assertRaises(ValueError):
+            IdGenerator(MAX_WORKER_ID + 1)
+
+
+class WorkerLeaseTests(TestCase):
+    def test_processes_get_distinct_worker_ids(self):
+        ids = [acquire_worker_id(f"host:{pid}", 60) for pid in range(MAX_WORKER_ID + 1)]
+        self.assertEqual(sorted(ids), list(range(MAX_WORKER_ID + 1)))
+
+    def test_fails_when_all_worker_ids_are_leased(self):
+        for pid in range(MAX_WORKER_ID + 1):
+            acquire_worker_id(f"host:{pid}", 60)
+        with self.assertRaises(RuntimeError):
+            acquire_worker_id("host:extra", 60)
+
+    def test_takes_over_expired_lease(self):
+        for pid in range(MAX_WORKER_ID + 1):
+            acquire_worker_id(f"host:{pid}", 60)
+        WorkerLease.objects.filter(worker_id=7).update(heartbeat=timezone.now() - timedelta(seconds=120))
+        self.assertEqual(acquire_worker_id("host:new", 60), 7)
+        self.assertEqual(WorkerLease.objects.get(worker_id=7).owner, "host:new")
+
+
+@mock.patch.object(MessageLog, '_start')
+class MessageLogTests(TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        self.user = User.objects.create(user_acc='tester', user_psd='x')
+        self.next_id = iter(range(1, 1000))
+
+    def make_log(self):
+        return MessageLog(self.spool_dir, batch_size=10)
+
+    def log_message(self, message_log, content):
+        return message_log.log(id=next(self.next_id), content=content, response='', user_id=self.user.id)
+
+    def write_spool(self, name, records):
+        with open(os.path.join(self.spool_dir, name), 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(dict(record, created_at=timezone.now().isoformat()), ensure_ascii=False) + '\n')
+
+    def record(self, message_id, content):
+        return {'id': message_id, 'content': content, 'response': '', 'source_documents': None,
+                'is_bot_response': False, 'answer_path': '', 'latency_ms': None,
+                'user_id': self.user.id, 'conversation_id': None}
+
+    def test_flush_writes_buffer_and_removes_spool(self, _start):
+        message_log = self.make_log()
+        message = self.log_message(message_log, '請假')
+        self.assertTrue(message_log.is_pending(message.id))
+        self.assertEqual(message_log.flush(), 1)
+        self.assertTrue(Message.objects.filter(id=message.id, content='請假').exists())
+        self.assertFalse(message_log.is_pending(message.id))
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_failed_flush_keeps_messages_pending_and_retries(self, _start):
+        message_log = self.make_log()
+        first = self.log_message(message_log, '第一則')
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                message_log.flush()
+        self.assertTrue(message_log.is_pending(first.id))
+        # 失敗批次的 .flushing 檔不會被本行程的 recover 重複寫入
+        message_log.recover()
+        self.assertFalse(Message.objects.filter(id=first.id).exists())
+
+        second = self.log_message(message_log, '第二則')
+        message_log.ensure_saved(first.id)
+        self.assertEqual(set(Message.objects.values_list('id', flat=True)), {first.id, second.id})
+        self.assertFalse(message_log.is_pending(first.id))
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_recover_skips_saved_records_and_reassigns_conflicting_ids(self, _start):
+        Message.objects.create(id=1, content='已寫入', response='', user=self.user)
+        Message.objects.create(id=2, content='其他內容', response='', user=self.user)
+        self.write_spool('messages-999999999.jsonl.1.flushing',
+                         [self.record(1, '已寫入'), self.record(2, '遺留'), self.record(3, '新的')])
+        message_log = self.make_log()
+        message_log.recover()
+        self.assertEqual(Message.objects.filter(content='已寫入').count(), 1)
+        self.assertTrue(Message.objects.filter(id=3, content='新的').exists())
+        relocated = Message.objects.get(content='遺留')
+        self.assertNotEqual(relocated.id, 2)
+        self.assertEqual(Message.objects.get(id=2).content, '其他內容')
+        self.assertEqual(message_log.stats['recovered'], 2)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_recovers_spool_of_earlier_process_with_same_pid(self, _start):
+        # 容器重啟後 PID 重複：先前行程的 spool 檔不會被新行程當成自己的檔案
+        name = f"messages-{os.getpid()}-deadbeef.jsonl"
+        self.write_spool(name, [self.record(7, '重啟前')])
+        message_log = self.make_log()
+        self.assertNotEqual(os.path.basename(message_log.spool_path), name)
+        self.log_message(message_log, '重啟後')
+        message_log.recover()
+        self.assertTrue(Message.objects.filter(id=7, content='重啟前').exists())
+        message_log.flush()
+        self.assertEqual(set(Message.objects.values_list('content', flat=True)), {'重啟前', '重啟後'})
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_ensure_saved_waits_for_message_buffered_by_another_worker(self, _start):
+        message_log = self.make_log()
+        message_id = IdGenerator(9).next_id()
+
+        def other_worker_flushes(seconds):
+            Message.objects.create(id=message_id, content='其他 worker', response='', user=self.user)
+
+        with mock.patch('botapp.message_log.time.sleep', side_effect=other_worker_flushes) as sleep:
+            message_log.ensure_saved(message_id)
+        self.assertEqual(sleep.call_count, 1)
+        self.assertTrue(Message.objects.filter(id=message_id).exists())
+
+    def test_ensure_saved_does_not_wait_for_old_unknown_id(self, _start):
+        with mock.patch('botapp.message_log.time.sleep') as sleep:
+            self.make_log().ensure_saved(12345)
+        sleep.assert_not_called()
+
+    def test_recover_skips_files_claimed_by_live_process(self, _start):
+        name = f"messages-999999999.jsonl.recovering-{os.getppid()}"
+        self.write_spool(name, [self.record(5, '處理中')])
+        self.make_log().recover()
+        self.assertFalse(Message.objects.filter(id=5).exists())
+        self.assertEqual(os.listdir(self.spool_dir), [name])
+
+
+class FakeStreamEngine:
+    """以離線假聊天模型逐 token 回答的 QA 引擎替身"""
+
+    def __init__(self):
+        self.llm = FakeChatModel(first_token_latency=0, tokens_per_second=0)
+
+    async def astream(self, question, memory=None):
+        result = ""
+        async for chunk in self.llm.astream(question):
+            result += chunk.content
+            yield "token", chunk.content
+        yield "done", {"answer": result, "source": "", "sources": [], "path": "llm", "latency_ms": 0}
+
+    def summarize(self, summary, turns):
+        return summary
+
+
+class ChatStreamTests(TransactionTestCase):
+    def setUp(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        self.message_log = MessageLog(spool_dir)
+        for patcher in (
+            mock.patch.object(MessageLog, '_start'),
+            mock.patch.object(views, 'qa_engine', FakeStreamEngine()),
+            mock.patch.object(views, 'message_log', self.message_log),
+            # 模擬剛啟動、尚未租用 worker ID 的行程
+            mock.patch.multiple(ids, _generator=None, _generator_pid=None, _lease=None),
+            mock.patch.object(ids.WorkerLease, 'keep_alive'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def read_events(self, response):
+        body = ""
+        async for chunk in response.streaming_content:
+            body += chunk.decode() if isinstance(chunk, bytes) else chunk
+        events = []
+        for block in body.strip().split("\n\n"):
+            event, data = block.split("\n")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return events
+
+    async def test_streams_tokens_then_sources_and_logs_both_messages(self):
+        request = RequestFactory().post('/api/chat/stream/', data=json.dumps({'question': '婚假幾天'}),
+                                        content_type='application/json')
+        response = await views.chat_stream(request)
+        events = await self.read_events(response)
+
+        kinds = [kind for kind, _ in events]
+        self.assertEqual(kinds[-1], 'sources', events)
+        self.assertIn('token', kinds)
+        sources = events[-1][1]
+        self.assertEqual(sources['answer'], "".join(data['content'] for kind, data in events if kind == 'token'))
+        self.assertTrue(self.message_log.is_pending(sources['id']))
+        self.assertEqual(self.message_log.stats['logged'], 2)
+
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_acc='owner', user_psd='x')
+        self.other = User.objects.create(user_acc='other', user_psd='x')
+
+    def add_turns(self, conversation, count):
+        for index in range(count):
+            Message.objects.create(id=index + 1, content=f"問題{index}", response=f"回答{index}",
+                                   user=self.user, conversation=conversation)
+
+    def test_new_conversation_is_not_written(self):
+        conversation = resolve_conversation(None, self.user.id)
+        self.assertFalse(Conversation.objects.exists())
+        self.assertEqual(load_memory(conversation), {'summary': '', 'turns': []})
+
+    def test_flush_creates_conversation_with_first_messages(self):
+        conversation = resolve_conversation(None, self.user.id)
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        with mock.patch.object(MessageLog, '_start'):
+            message_log = MessageLog(spool_dir)
+            message_log.log(id=1, content='問題', response='回答', user_id=self.user.id,
+                            conversation_id=conversation.id)
+            message_log.flush()
+        self.assertEqual(Conversation.objects.get(id=conversation.id).user_id, self.user.id)
+
+    def test_rejects_unknown_or_forged_conversation_id(self):
+        with self.assertRaises(ConversationNotFound):
+            resolve_conversation('chosen-by-client', self.user.id)
+        # 伺服器發出、尚未寫入資料庫的 ID 可以使用
+        issued = issue_conversation_id()
+        self.assertEqual(resolve_conversation(issued, self.user.id).id, issued)
+        with self.assertRaises(ConversationNotFound):
+            resolve_conversation(issued[:-1] + ('0' if issued[-1] != '0' else '1'), self.user.id)
+
+    def test_rejects_conversation_of_another_user(self):
+        conversation = Conversation.objects.create(user=self.user)
+        self.assertEqual(resolve_conversation(conversation.id, self.user.id).id, conversation.id)
+        for user_id in (self.other.id, None):
+            with self.assertRaises(ConversationNotFound):
+                resolve_conversation(conversation.id, user_id)
+
+    def test_load_memory_reads_stored_summary_without_llm(self):
+        conversation = Conversation.objects.create(user=self.user, summary='先前的摘要')
+        self.add_turns(conversation, DEFAULT_WINDOW_TURNS + SUMMARY_BATCH_TURNS + 2)
+        memory = load_memory(conversation)
+        self.assertEqual(memory['summary'], '先前的摘要')
+        self.assertEqual(len(memory['turns']), DEFAULT_WINDOW_TURNS + SUMMARY_BATCH_TURNS)
+
+    def test_summarizes_only_after_a_batch_of_turns(self):
+        conversation = Conversation.objects.create(user=self.user)
+        summarize = mock.Mock(return_value='摘要')
+        self.add_turns(conversation, DEFAULT_WINDOW_TURNS + SUMMARY_BATCH_TURNS - 1)
+        self.assertFalse(summarize_conversation(conversation.id, summarize))
+        summarize.assert_not_called()
+
+        Message.objects.create(id=100, content='再問', response='再答', user=self.user, conversation=conversation)
+        self.assertTrue(summarize_conversation(conversation.id, summarize))
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.summary, '摘要')
+        self.assertEqual(len(summarize.call_args[0][1]), SUMMARY_BATCH_TURNS)
+        self.assertEqual(len(load_memory(conversation)['turns']), DEFAULT_WINDOW_TURNS)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(user_acc='pager', user_psd='x')
+        created_at = timezone.now()
+        # 前兩筆 created_at 相同，需以 id 決定順序
+        for message_id in range(1, 8):
+            Message.objects.create(id=message_id, content=str(message_id), response='', user=self.user,
+                                   created_at=created_at + timedelta(seconds=max(message_id, 2)))
+
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+
+    def test_pages_cover_all_rows_newest_first(self):
+        seen, cursor = [], None
+        while True:
+            page = list(keyset_page(Message.objects.all(), cursor, limit=3))
+            seen += [message.id for message in page[:3]]
+            if len(page) <= 3:
+                break
+            cursor = encode_cursor(page[2].created_at, page[2].id)
+        self.assertEqual(seen, [7, 6, 5, 4, 3, 2, 1])
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-base64!', encode_cursor(timezone.now(), 1)[:-4], 'eA'):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_list_rejects_bad_cursor_and_user(self):
+        for query in ('cursor=eA', 'user=abc'):
+            response = self.client.get(f'/api/questions/?{query}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_list_streams_next_cursor(self):
+        response = self.client.get(f'/api/questions/?user={self.user.id}&limit=5')
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([message['id'] for message in data['messages']], [7, 6, 5, 4, 3])
+        response = self.client.get(f"/api/questions/?limit=5&cursor={data['next_cursor']}")
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([message['id'] for message in data['messages']], [2, 1])
+        self.assertIsNone(data['next_cursor'])
+
+
+class UserExistsTests(TestCase):
+    def setUp(self):
+        views._known_users.clear()
+
+    def test_missing_user_is_not_cached(self):
+        self.assertFalse(views.user_exists(12345))
+        User.objects.create(id=12345, user_acc='late', user_psd='x')
+        self.assertTrue(views.user_exists(12345))
+
+    def test_known_user_is_rechecked_after_ttl(self):
+        user_id = User.objects.create(user_acc='gone', user_psd='x').id
+        self.assertTrue(views.user_exists(user_id))
+        User.objects.filter(id=user_id).delete()
+        self.assertTrue(views.user_exists(user_id))
+        with mock.patch('botbackend.views.time.monotonic', return_value=time.monotonic() + views.USER_CACHE_SECONDS):
+            self.assertFalse(views.user_exists(user_id))
@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+The streaming chat endpoint (/api/chat/stream/) is an async view and needs
+an ASGI server to hold many concurrent streams in one process, e.g.:
+
+    uvicorn botbackend.asgi:application --workers 2
 """
 
 import os
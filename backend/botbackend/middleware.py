@@ -1,17 +1,36 @@
 # middleware.py
 import json
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import JsonResponse
 
 class ErrorHandlingMiddleware:
+    # 同時支援同步與非同步，ASGI 下的非同步 view 不必被轉到執行緒中執行
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         try:
             response = self.get_response(request)
             return response
         except Exception as e:
-            return JsonResponse({
-                'status': 'error',
-                'message': str(e)
-            }, status=500)
\ No newline at end of file
+            return self.error_response(e)
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+            return response
+        except Exception as e:
+            return self.error_response(e)
+
+    def error_response(self, e):
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
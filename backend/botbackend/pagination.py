@@ -0,0 +1,71 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    """將最後一筆的 (created_at, id) 編成不透明的游標字串"""
+    raw = f"{created_at.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, pk = raw.rsplit('|', 1)
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError(created_at)
+        return created_at, int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"無效的游標: {cursor}") from e
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value) if value else default
+    except ValueError:
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """以 (created_at, id) 由新到舊做 keyset 分頁
+
+    不使用 OFFSET：每一頁都從游標位置沿 (created_at, id) 索引往下讀 limit + 1 筆，
+    無論翻到第幾頁成本都相同；多讀的一筆只用來判斷是否還有下一頁。
+    """
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    return queryset.order_by('-created_at', '-id')[:limit + 1]
+
+
+def stream_page(rows, limit, serialize, key='messages'):
+    """逐筆序列化並串流輸出 {"<key>": [...], "next_cursor": ...}
+
+    rows 為 queryset 的 iterator()，資料不會一次全部載入記憶體。
+    """
+    def generate():
+        yield f'{{"{key}": ['
+        last = None
+        for count, row in enumerate(rows):
+            if count == limit:
+                # 第 limit + 1 筆存在，代表還有下一頁
+                yield f'], "next_cursor": {json.dumps(encode_cursor(last.created_at, last.id))}}}'
+                return
+            yield (',' if count else '') + json.dumps(serialize(row), ensure_ascii=False)
+            last = row
+        yield '], "next_cursor": null}'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
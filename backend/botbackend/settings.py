@@ -39,6 +39,35 @@ VECTOR_STORE_DIR = os.path.join(BASE_DIR, 'vector_store')
 os.makedirs(DOCUMENTS_DIR, exist_ok=True)
 os.makedirs(CHROMA_DB_DIR, exist_ok=True)
 
+# 向量索引後端：chroma、faiss-flat、faiss-hnsw、faiss-ivfpq
+# （可用 manage.py benchmark_vectors 依語料規模比較後選擇）
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'chroma')
+# 後端參數，如 {'ef_search': 64}（HNSW）或 {'nlist': 1024, 'nprobe': 16}（IVF-PQ）
+VECTOR_BACKEND_OPTIONS = {}
+
+# 嵌入與 LLM：openai，或 fake（離線的雜湊嵌入與假聊天模型，用於負載測試，見 manage.py benchmark_qa）
+QA_MODELS = os.getenv('QA_MODELS', 'openai')
+
+# QA 路徑的快取（查詢嵌入、檢索結果、答案，依索引版本分開）：memory（各 worker 各自一份）、
+# sqlite（同一台主機的 worker 共用檔案）、redis（跨主機共用）；多 worker 部署時使用 sqlite 或 redis
+QA_CACHE_BACKEND = os.getenv('QA_CACHE_BACKEND', 'memory')
+# 後端參數，如 {'path': '/dev/shm/qa_cache.sqlite3'}（sqlite，預設讀取 QA_CACHE_PATH）
+# 或 {'url': 'redis://localhost:6379/1'}（redis，預設讀取 REDIS_URL）
+QA_CACHE_OPTIONS = {}
+
+# 啟動時預先初始化 QA 系統（部署伺服器時設為 True，否則於第一次請求時才初始化）
+QA_ENGINE_WARMUP = os.getenv('QA_ENGINE_WARMUP', 'False').lower() in ('1', 'true', 'yes')
+
+# 對話記錄採 write-behind：先附加寫入本機 spool 檔，再由背景執行緒以 bulk_create 批次寫入資料庫
+MESSAGE_SPOOL_DIR = os.path.join(BASE_DIR, 'message_spool')
+MESSAGE_LOG_BATCH_SIZE = int(os.getenv('MESSAGE_LOG_BATCH_SIZE', '100'))
+MESSAGE_LOG_FLUSH_INTERVAL = float(os.getenv('MESSAGE_LOG_FLUSH_INTERVAL', '1.0'))  # 秒
+# 每筆記錄都 fsync（可承受主機斷電，但較慢）；預設只保證行程當掉時不遺失
+MESSAGE_SPOOL_FSYNC = os.getenv('MESSAGE_SPOOL_FSYNC', 'False').lower() in ('1', 'true', 'yes')
+# 訊息 ID 產生器的 worker 編號（0-31）由各行程在資料庫租用（botapp.models.WorkerLease），
+# 超過此秒數未續約的租約可由其他行程接手
+MESSAGE_WORKER_LEASE_SECONDS = int(os.getenv('MESSAGE_WORKER_LEASE_SECONDS', '60'))
+
 # Application definition
 
 INSTALLED_APPS = [
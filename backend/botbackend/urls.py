@@ -4,10 +4,14 @@ from django.shortcuts import redirect
 from .views import (
     login_user, 
     feedback, 
+    feedback_stats,
     QuestionResponseViewSet, 
     UserFeedbackViewSet,
     create_message,
     chat_response,
+    chat_stream,
+    health_check,
+    metrics,
 )
 from django.contrib import admin
 
@@ -22,8 +26,13 @@ urlpatterns = [
         path('login/', login_user, name='login'),
         path('create_message/', create_message, name='create_message'),
         path('feedback/', feedback, name='feedback'),
+        path('feedback/stats/', feedback_stats, name='feedback_stats'),
         path('chat/', chat_response, name='chat_response'),
+        path('chat/stream/', chat_stream, name='chat_stream'),
+        path('health/', health_check, name='health_check'),
     ])),
+    # Prometheus 預設抓取 /metrics
+    path('metrics', metrics, name='metrics'),
     # 將根路徑重定向到 api/chat/
     path('', lambda request: redirect('api/chat/')),
 ]
\ No newline at end of file
@@ -1,82 +1,79 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
 from botapp.models import User, Feedback, Message
 from botapp.serializers import UserSerializer, FeedbackSerializer
+from botapp.message_log import message_log
+from botapp.conversations import ConversationNotFound, load_memory, resolve_conversation, summarize_later
+from botapp.feedback_stats import GROUP_FIELDS, feedback_summary, record_feedback
 import json
-import os
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain_openai import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
+import time
+from asgiref.sync import sync_to_async
 from dotenv import load_dotenv
 from django.conf import settings
-from langchain.prompts import PromptTemplate
-from rag.qa_system import init_qa_system
-from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
+from django.utils.dateparse import parse_date
+from rag.engine import QAEngine
+from rag.tracing import render_metrics, span, trace
+from botbackend.pagination import InvalidCursor, keyset_page, parse_page_size, stream_page
 
 # 加載環境變量
 load_dotenv()
 
-# 獲取 OpenAI API 金鑰
-openai_api_key = os.getenv("OPENAI_API_KEY")
-vector_store_path = os.path.join(settings.BASE_DIR, "vector_store")
-
-# 初始化 QA 系統
-qa_chain = init_qa_system(docs_dir=os.path.join(settings.BASE_DIR, 'documents'))
-def init_qa_system():
-    global qa_chain
-    if qa_chain is not None:
-        return qa_chain
-        
-    try:
-        embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-        if os.path.exists(vector_store_path):
-            print("載入現有的向量資料庫...")
-            vector_store = FAISS.load_local(vector_store_path, embeddings, allow_dangerous_deserialization=True)
-            
-            # 初始化 QA chain，加入長度限制
-            llm = ChatOpenAI(
-                temperature=0, 
-                model_name="gpt-3.5-turbo",
-                max_tokens=4000  # 限制輸出長度
-            )
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=vector_store.as_retriever(
-                    search_kwargs={
-                        "k": 2,  # 減少檢索的文檔數量
-                        "fetch_k": 4  # 減少檢索的候選文檔數量
-                    }
-                ),
-                return_source_documents=True,
-                chain_type_kwargs={
-                    "prompt": PromptTemplate(
-                        template="""基於以下資訊回答問題。如果無法從資訊中找到答案，請說明無法回答。
+# QA 系統於第一次請求時才初始化（或由 BotappConfig.ready 預熱）
+qa_engine = QAEngine.configure(
+    docs_dir=settings.DOCUMENTS_DIR,
+    vector_backend=settings.VECTOR_BACKEND,
+    backend_options=settings.VECTOR_BACKEND_OPTIONS,
+    models=settings.QA_MODELS,
+    cache_backend=settings.QA_CACHE_BACKEND,
+    cache_options=settings.QA_CACHE_OPTIONS,
+)
 
-資訊:
-{context}
+# 只快取確認存在的使用者（user_id -> 確認時間），不存在的結果不快取，之後建立的帳號立即可用；
+# 快取逾時後重新確認，刪除的帳號最多延遲 USER_CACHE_SECONDS 秒才失效
+USER_CACHE_SECONDS = 60
+USER_CACHE_SIZE = 4096
+_known_users = {}
 
-問題: {question}
+def user_exists(user_id):
+    checked_at = _known_users.get(user_id)
+    if checked_at is not None and time.monotonic() - checked_at < USER_CACHE_SECONDS:
+        return True
+    exists = User.objects.filter(id=user_id).exists()
+    if exists:
+        if len(_known_users) >= USER_CACHE_SIZE:
+            _known_users.clear()
+        _known_users[user_id] = time.monotonic()
+    else:
+        _known_users.pop(user_id, None)
+    return exists
 
-回答:""",
-                        input_variables=["context", "question"]
-                    )
-                }
-            )
-            print("QA 系統初始化成功")
-            return qa_chain
-        else:
-            print("向量資料庫不存在，需要重新生成。")
-            return None
-    except Exception as e:
-        print(f"初始化 QA 系統時發生錯誤: {str(e)}")
-        return None
-
-# 初始化 QA 系統
-qa_chain = init_qa_system()
+def message_owner(data):
+    """從請求取出對話歸屬（user_id、conversation_id），無效的 user_id 視為未登入"""
+    user_id = data.get('user_id')
+    try:
+        user_id = int(user_id) if user_id is not None else None
+    except (TypeError, ValueError):
+        user_id = None
+    if user_id is not None and not user_exists(user_id):
+        user_id = None
+    conversation_id = data.get('conversation_id')
+    return {
+        'user_id': user_id,
+        'conversation_id': str(conversation_id)[:64] if conversation_id else None,
+    }
+
+def open_conversation(data):
+    """取得對話（未提供 conversation_id 時開啟新對話）並讀取對話記憶，回傳 (owner, memory)"""
+    owner = message_owner(data)
+    conversation = resolve_conversation(owner['conversation_id'], owner['user_id'])
+    owner['conversation_id'] = conversation.id
+    return owner, load_memory(conversation)
+
+def conversation_not_found():
+    return JsonResponse({"status": "error", "message": "對話不存在"}, status=404)
 
 @csrf_exempt
 def chat_response(request):
@@ -88,46 +85,50 @@ def chat_response(request):
             if not question:
                 return JsonResponse({"status": "error", "message": "請提供問題"}, status=400)
                 
-            if qa_chain is None:
+            try:
+                qa_engine.get_chain()
+            except Exception as e:
+                print(f"QA 系統初始化失敗: {str(e)}")
                 return JsonResponse({"status": "error", "message": "QA 系統未正確初始化"}, status=500)
                 
-            # 使用 QA chain 獲取答案
+            # 使用 QA 系統獲取答案（含參考來源，可能由條款查詢或答案快取直接回答）
             try:
-                result = qa_chain.invoke({"query": question})
-                answer = result.get("result", "")
-                source_docs = result.get("source_documents", [])
-                
-                # Get source string
-                from rag.qa_system import get_source_string
-                source_string = get_source_string(source_docs)
-                
-                # Add source to answer
-                if source_string:
-                    if not answer.endswith('\n'):
-                        answer += '\n'
-                    answer += f"參考來源：{source_string}"
-                
-                # 儲存用戶問題
-                user_message = Message.objects.create(
-                    content=question,
-                    is_bot_response=False
-                )
-                
-                # 儲存機器人回答
-                bot_message = Message.objects.create(
-                    content=answer,
-                    is_bot_response=True
-                )
-                
+                with trace("chat"):
+                    with span("memory"):
+                        owner, memory = open_conversation(data)
+                    result = qa_engine.answer(question, memory)
+                    answer = result["answer"]
+
+                    # 儲存用戶問題與機器人回答（write-behind：ID 立即可用，稍後批次寫入資料庫）
+                    with span("db_write"):
+                        user_message = message_log.log(
+                            content=question,
+                            is_bot_response=False,
+                            **owner
+                        )
+                        bot_message = message_log.log(
+                            content=answer,
+                            is_bot_response=True,
+                            source_documents=result["sources"],
+                            answer_path=result["path"],
+                            latency_ms=result["latency_ms"],
+                            **owner
+                        )
+                summarize_later(owner["conversation_id"], memory, qa_engine.summarize)
+
                 return JsonResponse({
                     "status": "success",
                     "data": {
                         "id": bot_message.id,  # 返回機器人回答的ID
                         "question": question,
                         "answer": answer,
+                        "path": result["path"],
+                        "conversation_id": owner["conversation_id"],
                         "created_at": bot_message.created_at.isoformat()
                     }
                 })
+            except ConversationNotFound:
+                return conversation_not_found()
             except Exception as e:
                 print(f"QA chain 錯誤: {str(e)}")  # 添加錯誤日誌
                 return JsonResponse({
@@ -151,6 +152,83 @@ def chat_response(request):
         "status": "error",
         "message": "只支援 POST 方法"
     }, status=405)
+def sse_event(event, data):
+    """組成一筆 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@csrf_exempt
+async def chat_stream(request):
+    """以 Server-Sent Events 逐 token 回傳答案（需經由 ASGI 伺服器提供服務）"""
+    if request.method != 'POST':
+        return JsonResponse({
+            "status": "error",
+            "message": "只支援 POST 方法"
+        }, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            "status": "error",
+            "message": "無效的 JSON 格式"
+        }, status=400)
+
+    question = data.get('question')
+    if not question:
+        return JsonResponse({"status": "error", "message": "請提供問題"}, status=400)
+
+    async def event_stream():
+        result = None
+        with trace("chat_stream") as current:
+            try:
+                with span("memory"):
+                    owner, memory = await sync_to_async(open_conversation)(data)
+                async for kind, payload in qa_engine.astream(question, memory):
+                    if kind == "token":
+                        yield sse_event("token", {"content": payload})
+                    else:
+                        result = payload
+                answer = result["answer"]
+
+                # 串流結束後才寫入對話記錄（write-behind，不等待資料庫）；
+                # 產生訊息 ID 可能需要租用或續約 worker ID（存取資料庫），因此在執行緒中呼叫
+                with span("db_write"):
+                    await sync_to_async(message_log.log)(
+                        content=question,
+                        is_bot_response=False,
+                        **owner
+                    )
+                    bot_message = await sync_to_async(message_log.log)(
+                        content=answer,
+                        is_bot_response=True,
+                        source_documents=result["sources"],
+                        answer_path=result["path"],
+                        latency_ms=result["latency_ms"],
+                        **owner
+                    )
+                summarize_later(owner["conversation_id"], memory, qa_engine.summarize)
+
+                yield sse_event("sources", {
+                    "id": bot_message.id,
+                    "source": result["source"],
+                    "answer": answer,
+                    "path": result["path"],
+                    "conversation_id": owner["conversation_id"],
+                    "created_at": bot_message.created_at.isoformat()
+                })
+            except ConversationNotFound:
+                yield sse_event("error", {"message": "對話不存在"})
+            except Exception as e:
+                current.attrs['error'] = str(e)
+                print(f"串流回答錯誤: {str(e)}")
+                yield sse_event("error", {"message": f"處理問題時發生錯誤: {str(e)}"})
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # 避免反向代理（如 nginx）緩衝串流內容
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @csrf_exempt
 def login_user(request):
     if request.method == 'POST':
@@ -160,7 +238,7 @@ def login_user(request):
             user_psd = data.get('user_psd')
             user = User.objects.filter(user_acc=user_acc, user_psd=user_psd).first()
             if user:
-                return JsonResponse({'status': 'success', 'message': 'Login successful'}, status=200)
+                return JsonResponse({'status': 'success', 'message': 'Login successful', 'user_id': user.id}, status=200)
             else:
                 return JsonResponse({'status': 'error', 'message': 'Invalid credentials'}, status=401)
         except Exception as e:
@@ -198,14 +276,19 @@ def feedback(request):
             if not message_id or not feedback_type:
                 return JsonResponse({"status": "error", "message": "缺少必要欄位"}, status=400)
             
+            # 訊息可能還在 write-behind 緩衝中，先寫入資料庫
+            message_log.ensure_saved(message_id)
             message = Message.objects.filter(id=message_id).first()
             if not message:
                 return JsonResponse({"status": "error", "message": "訊息不存在"}, status=404)
             
-            feedback = Feedback.objects.create(
-                message=message,
-                feedback_type=feedback_type
-            )
+            # 回饋與當日彙總一起寫入
+            with transaction.atomic():
+                feedback = Feedback.objects.create(
+                    message=message,
+                    feedback_type=feedback_type
+                )
+                record_feedback(feedback)
             
             return JsonResponse({
                 "status": "success",
@@ -241,15 +324,29 @@ def save_message(request):
 
 class QuestionResponseViewSet(ViewSet):
     def list(self, request):
-        # 獲取歷史對話記錄
-        messages = Message.objects.all().order_by('-created_at')
-        return Response({
-            "messages": [{
-                "id": msg.id,
-                "content": msg.content,
-                "response": msg.response,
-                "created_at": msg.created_at.isoformat()
-            } for msg in messages]
+        # 獲取歷史對話記錄：以 cursor 分頁（由新到舊），可依 user、conversation_id 篩選
+        messages = Message.objects.only('id', 'content', 'response', 'created_at')
+        user_id = request.query_params.get('user')
+        if user_id:
+            try:
+                messages = messages.filter(user_id=int(user_id))
+            except ValueError:
+                return Response({"error": f"無效的使用者: {user_id}"}, status=400)
+        conversation_id = request.query_params.get('conversation_id')
+        if conversation_id:
+            messages = messages.filter(conversation_id=conversation_id)
+
+        limit = parse_page_size(request.query_params.get('limit'))
+        try:
+            page = keyset_page(messages, request.query_params.get('cursor'), limit)
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=400)
+
+        return stream_page(page.iterator(chunk_size=100), limit, lambda msg: {
+            "id": msg.id,
+            "content": msg.content,
+            "response": msg.response,
+            "created_at": msg.created_at.isoformat()
         })
 
     def create(self, request):
@@ -258,48 +355,75 @@ class QuestionResponseViewSet(ViewSet):
             if not question:
                 return Response({"error": "請提供問題"}, status=400)
                 
-            # 使用 QA chain 獲取答案
-            result = qa_chain({"query": question})
-            answer = result.get("result", "")
-            source_docs = result.get("source_documents", [])
-            
-            # Get source string
-            from rag.qa_system import get_source_string
-            source_string = get_source_string(source_docs)
-            
-            # Add source to answer
-            if source_string:
-                if not answer.endswith('\n'):
-                    answer += '\n'
-                answer += f"參考來源：{source_string}"
-            
-            # 儲存對話記錄
-            message = Message.objects.create(
-                content=question,
-                response=answer
-            )
+            # 使用 QA 系統獲取答案（含參考來源，可能由條款查詢或答案快取直接回答）
+            with trace("questions"):
+                with span("memory"):
+                    owner, memory = open_conversation(request.data)
+                result = qa_engine.answer(question, memory)
+                answer = result["answer"]
+
+                # 儲存對話記錄（write-behind）
+                with span("db_write"):
+                    message = message_log.log(
+                        content=question,
+                        response=answer,
+                        source_documents=result["sources"],
+                        **owner,
+                        answer_path=result["path"],
+                        latency_ms=result["latency_ms"]
+                    )
+            summarize_later(owner["conversation_id"], memory, qa_engine.summarize)
             
             return Response({
                 "id": message.id,
                 "question": question,
                 "answer": answer,
+                "conversation_id": owner["conversation_id"],
                 "created_at": message.created_at.isoformat()
             })
             
+        except ConversationNotFound:
+            return Response({"error": "對話不存在"}, status=404)
         except Exception as e:
             return Response({"error": str(e)}, status=500)
 
 
+@csrf_exempt
+def feedback_stats(request):
+    """讚／倒讚統計，只讀取每日彙總表
+
+    參數：start、end（YYYY-MM-DD，含當日）與 group_by（day、path 或 source，預設 day）
+    """
+    if request.method != 'GET':
+        return JsonResponse({"status": "error", "message": "只支援 GET 方法"}, status=405)
+
+    group_by = request.GET.get('group_by', 'day')
+    if group_by not in GROUP_FIELDS:
+        return JsonResponse({"status": "error", "message": f"group_by 需為 {'、'.join(GROUP_FIELDS)}"}, status=400)
+    dates = {}
+    for name in ('start', 'end'):
+        value = request.GET.get(name)
+        try:
+            dates[name] = parse_date(value) if value else None
+        except ValueError:
+            dates[name] = None
+        if value and dates[name] is None:
+            return JsonResponse({"status": "error", "message": f"無效的日期: {value}"}, status=400)
+
+    return JsonResponse({"status": "success", "data": feedback_summary(group_by=group_by, **dates)})
+
 class UserFeedbackViewSet(ViewSet):
     def list(self, request):
-        feedbacks = Feedback.objects.all()
+        feedbacks = Feedback.objects.select_related('message')
         serializer = FeedbackSerializer(feedbacks, many=True)
         return Response(serializer.data)
 
     def create(self, request):
+        message_log.ensure_saved(request.data.get('message'))
         serializer = FeedbackSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                record_feedback(serializer.save())
             return Response({"message": "反饋已成功儲存", "data": serializer.data})
         return Response({"message": "反饋儲存失敗", "errors": serializer.errors}, status=400)
 
@@ -307,5 +431,14 @@ class UserFeedbackViewSet(ViewSet):
 def health_check(request):
     return JsonResponse({
         'status': 'ok',
-        'qa_system': 'initialized' if qa_chain else 'not initialized'
+        'qa_system': 'initialized' if qa_engine.is_ready else 'not initialized',
+        'index_version': qa_engine.index_version,
+        'answer_cache': qa_engine.answer_cache.stats() if qa_engine.answer_cache is not None else None,
+        'qa_cache': qa_engine.cache.stats() if qa_engine.cache is not None else None,
+        'answer_paths': qa_engine.path_stats(),
+        'message_log': message_log.stats
     })
+
+def metrics(request):
+    """Prometheus 抓取端點：各階段與整個請求的耗時直方圖、token 數"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
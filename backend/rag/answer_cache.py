@@ -0,0 +1,202 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from rag.cache_backends import MemoryCache
+from rag.query import normalize_query
+
+DEFAULT_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+DEFAULT_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+# 近似問題必須相同的關鍵詞：數字與條款編號、假別（產假、婚假）、費用與獎金名稱（加班費）
+KEY_TERM_PATTERN = re.compile(r'\d+(?:\.\d+)*|[\u4e00-\u9fff]假|[\u4e00-\u9fff]{2}(?:費|金|津貼)')
+
+
+def normalize_question(question):
+    """完全比對的鍵：正規化後的查詢（見 rag.query.normalize_query）再移除所有空白"""
+    return re.sub(r'\s+', '', normalize_query(question))
+
+
+def key_terms(key):
+    """正規化問題中的關鍵詞；「產假幾天」與「婚假幾天」的嵌入很接近，但關鍵詞不同"""
+    return frozenset(KEY_TERM_PATTERN.findall(key))
+
+
+class AnswerCache:
+    """問答結果的兩層快取
+
+    第一層以正規化後的問題完全比對；第二層以問題嵌入的 cosine 相似度
+    比對近似問題（高於 similarity_threshold，且關鍵詞 key_terms 完全相同才算命中）。
+    答案存在 QA 快取（rag.cache_backends）的 answer:<索引版本> namespace，使用 sqlite、redis 後端時
+    各 worker 共用，並由後端處理 TTL 與 LRU 上限；索引版本變更時改用新的 namespace 並刪除舊版本。
+    第二層的問題向量矩陣留在行程內，包含本行程寫入與第一層命中過的問題。
+    """
+
+    def __init__(self, embeddings=None, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+                 ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, cache=None):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache = cache if cache is not None else MemoryCache()
+        self.index_version = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._namespace = None
+        # 第二層：問題 -> 在向量矩陣中的列（LRU）；矩陣預先配置並加倍擴充，
+        # 淘汰的列放回 _free_rows 重複使用，_matrix_keys、_matrix_terms 記錄各列的問題與關鍵詞（空列為 None）
+        self._vectors = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._matrix_terms = []
+        self._free_rows = []
+        self._lock = threading.Lock()
+
+    def _check_version(self, index_version):
+        """回傳目前版本的 namespace；版本變更時清空第二層並刪除舊版本的答案"""
+        with self._lock:
+            if self._namespace is not None and index_version == self.index_version:
+                return self._namespace
+            name = f"answer:{index_version}"
+            self._namespace = self.cache.namespace(name, self.max_entries, self.ttl)
+            self._reset_matrix()
+            self.index_version = index_version
+            namespace = self._namespace
+        self.cache.drop_namespaces("answer", keep=name)
+        return namespace
+
+    def _remember(self, key, embedding):
+        """將問題向量加入第二層，直接寫入矩陣的一列"""
+        if embedding is None:
+            return
+        with self._lock:
+            row = self._vectors.get(key)
+            if row is None:
+                while self._vectors and len(self._vectors) >= self.max_entries:
+                    self._release(self._vectors.popitem(last=False)[1])
+                row = self._allocate_row(len(embedding))
+                self._vectors[key] = row
+                self._matrix_keys[row] = key
+                self._matrix_terms[row] = key_terms(key)
+            else:
+                self._vectors.move_to_end(key)
+            self._matrix[row] = embedding
+
+    def _forget(self, key):
+        with self._lock:
+            row = self._vectors.pop(key, None)
+            if row is not None:
+                self._release(row)
+
+    def _allocate_row(self, dim):
+        if self._free_rows:
+            return self._free_rows.pop()
+        if self._matrix is None or self._matrix.shape[1] != dim:
+            self._reset_matrix()
+            self._matrix = np.empty((min(16, max(self.max_entries, 1)), dim), dtype=np.float32)
+        row = len(self._matrix_keys)
+        if row == self._matrix.shape[0]:
+            # 容量加倍（不超過 max_entries），避免每次加入都複製整個矩陣
+            grown = np.empty((min(row * 2, max(self.max_entries, row + 1)), dim), dtype=np.float32)
+            grown[:row] = self._matrix
+            self._matrix = grown
+        self._matrix_keys.append(None)
+        self._matrix_terms.append(None)
+        return row
+
+    def _release(self, row):
+        self._matrix_keys[row] = None
+        self._matrix_terms[row] = None
+        self._free_rows.append(row)
+
+    def _reset_matrix(self):
+        self._vectors.clear()
+        self._matrix, self._matrix_keys, self._matrix_terms, self._free_rows = None, [], [], []
+
+    def _embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _hit(self, level):
+        with self._lock:
+            if level == 'exact':
+                self.exact_hits += 1
+            elif level == 'semantic':
+                self.semantic_hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, question, index_version):
+        """查詢快取，命中時回傳 (結果, 層級)，否則回傳 (None, None)"""
+        if self.max_entries <= 0:
+            self._hit(None)
+            return None, None
+        namespace = self._check_version(index_version)
+        key = normalize_question(question)
+        entry = namespace.get(key)
+        if entry is not None:
+            # 其他 worker 寫入的問題也加入本行程的第二層
+            if key not in self._vectors:
+                self._remember(key, entry['embedding'])
+            self._hit('exact')
+            return entry['result'], 'exact'
+
+        # 只與關鍵詞相同的問題比對相似度，沒有候選時也不必嵌入問題
+        terms = key_terms(key)
+        with self._lock:
+            has_candidates = bool(self._candidates(terms))
+        if self.embeddings is not None and has_candidates:
+            vector = self._embed(question)
+            # 矩陣的列會被就地改寫，在鎖內重新取候選並計算分數
+            with self._lock:
+                candidates = self._candidates(terms)
+                best_key, best_score = None, None
+                if candidates:
+                    scores = self._matrix[candidates] @ vector
+                    position = int(np.argmax(scores))
+                    best_key, best_score = self._matrix_keys[candidates[position]], scores[position]
+            if best_key is not None and best_score >= self.similarity_threshold:
+                entry = namespace.get(best_key)
+                if entry is not None:
+                    self._hit('semantic')
+                    return entry['result'], 'semantic'
+                # 已過期或被淘汰
+                self._forget(best_key)
+
+        self._hit(None)
+        return None, None
+
+    def _candidates(self, terms):
+        return [row for row, row_terms in enumerate(self._matrix_terms) if row_terms == terms]
+
+    def put(self, question, result, index_version):
+        if self.max_entries <= 0:
+            return
+        namespace = self._check_version(index_version)
+        key = normalize_question(question)
+        embedding = self._embed(question) if self.embeddings is not None else None
+        namespace.set(key, {'result': result, 'embedding': embedding})
+        self._remember(key, embedding)
+
+    def clear(self):
+        with self._lock:
+            namespace = self._namespace
+            self._reset_matrix()
+        if namespace is not None:
+            namespace.clear()
+
+    def stats(self):
+        total = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            'exact_hits': self.exact_hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': (self.exact_hits + self.semantic_hits) / total if total else 0.0,
+            'entries': self.cache.namespaces().get(f"answer:{self.index_version}", 0),
+            'backend': self.cache.name,
+        }
@@ -0,0 +1,258 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from rag.matrix_index import MatrixIndex, normalize_rows
+from rag.vector_backends import create_backend
+
+
+def synthetic_vectors(count, dim, clusters=64, seed=0):
+    """產生帶群聚結構的單位向量（比均勻亂數更接近真實嵌入的分佈）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = np.empty((count, dim), dtype=np.float32)
+    for start in range(0, count, 100000):
+        size = min(100000, count - start)
+        labels = rng.integers(0, clusters, size)
+        vectors[start:start + size] = centers[labels] + rng.normal(scale=0.8, size=(size, dim))
+    return normalize_rows(vectors)
+
+
+def sample_queries(vectors, count, seed=1):
+    """以資料向量加上雜訊作為查詢"""
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.integers(0, len(vectors), count)]
+    return normalize_rows(picks + rng.normal(scale=0.05, size=picks.shape).astype(np.float32))
+
+
+def exact_neighbors(vectors, queries, k, batch_size=32):
+    """以 MatrixIndex 計算精確的 top-k 作為 recall 基準（分批避免分數矩陣過大）"""
+    index = MatrixIndex(vectors)
+    results = []
+    for start in range(0, len(queries), batch_size):
+        indices, _ = index.search_batch(queries[start:start + batch_size], k)
+        results.extend(indices)
+    return np.asarray(results)
+
+
+def percentile_ms(seconds, q):
+    return float(np.percentile(np.asarray(seconds) * 1000, q))
+
+
+def benchmark_backend(name, vectors, queries, truth, k, options=None, add_batch_size=10000):
+    """建立、重新載入並查詢單一後端，回傳各項指標"""
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    try:
+        ids = [str(i) for i in range(len(vectors))]
+        start = time.perf_counter()
+        backend = create_backend(name, workdir, **(options or {}))
+        for offset in range(0, len(vectors), add_batch_size):
+            backend.add(ids[offset:offset + add_batch_size], vectors[offset:offset + add_batch_size])
+        backend.commit()
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        backend = create_backend(name, workdir, **(options or {}))
+        backend.search(queries[0], k)
+        load_seconds = time.perf_counter() - start
+
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            result = backend.search(query, k)
+            latencies.append(time.perf_counter() - start)
+            hits += len({int(chunk_id) for chunk_id, _ in result} & set(expected.tolist()))
+
+        return {
+            'backend': name,
+            'size': len(vectors),
+            'build_s': round(build_seconds, 3),
+            'load_s': round(load_seconds, 3),
+            'p50_ms': round(percentile_ms(latencies, 50), 3),
+            'p99_ms': round(percentile_ms(latencies, 99), 3),
+            'qps': round(len(latencies) / sum(latencies), 1),
+            f'recall@{k}': round(hits / (len(queries) * k), 4),
+            'index_mb': round(backend.nbytes / 1024 / 1024, 2),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_vector_benchmark(backends, sizes=(10000, 100000, 1000000), dim=256, k=10,
+                         num_queries=200, options=None, log=print):
+    """對每個規模與後端執行建立／載入／搜尋基準測試
+
+    options 為 {後端名稱: 參數}。recall 以精確搜尋的 top-k 為基準。
+    """
+    results = []
+    for size in sizes:
+        log(f"產生 {size} 筆 {dim} 維向量...")
+        vectors = synthetic_vectors(size, dim)
+        queries = sample_queries(vectors, num_queries)
+        truth = exact_neighbors(vectors, queries, k)
+        for name in backends:
+            log(f"  測試 {name} ...")
+            result = benchmark_backend(name, vectors, queries, truth, k, (options or {}).get(name))
+            log(f"    {result}")
+            results.append(result)
+    return results
+
+
+# 端到端基準測試使用的預設問題（--questions 可改用檔案，每行一題）
+DEFAULT_QUESTIONS = [
+    "事假一年可以請幾天？",
+    "病假的薪資怎麼計算？",
+    "婚假有幾天？",
+    "產假的規定是什麼？",
+    "特別休假如何計算？",
+    "喪假可以分次請嗎？",
+    "請假需要提前多久申請？",
+    "陪產假有幾天？",
+]
+
+
+def latency_summary(latencies, elapsed, errors=0):
+    """彙總一組請求的耗時：QPS 以整體經過時間計算（含並行）"""
+    summary = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'qps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+    if latencies:
+        summary.update(
+            p50_ms=round(percentile_ms(latencies, 50), 2),
+            p90_ms=round(percentile_ms(latencies, 90), 2),
+            p99_ms=round(percentile_ms(latencies, 99), 2),
+            max_ms=round(max(latencies) * 1000, 2),
+        )
+    return summary
+
+
+def run_concurrent(func, items, concurrency):
+    """以 concurrency 個執行緒依序處理 items，回傳 latency_summary；func 拋出例外視為錯誤"""
+    def timed(item):
+        start = time.perf_counter()
+        try:
+            func(item)
+        except Exception as e:
+            return None, str(e)
+        return time.perf_counter() - start, None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        results = list(pool.map(timed, items))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in results if latency is not None]
+    errors = [error for _, error in results if error is not None]
+    summary = latency_summary(latencies, elapsed, len(errors))
+    if errors:
+        summary['first_error'] = errors[0]
+    return dict(summary, concurrency=concurrency)
+
+
+def benchmark_ingestion(docs_dir, vector_backend, embeddings, index_dir, backend_options=None):
+    """從空索引匯入整個文件目錄，回傳 (IndexManager, 指標)"""
+    from rag.qa_system import build_index
+
+    start = time.perf_counter()
+    index = build_index(docs_dir, vector_backend, backend_options, embeddings=embeddings, index_dir=index_dir)
+    seconds = time.perf_counter() - start
+    docs = len(index.manifest['files'])
+    return index, {
+        'docs': docs,
+        'chunks': index.chunk_count,
+        'seconds': round(seconds, 3),
+        'docs_per_s': round(docs / seconds, 2) if seconds else 0.0,
+        'chunks_per_s': round(index.chunk_count / seconds, 1) if seconds else 0.0,
+    }
+
+
+def benchmark_retrieval(retriever, questions, num_queries=200, concurrency=4):
+    """以多個執行緒重複查詢檢索器（嵌入、向量／BM25 搜尋、父段落與 context 組合）"""
+    retriever.invoke(questions[0])
+    items = [questions[i % len(questions)] for i in range(num_queries)]
+    return run_concurrent(retriever.invoke, items, concurrency)
+
+
+def benchmark_http(post, questions, clients=8, requests_per_client=10):
+    """以 clients 個並行用戶端呼叫問答端點；post(問題) 在失敗時拋出例外"""
+    items = [questions[i % len(questions)] for i in range(clients * requests_per_client)]
+    return run_concurrent(post, items, clients)
+
+
+def compare_results(baseline, current, prefix=''):
+    """比較兩次結果的數值指標，回傳 [(指標, 基準, 目前, 變化百分比)]"""
+    rows = []
+    for key, value in current.items():
+        old = baseline.get(key) if isinstance(baseline, dict) else None
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            rows.extend(compare_results(old or {}, value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(old, (int, float)):
+            change = (value - old) / old * 100 if old else None
+            rows.append((name, old, value, round(change, 1) if change is not None else None))
+    return rows
+
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def chunking_label(config):
+    return (f"{config['strategy']} size={config['chunk_size']} overlap={config['chunk_overlap']} "
+            f"parent={config['parent_chunk_size']} sep={config['separators']}")
+
+
+def sweep_chunking(configs, docs_dir, vector_backend, embeddings, items, workdir, k=5, workers=4, log=print):
+    """以多組分割設定各自建立索引，比較 chunk 數、索引大小、建立時間、查詢延遲與 recall@k
+
+    各設定的索引以 workers 個執行緒並行建立，共用同一個 CachedEmbeddings，
+    不同設定切出相同文字的 chunk 只嵌入一次；查詢延遲在全部建立完成後依序量測，避免互相干擾。
+    items 為 rag.evaluation.load_questions 的標註問題。
+    """
+    from rag.evaluation import score_retrieval
+    from rag.qa_system import build_index, build_retriever
+
+    def build(args):
+        number, config = args
+        start = time.perf_counter()
+        index = build_index(docs_dir, vector_backend, embeddings=embeddings, chunking=config,
+                            index_dir=os.path.join(workdir, str(number)), verbose=False)
+        seconds = time.perf_counter() - start
+        log(f"  已建立 {chunking_label(config)}: {index.chunk_count} chunks, {seconds:.2f}s")
+        return index, seconds
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        built = list(pool.map(build, enumerate(configs)))
+
+    results = []
+    for number, (config, (index, seconds)) in enumerate(zip(configs, built)):
+        retriever = build_retriever(index, k=k)
+        retriever.invoke(items[0]['question'])
+        latencies, scores = [], []
+        for item in items:
+            start = time.perf_counter()
+            docs = retriever.invoke(item['question'])
+            latencies.append(time.perf_counter() - start)
+            if item['clauses']:
+                scores.append(score_retrieval(item['clauses'], docs))
+        results.append(dict(
+            config,
+            chunks=index.chunk_count,
+            index_bytes=directory_bytes(os.path.join(workdir, str(number))),
+            build_s=round(seconds, 3),
+            p50_ms=round(percentile_ms(latencies, 50), 2),
+            p99_ms=round(percentile_ms(latencies, 99), 2),
+            **{f'recall@{k}': round(sum(s['recall'] for s in scores) / len(scores), 4) if scores else None,
+               'mrr': round(sum(s['reciprocal_rank'] for s in scores) / len(scores), 4) if scores else None}
+        ))
+    return results
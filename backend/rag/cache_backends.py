@@ -0,0 +1,338 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from rag.tracing import CACHE_REQUESTS
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# QA 路徑快取的後端：memory（各行程各自一份）、sqlite（同一台主機的 worker 共用）、redis（跨主機共用）
+DEFAULT_CACHE_BACKEND = os.getenv("QA_CACHE_BACKEND", "memory")
+# sqlite 後端的檔案，可放在 /dev/shm 等共享記憶體的檔案系統
+DEFAULT_CACHE_PATH = os.getenv("QA_CACHE_PATH", os.path.join(BASE_DIR, "qa_cache", "cache.sqlite3"))
+DEFAULT_REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# sqlite 後端命中時累積最近使用時間，達到筆數或間隔（秒）才批次寫入
+TOUCH_BATCH = 256
+TOUCH_INTERVAL = 30.0
+
+
+class CacheBackend:
+    """QA 路徑快取後端的共同介面（查詢嵌入、檢索結果、答案）
+
+    項目依 namespace 分組，名稱為「種類:版本」（如 answer:<索引版本>），
+    每個 namespace 各自有筆數上限，超過時淘汰最久未使用的項目；ttl 為秒數（None 為不過期）。
+    值以 pickle 保存（memory 後端直接保存物件，取出後不應修改）。
+    """
+
+    name = None
+
+    def get(self, namespace, key):
+        """回傳快取的值，未命中或已過期時回傳 None"""
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, ttl=None, max_entries=None):
+        raise NotImplementedError
+
+    def clear(self, namespace):
+        raise NotImplementedError
+
+    def namespaces(self):
+        """回傳 {namespace: 項目數}"""
+        raise NotImplementedError
+
+    def drop_namespaces(self, kind, keep=None):
+        """刪除某種類除 keep 以外的所有 namespace（索引版本變更後清除舊版本的項目）"""
+        for namespace in self.namespaces():
+            if namespace.startswith(kind + ':') and namespace != keep:
+                self.clear(namespace)
+
+    def namespace(self, name, max_entries=None, ttl=None):
+        return Namespace(self, name, max_entries, ttl)
+
+    def stats(self):
+        return {'backend': self.name, 'namespaces': self.namespaces()}
+
+
+class Namespace:
+    """綁定名稱、筆數上限與 TTL 的 namespace
+
+    查詢結果記錄在 rag_cache_requests_total（如 answer_hit、retrieval_miss）；
+    後端無法連線時視為未命中，不影響回答。
+    """
+
+    def __init__(self, backend, name, max_entries=None, ttl=None):
+        self.backend = backend
+        self.name = name
+        self.kind = name.split(':', 1)[0]
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        try:
+            value = self.backend.get(self.name, key)
+        except Exception as e:
+            print(f"快取讀取失敗 ({self.backend.name}): {str(e)}")
+            value = None
+        CACHE_REQUESTS.inc(f"{self.kind}_{'miss' if value is None else 'hit'}")
+        return value
+
+    def set(self, key, value):
+        try:
+            self.backend.set(self.name, key, value, self.ttl, self.max_entries)
+        except Exception as e:
+            print(f"快取寫入失敗 ({self.backend.name}): {str(e)}")
+
+    def clear(self):
+        self.backend.clear(self.name)
+
+
+class MemoryCache(CacheBackend):
+    """行程內的快取，每個 namespace 一個 OrderedDict（LRU）"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._namespaces = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self._lock:
+            entries = self._namespaces.get(namespace)
+            entry = entries.get(key) if entries is not None else None
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return value
+
+    def set(self, namespace, key, value, ttl=None, max_entries=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            entries = self._namespaces.setdefault(namespace, OrderedDict())
+            entries[key] = (value, expires_at)
+            entries.move_to_end(key)
+            while max_entries is not None and len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def clear(self, namespace):
+        with self._lock:
+            self._namespaces.pop(namespace, None)
+
+    def namespaces(self):
+        with self._lock:
+            return {namespace: len(entries) for namespace, entries in self._namespaces.items()}
+
+
+class SQLiteCache(CacheBackend):
+    """以 SQLite 檔案在同一台主機的多個 worker 間共用（WAL 模式，讀取不互相阻塞）"""
+
+    name = "sqlite"
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+            "expires_at REAL, last_used REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries(namespace, last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_expiry ON entries(namespace, expires_at)")
+        # (namespace, key) -> 尚未寫入的最近使用時間
+        self._touched = {}
+        self._touched_at = time.monotonic()
+
+    def get(self, namespace, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            # 過期項目留待 set 時刪除；命中時只在記憶體記錄使用時間，讀取不寫入 SQLite
+            if row is None or (row[1] is not None and row[1] < now):
+                return None
+            self._touched[(namespace, key)] = now
+            if len(self._touched) >= TOUCH_BATCH or time.monotonic() - self._touched_at >= TOUCH_INTERVAL:
+                self._flush_touches()
+        return pickle.loads(row[0])
+
+    def _flush_touches(self):
+        """將累積的最近使用時間寫入 SQLite（淘汰前也會先寫入，LRU 順序仍正確）"""
+        touched, self._touched = self._touched, {}
+        self._touched_at = time.monotonic()
+        if touched:
+            self._conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE namespace = ? AND key = ?",
+                [(used, namespace, key) for (namespace, key), used in touched.items()]
+            )
+
+    def set(self, namespace, key, value, ttl=None, max_entries=None):
+        now = time.time()
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, data, now + ttl if ttl else None, now)
+                )
+                self._conn.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND expires_at < ?", (namespace, now)
+                )
+                if max_entries is not None:
+                    self._flush_touches()
+                    count = self._conn.execute(
+                        "SELECT COUNT(*) FROM entries WHERE namespace = ?", (namespace,)
+                    ).fetchone()[0]
+                    if count > max_entries:
+                        self._conn.execute(
+                            "DELETE FROM entries WHERE rowid IN ("
+                            "SELECT rowid FROM entries WHERE namespace = ? ORDER BY last_used LIMIT ?)",
+                            (namespace, count - max_entries)
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def clear(self, namespace):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+    def namespaces(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT namespace, COUNT(*) FROM entries WHERE expires_at IS NULL OR expires_at >= ? "
+                "GROUP BY namespace", (time.time(),)
+            ).fetchall()
+        return dict(rows)
+
+
+class RedisCache(CacheBackend):
+    """以 Redis 在多台主機的 worker 間共用
+
+    值存為 <prefix>:v:<namespace>:<key>（設定 ttl 時以 Redis 的 EXPIRE 過期），
+    每個 namespace 另以 sorted set（<prefix>:lru:<namespace>）記錄最近使用時間，
+    超過上限時淘汰分數最低的項目。有 ttl 的項目同時記錄在 <prefix>:exp:<namespace>（分數為過期時間），
+    寫入與統計前以 ZRANGEBYSCORE 找出已過期的項目，從兩個 sorted set 移除。
+    client 可傳入既有的連線（如 fakeredis）。
+    """
+
+    name = "redis"
+
+    def __init__(self, url=DEFAULT_REDIS_URL, client=None, prefix="qa"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _value_key(self, namespace, key):
+        return f"{self.prefix}:v:{namespace}:{key}"
+
+    def _lru_key(self, namespace):
+        return f"{self.prefix}:lru:{namespace}"
+
+    def _expiry_key(self, namespace):
+        return f"{self.prefix}:exp:{namespace}"
+
+    def _prune(self, namespace, now):
+        """從 sorted set 移除值已由 Redis 過期刪除的項目"""
+        expiry_key = self._expiry_key(namespace)
+        expired = self.client.zrangebyscore(expiry_key, '-inf', now)
+        if expired:
+            pipe = self.client.pipeline()
+            pipe.zrem(self._lru_key(namespace), *expired)
+            pipe.zremrangebyscore(expiry_key, '-inf', now)
+            pipe.execute()
+
+    def get(self, namespace, key):
+        data = self.client.get(self._value_key(namespace, key))
+        if data is None:
+            # 值已過期（或被淘汰）時一併移除 sorted set 中的項目
+            pipe = self.client.pipeline()
+            pipe.zrem(self._lru_key(namespace), key)
+            pipe.zrem(self._expiry_key(namespace), key)
+            pipe.execute()
+            return None
+        self.client.zadd(self._lru_key(namespace), {key: time.time()})
+        return pickle.loads(data)
+
+    def set(self, namespace, key, value, ttl=None, max_entries=None):
+        now = time.time()
+        self._prune(namespace, now)
+        lru_key = self._lru_key(namespace)
+        expiry_key = self._expiry_key(namespace)
+        pipe = self.client.pipeline()
+        pipe.set(self._value_key(namespace, key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                 ex=int(ttl) if ttl else None)
+        if ttl:
+            pipe.zadd(expiry_key, {key: now + int(ttl)})
+        else:
+            pipe.zrem(expiry_key, key)
+        pipe.zadd(lru_key, {key: now})
+        pipe.sadd(f"{self.prefix}:namespaces", namespace)
+        pipe.zcard(lru_key)
+        count = pipe.execute()[-1]
+        if max_entries is not None and count > max_entries:
+            victims = [member for member, _ in self.client.zpopmin(lru_key, count - max_entries)]
+            pipe = self.client.pipeline()
+            pipe.delete(*[self._value_key(namespace, self._decode(member)) for member in victims])
+            pipe.zrem(expiry_key, *victims)
+            pipe.execute()
+
+    @staticmethod
+    def _decode(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def clear(self, namespace):
+        lru_key = self._lru_key(namespace)
+        keys = [self._value_key(namespace, self._decode(member)) for member in self.client.zrange(lru_key, 0, -1)]
+        pipe = self.client.pipeline()
+        for start in range(0, len(keys), 500):
+            pipe.delete(*keys[start:start + 500])
+        pipe.delete(lru_key, self._expiry_key(namespace))
+        pipe.srem(f"{self.prefix}:namespaces", namespace)
+        pipe.execute()
+
+    def namespaces(self):
+        names = sorted(self._decode(name) for name in self.client.smembers(f"{self.prefix}:namespaces"))
+        now = time.time()
+        for name in names:
+            self._prune(name, now)
+        pipe = self.client.pipeline()
+        for name in names:
+            pipe.zcard(self._lru_key(name))
+        return dict(zip(names, pipe.execute()))
+
+
+CACHE_BACKENDS = {backend.name: backend for backend in (MemoryCache, SQLiteCache, RedisCache)}
+
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+
+def create_cache(name, **options):
+    """依名稱建立快取後端"""
+    if name not in CACHE_BACKENDS:
+        raise ValueError(f"未知的快取後端: {name}（可用: {', '.join(CACHE_BACKENDS)}）")
+    return CACHE_BACKENDS[name](**options)
+
+
+def get_cache(name=DEFAULT_CACHE_BACKEND, **options):
+    """同一行程內相同設定共用同一個快取後端"""
+    key = (name, tuple(sorted(options.items())))
+    with _shared_lock:
+        if key not in _shared_caches:
+            _shared_caches[key] = create_cache(name, **options)
+        return _shared_caches[key]
@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import threading
+
+from langchain_core.documents import Document
+
+
+class ChunkStore:
+    """以 SQLite 保存 chunk 內容與 metadata，向量後端只需保存 ID 與向量
+
+    另以 clauses 資料表建立「(來源文件, 條款編號) → chunk ID」索引（來源為 metadata['source'] 與
+    metadata['clauses']），可直接查出某條款所在的 chunk，不需向量搜尋。不同文件可能使用相同的條款編號
+    （如兩份手冊都有 7.1），查詢結果依來源文件分組，並依 chunk 在文件中的順序（ordinal）排列。
+    使用父子分割時，父段落存於 parents 資料表（ID → 內容），子 chunk 以 metadata['parent_id'] 指向它。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS parents (id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(clauses)")]
+        if columns and 'source' not in columns:
+            # 舊版索引沒有記錄來源文件，由 chunks 資料表重建
+            self._conn.execute("DROP TABLE clauses")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS clauses ("
+            "source TEXT NOT NULL, clause TEXT NOT NULL, chunk_id TEXT NOT NULL, ordinal INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS clauses_clause ON clauses (clause, source, ordinal)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS clauses_chunk_id ON clauses (chunk_id)")
+        if columns and 'source' not in columns:
+            self._rebuild_clauses()
+        self._conn.commit()
+
+    @staticmethod
+    def _clause_rows(ids, documents, ordinals):
+        return [(doc.metadata.get('source', ''), clause, chunk_id, ordinal)
+                for chunk_id, doc, ordinal in zip(ids, documents, ordinals)
+                for clause in doc.metadata.get('clauses', [])]
+
+    def _rebuild_clauses(self):
+        """由 chunks 資料表重建條款索引；chunk ID 以 -<序號> 結尾（見 index_manager.make_chunk_ids）"""
+        rows = []
+        for chunk_id, content, metadata in self._conn.execute("SELECT id, content, metadata FROM chunks"):
+            ordinal = chunk_id.rsplit('-', 1)[-1]
+            rows.extend(self._clause_rows(
+                [chunk_id], [Document(page_content=content, metadata=json.loads(metadata))],
+                [int(ordinal) if ordinal.isdigit() else 0]
+            ))
+        self._conn.executemany("INSERT INTO clauses (source, clause, chunk_id, ordinal) VALUES (?, ?, ?, ?)", rows)
+
+    def add(self, ids, documents):
+        """寫入 chunk；documents 依其在來源文件中的順序排列（條款查詢依此順序回傳）"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, content, metadata) VALUES (?, ?, ?)",
+                [(chunk_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                 for chunk_id, doc in zip(ids, documents)]
+            )
+            self._conn.executemany("DELETE FROM clauses WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.executemany(
+                "INSERT INTO clauses (source, clause, chunk_id, ordinal) VALUES (?, ?, ?, ?)",
+                self._clause_rows(ids, documents, range(len(ids)))
+            )
+            self._conn.commit()
+
+    def delete(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.executemany("DELETE FROM clauses WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM parents")
+            self._conn.execute("DELETE FROM clauses")
+            self._conn.commit()
+
+    def add_parents(self, ids, documents):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO parents (id, content, metadata) VALUES (?, ?, ?)",
+                [(parent_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                 for parent_id, doc in zip(ids, documents)]
+            )
+            self._conn.commit()
+
+    def delete_parents(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM parents WHERE id = ?", [(parent_id,) for parent_id in ids])
+            self._conn.commit()
+
+    def get_many(self, ids, table="chunks"):
+        """依 ids 的順序回傳 Document（不存在的 ID 會略過）"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = list(ids[start:start + 500])
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT id, content, metadata FROM {table} WHERE id IN ({placeholders})", batch
+                ).fetchall()
+                for chunk_id, content, metadata in rows:
+                    found[chunk_id] = Document(id=chunk_id, page_content=content, metadata=json.loads(metadata))
+        return [found[chunk_id] for chunk_id in ids if chunk_id in found]
+
+    def get_parents(self, ids):
+        return self.get_many(ids, table="parents")
+
+    def to_parents(self, documents):
+        """將子 chunk 換成其父段落（依第一次出現的順序去除重複），沒有父段落的 chunk 原樣保留
+
+        父段落的 score 取其子 chunk 的最高分。
+        """
+        parent_ids = []
+        scores = {}
+        for doc in documents:
+            parent_id = doc.metadata.get('parent_id')
+            if parent_id is None:
+                continue
+            if parent_id not in scores:
+                parent_ids.append(parent_id)
+                scores[parent_id] = doc.metadata.get('score')
+            elif doc.metadata.get('score') is not None:
+                scores[parent_id] = max(scores[parent_id] or 0.0, doc.metadata['score'])
+        parents = {doc.id: doc for doc in self.get_parents(parent_ids)}
+
+        results, emitted = [], set()
+        for doc in documents:
+            parent_id = doc.metadata.get('parent_id')
+            if parent_id is None or parent_id not in parents:
+                results.append(doc)
+            elif parent_id not in emitted:
+                emitted.add(parent_id)
+                parent = parents[parent_id]
+                if scores[parent_id] is not None:
+                    parent.metadata['score'] = scores[parent_id]
+                results.append(parent)
+        return results
+
+    def clause_chunk_ids(self, clause):
+        """回傳 {來源文件: 含有該條款（或其子條款）編號的 chunk ID}，chunk ID 依其在文件中的順序排列"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, chunk_id, MIN(ordinal) AS position FROM clauses "
+                "WHERE clause = ? OR clause LIKE ? GROUP BY source, chunk_id ORDER BY source, position",
+                (clause, clause + '.%')
+            ).fetchall()
+        grouped = {}
+        for source, chunk_id, _ in rows:
+            grouped.setdefault(source, []).append(chunk_id)
+        return grouped
+
+    def get_clause_documents(self, clause):
+        """回傳 {來源文件: [Document]}，同一來源的 chunk 依文件順序排列"""
+        return {source: self.get_many(chunk_ids) for source, chunk_ids in self.clause_chunk_ids(clause).items()}
+
+    def ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM chunks ORDER BY id")]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
@@ -0,0 +1,67 @@
+import os
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from rag.clause_splitter import ClauseSplitter
+from rag.parent_child import ParentChildSplitter
+
+# 分割方式：clause 依條款結構分割（過長的條款才以分隔符切開），recursive 依分隔符與長度分割
+STRATEGIES = ("clause", "recursive")
+
+# 分隔符組合，依序嘗試（clause 分割時只用於過長的條款）；可用 manage.py sweep_chunking 比較
+SEPARATOR_SETS = {
+    # 段落、換行、中文句號與逗號
+    "zh": ["\n\n", "\n", "。", "，", " ", ""],
+    # 只在段落與換行處切開，條文較完整但 chunk 長度較不平均
+    "newline": ["\n\n", "\n", ""],
+    # 在句子與分號處切開
+    "sentence": ["\n\n", "\n", "。", "；", "，", ""],
+}
+
+# 分割設定集中於此，QA 系統、匯入指令與評估共用（修改後索引會自動重建，相同文字沿用嵌入快取）
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "250"))
+# 上下文由父段落提供，子 chunk 只需少量重疊
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+PARENT_CHUNK_SIZE = int(os.getenv("PARENT_CHUNK_SIZE", "1200"))
+CHUNK_SEPARATORS = os.getenv("CHUNK_SEPARATORS", "zh")
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "clause")
+
+
+def chunking_config(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, parent_chunk_size=PARENT_CHUNK_SIZE,
+                    separators=CHUNK_SEPARATORS, strategy=CHUNK_STRATEGY):
+    """分割設定（記錄在索引 manifest 中，變更時重建索引）"""
+    if strategy not in STRATEGIES:
+        raise ValueError(f"未知的分割方式: {strategy}（可用: {', '.join(STRATEGIES)}）")
+    if separators not in SEPARATOR_SETS:
+        raise ValueError(f"未知的分隔符組合: {separators}（可用: {', '.join(SEPARATOR_SETS)}）")
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) 需小於 chunk_size ({chunk_size})")
+    return {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "parent_chunk_size": parent_chunk_size,
+        "separators": separators,
+        "strategy": strategy,
+    }
+
+
+def create_text_splitter(config=None):
+    """依分割設定建立兩層分割器：子 chunk 用於嵌入與檢索，父段落（一個 x.y 條款）用於生成"""
+    config = config or chunking_config()
+    separators = SEPARATOR_SETS[config["separators"]]
+    if config.get("strategy", "recursive") == "clause":
+        return ClauseSplitter(config["chunk_size"], config["chunk_overlap"], config["parent_chunk_size"], separators)
+    return ParentChildSplitter(
+        child_splitter=RecursiveCharacterTextSplitter(
+            chunk_size=config["chunk_size"],
+            chunk_overlap=config["chunk_overlap"],
+            separators=separators,
+            add_start_index=True  # 記錄 chunk 在文件中的位置，供組合 context 時合併重疊的 chunk
+        ),
+        parent_splitter=RecursiveCharacterTextSplitter(
+            chunk_size=config["parent_chunk_size"],
+            chunk_overlap=0,
+            separators=separators,
+            add_start_index=True
+        )
+    )
@@ -0,0 +1,152 @@
+import bisect
+import re
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from rag.clauses import is_within
+
+# 行首的條款編號：「3.工作時間」、「3.1非醫師…」、「2.1.3.牙醫師」（一層編號需有句點，避免把「1年期」當成條款）
+HEADING_PATTERN = re.compile(r'^[ \t]*(\d+(?:\.\d+)+|\d+(?=\.))\.?(?=[^\d.\s])', re.MULTILINE)
+
+
+def parse_clauses(text):
+    """掃描一次文字，回傳 [(條款編號, 起始, 結束)]；第一個編號之前的內容編號為 ''"""
+    starts = [(match.group(1), match.start()) for match in HEADING_PATTERN.finditer(text)]
+    if not starts or starts[0][1] != 0:
+        starts.insert(0, ('', 0))
+    ends = [start for _, start in starts[1:]] + [len(text)]
+    return [(number, start, end) for (number, start), end in zip(starts, ends)]
+
+
+def clause_depth(number):
+    return number.count('.') + 1 if number else 0
+
+
+def subtree_ends(segments):
+    """每個條款（含其全部子條款）結束於第幾個 segment（不含），以堆疊一次算出"""
+    ends = [len(segments)] * len(segments)
+    stack = []
+    for index, (number, _, _) in enumerate(segments):
+        while stack and not (number and is_within(number, segments[stack[-1]][0])):
+            ends[stack.pop()] = index
+        stack.append(index)
+    return ends
+
+
+def trim(text, start, end):
+    """去除範圍前後的空白，回傳新的 (起始, 結束)"""
+    piece = text[start:end]
+    stripped = piece.lstrip()
+    start += len(piece) - len(stripped)
+    return start, start + len(stripped.rstrip())
+
+
+class ClauseSplitter:
+    """依條款結構分割：一個條款（連同放得下的子條款）為一個 chunk
+
+    只掃描一次條款編號，每章的子樹範圍也只計算一次（子 chunk 沿用，以二分搜尋找出父段落內的條款）。
+    父段落在同一章（一層條款）內將條款依序合併到 parent_chunk_size 為止，
+    子 chunk 在父段落內同樣以條款為單位合併到 chunk_size 為止；
+    只有單一條款本身超過長度時才以 separators 再切開（此時才使用 chunk_overlap）。
+    介面與 ParentChildSplitter 相同，metadata 記錄 start_index 與 parent_index。
+    """
+
+    def __init__(self, chunk_size, chunk_overlap, parent_chunk_size, separators):
+        self.chunk_size = chunk_size
+        self.parent_chunk_size = parent_chunk_size
+        self.child_fallback = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=separators, add_start_index=True
+        )
+        self.parent_fallback = RecursiveCharacterTextSplitter(
+            chunk_size=parent_chunk_size, chunk_overlap=0, separators=separators, add_start_index=True
+        )
+
+    @staticmethod
+    def _chapters(segments):
+        """依一層條款（「3.工作時間」）分章，回傳 [(起始, 結束)] 的 segment 位置"""
+        starts = [index for index, (number, _, _) in enumerate(segments) if clause_depth(number) <= 1]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        return list(zip(starts, starts[1:] + [len(segments)]))
+
+    @staticmethod
+    def _pack(text, segments, ends, budget, fallback):
+        """將條款依序合併到 budget 為止，回傳 [(起始, 結束)]；ends 為 subtree_ends(segments)
+
+        整個條款（含子條款）放不下時，條款本身的文字與各子條款分開處理；
+        單一條款本身仍過長時以 fallback 分割。
+        """
+        spans = []
+        current = None
+        index = 0
+        while index < len(segments):
+            end = ends[index]
+            start, stop = trim(text, segments[index][1], segments[end - 1][2])
+            if stop - start > budget and end > index + 1:
+                end = index + 1
+                start, stop = trim(text, segments[index][1], segments[index][2])
+            index = end
+            if start == stop:
+                continue
+            if current is not None and stop - current[0] <= budget:
+                current = (current[0], stop)
+                continue
+            if current is not None:
+                spans.append(current)
+                current = None
+            if stop - start <= budget:
+                current = (start, stop)
+                continue
+            for piece in fallback.create_documents([text[start:stop]]):
+                piece_start = start + piece.metadata['start_index']
+                spans.append((piece_start, piece_start + len(piece.page_content)))
+        if current is not None:
+            spans.append(current)
+        return spans
+
+    @staticmethod
+    def _within(segments, starts, ends, start, end):
+        """範圍 [start, end) 內的條款（頭尾裁切到範圍內）與其 subtree_ends
+
+        segments 首尾相連，以 starts（各條款起始位置）二分搜尋出範圍；
+        範圍內的子樹結束位置即整章的結果截到範圍結尾，不需重新計算。
+        """
+        first = max(bisect.bisect_right(starts, start) - 1, 0)
+        last = bisect.bisect_left(starts, end)
+        window = [(number, max(lo, start), min(hi, end)) for number, lo, hi in segments[first:last]]
+        return window, [min(stop, last) - first for stop in ends[first:last]]
+
+    def _split(self, document):
+        text = document.page_content
+        segments = parse_clauses(text)
+        for lo, hi in self._chapters(segments):
+            chapter = segments[lo:hi]
+            ends = subtree_ends(chapter)
+            starts = [start for _, start, _ in chapter]
+            for parent_start, parent_end in self._pack(text, chapter, ends, self.parent_chunk_size,
+                                                       self.parent_fallback):
+                window, window_ends = self._within(chapter, starts, ends, parent_start, parent_end)
+                children = self._pack(text, window, window_ends, self.chunk_size, self.child_fallback)
+                yield (parent_start, parent_end), children
+
+    def split_with_parents(self, documents):
+        """回傳 (父段落, 子 chunk)"""
+        parents, children = [], []
+        for document in documents:
+            text = document.page_content
+            for (parent_start, parent_end), spans in self._split(document):
+                parent_index = len(parents)
+                parents.append(Document(
+                    page_content=text[parent_start:parent_end],
+                    metadata=dict(document.metadata, start_index=parent_start)
+                ))
+                for start, end in spans:
+                    children.append(Document(
+                        page_content=text[start:end],
+                        metadata=dict(document.metadata, start_index=start, parent_index=parent_index)
+                    ))
+        return parents, children
+
+    def split_documents(self, documents):
+        return self.split_with_parents(documents)[1]
@@ -0,0 +1,64 @@
+import re
+import unicodedata
+
+# 條款編號出現在行首或空白、句號之後，且後面緊接條文內容（如「7.5.1請假…」）。
+# 不使用 \b：中文字屬於 \w，「7.5.1請假」中的 7.5.1 後面沒有字詞邊界
+CLAUSE_PATTERN = re.compile(r'(?:^|(?<=[\s。；]))(\d+(?:\.\d+)+)(?=[^\d.\s])', re.MULTILINE)
+
+# 「7.5.1 說什麼」、「第7.5.1條的規定」這類只詢問條文內容的問題
+CLAUSE_QUESTION_PATTERN = re.compile(
+    r'^(?:請問)?(?:第)?(\d+(?:\.\d+)+)(?:條|款|項|節)?(?:的)?'
+    r'(?:規定|內容|條文|條款)?(?:是什麼|是甚麼|說什麼|寫什麼|在說什麼|講什麼|為何|如何規定)?[?？。!！]*$'
+)
+
+
+def clause_key(clause):
+    """條款排序鍵：7.10 排在 7.9 之後"""
+    return tuple(int(part) for part in clause.split('.'))
+
+
+def extract_clauses(text):
+    """找出文字中（開頭的）條款編號，依編號排序並去除重複"""
+    return sorted({match.group(1) for match in CLAUSE_PATTERN.finditer(text)}, key=clause_key)
+
+
+def annotate_clauses(chunks):
+    """於分割後的 chunk metadata 記錄其中的條款編號（ingestion 時執行一次）"""
+    for chunk in chunks:
+        chunk.metadata['clauses'] = extract_clauses(chunk.page_content)
+    return chunks
+
+
+def is_within(clause, parent):
+    """clause 是否為 parent 本身或其子條款"""
+    return clause == parent or clause.startswith(parent + '.')
+
+
+def clause_segments(text):
+    """將文字依條款編號切成 [(條款, 條文)]，第一個編號之前的內容捨棄"""
+    matches = list(CLAUSE_PATTERN.finditer(text))
+    segments = []
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following else len(text)
+        segments.append((match.group(1), text[match.start():end].strip()))
+    return segments
+
+
+def clause_text(clause, documents):
+    """從 chunk 組出指定條款（含子條款）的完整條文
+
+    相鄰 chunk 會重疊，同一條款可能出現多次且其中一份被截斷，取最長的版本。
+    """
+    best = {}
+    for doc in documents:
+        for number, segment in clause_segments(doc.page_content):
+            if is_within(number, clause) and len(segment) > len(best.get(number, '')):
+                best[number] = segment
+    return '\n'.join(best[number] for number in sorted(best, key=clause_key))
+
+
+def match_clause_question(question):
+    """問題只是在詢問某條款的內容時回傳條款編號，否則回傳 None"""
+    normalized = re.sub(r'\s+', '', unicodedata.normalize('NFKC', question))
+    match = CLAUSE_QUESTION_PATTERN.match(normalized)
+    return match.group(1) if match else None
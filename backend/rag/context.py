@@ -0,0 +1,89 @@
+import os
+
+from langchain_core.documents import Document
+
+from rag.clauses import clause_key
+from rag.embedding_executor import count_tokens, truncate_tokens
+
+DEFAULT_CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# 剩餘預算少於此值時不再截斷塞入片段
+MIN_SPAN_TOKENS = 50
+
+
+def merge_spans(documents):
+    """將同一來源中重疊或相鄰的 chunk 合併回連續段落，並移除重複內容
+
+    依 metadata['start_index'] 判斷位置；合併後的段落保留最佳檢索名次（rank）、
+    最高分數與所有條款編號。沒有位置資訊的 chunk 只依內容去除重複。
+    回傳依最佳名次排序的 Document。
+    """
+    spans = []
+    by_source = {}
+    seen_contents = set()
+    for rank, doc in enumerate(documents):
+        start = doc.metadata.get('start_index')
+        if start is None:
+            if doc.page_content not in seen_contents:
+                seen_contents.add(doc.page_content)
+                spans.append((rank, doc))
+            continue
+        by_source.setdefault(doc.metadata.get('source'), []).append((start, rank, doc))
+
+    for source, items in by_source.items():
+        items.sort(key=lambda item: item[0])
+        current = None
+        for start, rank, doc in items:
+            end = start + len(doc.page_content)
+            if current is not None and start <= current['end']:
+                # 重疊部分只保留一次
+                if end > current['end']:
+                    current['text'] += doc.page_content[current['end'] - start:]
+                    current['end'] = end
+                current['rank'] = min(current['rank'], rank)
+                current['docs'].append(doc)
+                continue
+            if current is not None:
+                spans.append(_to_span(source, current))
+            current = {'start': start, 'end': end, 'text': doc.page_content, 'rank': rank, 'docs': [doc]}
+        spans.append(_to_span(source, current))
+
+    spans.sort(key=lambda span: span[0])
+    return [doc for _, doc in spans]
+
+
+def _to_span(source, span):
+    docs = span['docs']
+    if len(docs) == 1:
+        return span['rank'], docs[0]
+    metadata = dict(docs[0].metadata)
+    metadata['start_index'] = span['start']
+    clauses = {clause for doc in docs for clause in doc.metadata.get('clauses', [])}
+    metadata['clauses'] = sorted(clauses, key=clause_key)
+    scores = [doc.metadata['score'] for doc in docs if 'score' in doc.metadata]
+    if scores:
+        metadata['score'] = max(scores)
+    metadata['merged_chunks'] = len(docs)
+    return span['rank'], Document(page_content=span['text'], metadata=metadata)
+
+
+def pack_context(documents, max_tokens=DEFAULT_CONTEXT_TOKENS):
+    """合併重疊 chunk 後，依檢索名次放入 token 預算內
+
+    放不下的段落在剩餘預算足夠時截斷放入，否則捨棄。
+    """
+    packed = []
+    remaining = max_tokens
+    for doc in merge_spans(documents):
+        tokens = count_tokens(doc.page_content)
+        if tokens <= remaining:
+            packed.append(doc)
+            remaining -= tokens
+        elif remaining >= MIN_SPAN_TOKENS:
+            packed.append(Document(
+                page_content=truncate_tokens(doc.page_content, remaining),
+                metadata=dict(doc.metadata, truncated=True)
+            ))
+            remaining = 0
+        if remaining < MIN_SPAN_TOKENS:
+            break
+    return packed
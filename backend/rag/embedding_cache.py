@@ -0,0 +1,308 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag.embedding_executor import EmbeddingExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(BASE_DIR, "embedding_cache"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# 向量檔每次擴充的列數
+GROW_ROWS = 1024
+# 讀取時的 LRU 時間先記在行程內，累積到此筆數或經過此秒數才寫入 SQLite
+TOUCH_BATCH = 256
+TOUCH_INTERVAL = 30.0
+
+
+def checksum(vector):
+    return zlib.crc32(np.ascontiguousarray(vector, dtype=np.float32).tobytes())
+
+
+def normalize_text(text):
+    """正規化文本：合併連續空白並去除首尾空白"""
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def cache_key(model, text):
+    """以 (模型名稱, 正規化文本雜湊) 產生快取鍵"""
+    digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+    return f"{model}:{digest}"
+
+
+class EmbeddingCache:
+    """以內容定址的磁碟嵌入快取
+
+    向量以 float32 存在依維度分開的 memory-mapped 檔案中，
+    SQLite 只記錄鍵 → (維度, 槽位, 向量的 CRC32, 最近使用時間)，項目數另記在 counters 表，
+    與新增、淘汰在同一交易中更新。超過 max_entries 時依最近使用時間淘汰（LRU），槽位會被重複利用。
+    多個行程可共用同一個目錄：槽位配置在 SQLite 交易中完成。
+    讀取不寫入 SQLite：查詢槽位與讀取向量之間槽位可能被其他行程淘汰並重新寫入，
+    因此讀出的向量需與 CRC32 相符才算命中；最近使用時間在行程內累積後批次寫入。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._touched = {}
+        self._touched_at = time.monotonic()
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite3"),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, slot INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]
+        if 'checksum' not in columns:
+            self._add_checksums()
+        self._conn.execute("CREATE TABLE IF NOT EXISTS free_slots (dim INTEGER NOT NULL, slot INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS slot_counters (dim INTEGER PRIMARY KEY, next_slot INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        # 舊版快取沒有項目數：以目前的項目數初始化
+        self._conn.execute("INSERT OR IGNORE INTO counters (name, value) SELECT 'entries', COUNT(*) FROM entries")
+
+    def _add_checksums(self):
+        """舊版快取沒有 checksum 欄位：以目前的向量補上"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]
+            if 'checksum' not in columns:
+                self._conn.execute("ALTER TABLE entries ADD COLUMN checksum INTEGER")
+                rows = self._conn.execute("SELECT key, dim, slot FROM entries").fetchall()
+                self._conn.executemany(
+                    "UPDATE entries SET checksum = ? WHERE key = ?",
+                    [(checksum(self._vectors(dim, slot + 1)[slot]), key) for key, dim, slot in rows]
+                )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _vector_path(self, dim):
+        return os.path.join(self.cache_dir, f"vectors-{dim}.f32")
+
+    def _vectors(self, dim, min_rows=0):
+        """取得某維度的 memmap，必要時擴充檔案（其他行程可能已擴充過）"""
+        path = self._vector_path(dim)
+        mapped = self._maps.get(dim)
+        if mapped is not None and mapped.shape[0] >= min_rows:
+            return mapped
+        row_bytes = dim * 4
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        rows = size // row_bytes
+        if rows < min_rows:
+            rows = ((min_rows + GROW_ROWS - 1) // GROW_ROWS) * GROW_ROWS
+            with open(path, 'ab') as f:
+                f.truncate(rows * row_bytes)
+        if rows == 0:
+            return None
+        mapped = np.memmap(path, dtype=np.float32, mode='r+', shape=(rows, dim))
+        self._maps[dim] = mapped
+        return mapped
+
+    def get_many(self, keys):
+        """批次查詢，回傳與 keys 對齊的向量列表（未命中為 None）"""
+        results = [None] * len(keys)
+        if not keys:
+            return results
+        with self._lock:
+            found = {}
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, dim, slot, checksum FROM entries WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, dim, slot, expected in rows:
+                    found[key] = (dim, slot, expected)
+
+            now = time.time()
+            for i, key in enumerate(keys):
+                if key not in found:
+                    continue
+                dim, slot, expected = found[key]
+                vector = np.array(self._vectors(dim, slot + 1)[slot])
+                # 槽位已被其他行程重新使用（或正在寫入）時視為未命中
+                if checksum(vector) != expected:
+                    continue
+                results[i] = vector
+                self._touched[key] = now
+
+            if len(self._touched) >= TOUCH_BATCH or time.monotonic() - self._touched_at >= TOUCH_INTERVAL:
+                self._flush_touches()
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(keys) - hit_count
+        return results
+
+    def _flush_touches(self):
+        """將累積的最近使用時間寫入 SQLite"""
+        touched, self._touched = self._touched, {}
+        self._touched_at = time.monotonic()
+        if touched:
+            self._conn.executemany(
+                "UPDATE entries SET last_used = ? WHERE key = ?", [(used, key) for key, used in touched.items()]
+            )
+
+    def put_many(self, keys, vectors):
+        """寫入向量；超過容量時先淘汰最久未使用的項目"""
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        with self._lock:
+            # 向量寫入完成後才提交，其他行程不會讀到尚未寫入的槽位
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                slots, added = [], 0
+                for key, vector in zip(keys, vectors):
+                    row = self._conn.execute("SELECT dim, slot FROM entries WHERE key = ?", (key,)).fetchone()
+                    if row and row[0] == dim:
+                        slot = row[1]
+                    else:
+                        if row:
+                            # 同一個鍵改存不同維度的向量：原維度的槽位放回 free_slots
+                            self._conn.execute("INSERT INTO free_slots (dim, slot) VALUES (?, ?)", row)
+                        else:
+                            added += 1
+                        slot = self._allocate_slot(key, dim)
+                    self._conn.execute("UPDATE entries SET checksum = ? WHERE key = ?", (checksum(vector), key))
+                    slots.append(slot)
+                if added:
+                    self._conn.execute("UPDATE counters SET value = value + ? WHERE name = 'entries'", (added,))
+                mapped = self._vectors(dim, max(slots) + 1)
+                for slot, vector in zip(slots, vectors):
+                    mapped[slot] = vector
+                mapped.flush()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            # 淘汰前先寫入讀取時累積的使用時間
+            self._flush_touches()
+            self._evict()
+
+    def _allocate_slot(self, key, dim):
+        row = self._conn.execute("SELECT rowid, slot FROM free_slots WHERE dim = ? LIMIT 1", (dim,)).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM free_slots WHERE rowid = ?", (row[0],))
+            slot = row[1]
+        else:
+            counter = self._conn.execute("SELECT next_slot FROM slot_counters WHERE dim = ?", (dim,)).fetchone()
+            slot = counter[0] if counter else 0
+            self._conn.execute(
+                "INSERT OR REPLACE INTO slot_counters (dim, next_slot) VALUES (?, ?)", (dim, slot + 1)
+            )
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (key, dim, slot, last_used) VALUES (?, ?, ?, ?)",
+            (key, dim, slot, time.time())
+        )
+        return slot
+
+    def _count(self):
+        return self._conn.execute("SELECT value FROM counters WHERE name = 'entries'").fetchone()[0]
+
+    def _evict(self):
+        if self._count() <= self.max_entries:
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 取得寫入鎖後重新讀取，其他行程可能已經淘汰過
+            overflow = self._count() - self.max_entries
+            victims = self._conn.execute(
+                "SELECT key, dim, slot FROM entries ORDER BY last_used LIMIT ?", (max(overflow, 0),)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _, _ in victims])
+            self._conn.executemany(
+                "INSERT INTO free_slots (dim, slot) VALUES (?, ?)", [(dim, slot) for _, dim, slot in victims]
+            )
+            self._conn.execute("UPDATE counters SET value = value - ? WHERE name = 'entries'", (len(victims),))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self),
+            'max_entries': self.max_entries,
+        }
+
+
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+
+def get_embedding_cache(cache_dir=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES):
+    """同一行程內共用同一目錄的快取實例（max_entries 只在第一次建立時使用）"""
+    with _shared_lock:
+        if cache_dir not in _shared_caches:
+            _shared_caches[cache_dir] = EmbeddingCache(cache_dir, max_entries)
+        return _shared_caches[cache_dir]
+
+
+class CachedEmbeddings(Embeddings):
+    """在任意 Embeddings 前加上磁碟快取，只對未命中的文本呼叫 API
+
+    未命中的文本交由 EmbeddingExecutor 分批並行嵌入，每完成一批即寫入快取，
+    因此中斷的匯入重新執行時會從未完成的批次繼續。
+    """
+
+    def __init__(self, embeddings, cache=None, executor=None):
+        self.embeddings = embeddings
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.executor = executor if executor is not None else EmbeddingExecutor(embeddings)
+        self.model = getattr(embeddings, 'model', type(embeddings).__name__)
+
+    def _checkpoint(self, texts, vectors):
+        self.cache.put_many([cache_key(self.model, text) for text in texts], vectors)
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model, text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # 相同文本只嵌入一次
+        missing = {}
+        for key, text, vector in zip(keys, texts, cached):
+            if vector is None and key not in missing:
+                missing[key] = text
+        if missing:
+            new_vectors = self.executor.embed(list(missing.values()), on_batch=self._checkpoint)
+            computed = dict(zip(missing.keys(), new_vectors))
+            cached = [vector if vector is not None else computed[key] for key, vector in zip(keys, cached)]
+
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in cached]
+
+    def embed_query(self, text):
+        key = cache_key(self.model, text)
+        vector = self.cache.get_many([key])[0]
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many([key], [vector])
+        return np.asarray(vector, dtype=np.float32).tolist()
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+DEFAULT_MAX_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "8000"))
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+DEFAULT_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+DEFAULT_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """cl100k_base（OpenAI 嵌入與 gpt-3.5/4 使用的編碼），tiktoken 無法使用時回傳 None"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text):
+    """以 tiktoken 計算 token 數；無法使用時以字元數估計（中文約一字一 token）"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text)
+
+
+def truncate_tokens(text, max_tokens):
+    """截斷至最多 max_tokens 個 token"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    # 截斷處可能切在多位元組字元中間，移除解碼失敗的殘字
+    return encoding.decode(tokens[:max_tokens]).rstrip('\ufffd')
+
+
+# 逾時與連線中斷（openai、httpx 的例外名稱）視為暫時性錯誤
+TRANSIENT_ERROR_NAMES = {
+    'RateLimitError', 'APITimeoutError', 'APIConnectionError', 'InternalServerError',
+    'TimeoutException', 'ConnectTimeout', 'ReadTimeout', 'ConnectError',
+}
+
+
+def status_code(error):
+    """API 錯誤的 HTTP 狀態碼，沒有則回傳 None"""
+    status = getattr(error, 'status_code', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error):
+    """429、5xx 與逾時、連線錯誤可重試；400、401 或輸入錯誤重試也不會成功"""
+    status = status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def retry_after_seconds(error):
+    """從 429 錯誤取出 Retry-After 秒數；不是速率限制錯誤則回傳 None"""
+    if status_code(error) != 429 and type(error).__name__ != 'RateLimitError':
+        return None
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for header in ('retry-after-ms', 'retry-after'):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000 if header == 'retry-after-ms' else seconds
+    return 0.0
+
+
+def run_coroutine(coroutine):
+    """在同步程式中執行 coroutine；目前執行緒已有事件迴圈時改到新執行緒執行"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    result = {}
+
+    def runner():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+class EmbeddingExecutor:
+    """批次嵌入執行器
+
+    - 依 token 數（並限制筆數）切分批次，避免超過 API 單次請求上限
+    - 以 asyncio 同時執行最多 concurrency 個批次
+    - 遇到 429 依 Retry-After 等待，5xx 與逾時等暫時性錯誤以指數退避重試，
+      其他錯誤（400、401、輸入無效）立即拋出
+    - 每完成一個批次即呼叫 on_batch（例如寫入嵌入快取），
+      中途失敗時已完成的批次不會遺失，下次只需嵌入剩下的部分
+    """
+
+    def __init__(self, embeddings, max_batch_tokens=DEFAULT_MAX_BATCH_TOKENS,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                 max_retries=DEFAULT_MAX_RETRIES):
+        self.embeddings = embeddings
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.stats = {'chunks': 0, 'batches': 0, 'retries': 0, 'seconds': 0.0}
+
+    @property
+    def chunks_per_second(self):
+        seconds = self.stats['seconds']
+        return self.stats['chunks'] / seconds if seconds else 0.0
+
+    def make_batches(self, texts):
+        """依 token 數切分，回傳每批的索引列表"""
+        batches, current, current_tokens = [], [], 0
+        for i, text in enumerate(texts):
+            tokens = count_tokens(text)
+            if current and (current_tokens + tokens > self.max_batch_tokens
+                            or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _embed_batch(self, semaphore, texts):
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return await self.embeddings.aembed_documents(texts)
+                except Exception as e:
+                    if attempt == self.max_retries or not is_retryable(e):
+                        raise
+                    wait = retry_after_seconds(e)
+                    if not wait:
+                        wait = min(60.0, 2 ** attempt) * (0.5 + random.random())
+                    self.stats['retries'] += 1
+                    print(f"嵌入批次失敗，{wait:.1f} 秒後重試 ({attempt + 1}/{self.max_retries}): {str(e)}")
+                    await asyncio.sleep(wait)
+
+    async def aembed(self, texts, on_batch=None):
+        """嵌入所有文本，回傳與 texts 對齊的向量列表"""
+        if not texts:
+            return []
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = [None] * len(texts)
+
+        async def run(indices):
+            batch = [texts[i] for i in indices]
+            vectors = await self._embed_batch(semaphore, batch)
+            for i, vector in zip(indices, vectors):
+                results[i] = vector
+            if on_batch is not None:
+                on_batch(batch, vectors)
+            self.stats['batches'] += 1
+            self.stats['chunks'] += len(batch)
+
+        try:
+            await asyncio.gather(*(run(indices) for indices in self.make_batches(texts)))
+        finally:
+            self.stats['seconds'] += time.perf_counter() - start
+        return results
+
+    def embed(self, texts, on_batch=None):
+        """同步版本的 aembed()"""
+        return run_coroutine(self.aembed(texts, on_batch=on_batch))
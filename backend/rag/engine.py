@@ -0,0 +1,378 @@
+import asyncio
+import os
+import threading
+import time
+from collections import namedtuple
+
+from langchain_core.prompts import format_document
+
+from rag.answer_cache import AnswerCache
+from rag.cache_backends import get_cache
+from rag.embedding_executor import count_tokens
+from rag.index_manager import read_index_version
+from rag.memory import DEFAULT_SUMMARY_TOKENS, question_with_history, retrieval_query, summarize_turns
+from rag.qa_system import format_answer, get_source_names, get_source_string, init_qa_system
+from rag.query import normalize_query
+from rag.router import QueryRouter
+from rag.tracing import add_tokens, current_trace, record_span, span
+
+# 檢索結果快取（namespace 為 retrieval:<索引版本>）的筆數上限（0 為停用）與保存秒數
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "5000"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "86400"))
+
+
+def build_prompt(chain, source_docs, question):
+    """以問答鏈的提示詞組合檢索結果與問題（與 RetrievalQA "stuff" 相同），回傳 (提示詞, context)"""
+    stuff_chain = chain.combine_documents_chain
+    context = stuff_chain.document_separator.join(
+        format_document(doc, stuff_chain.document_prompt) for doc in source_docs
+    )
+    return stuff_chain.llm_chain.prompt.format(context=context, question=question), context
+
+
+# 一個索引版本的問答鏈與其快取、路由器。重新載入時建立新的 EngineState 後以單一指派替換；
+# 每個請求開始時取得一次，處理期間重新載入也不會混用新舊版本的索引版本、路由器或快取
+EngineState = namedtuple('EngineState', [
+    'chain', 'index_version', 'manifest_path', 'cache', 'answer_cache', 'retrieval_cache', 'router'
+])
+
+
+class QAEngine:
+    """QA 系統的單一入口
+
+    - 延遲初始化：第一次使用時才建立問答鏈，也可由 warm_up() 預先建立
+    - 執行緒安全：多個執行緒同時請求時只會初始化一次
+    - 熱替換：索引更新後在背景建立新的 EngineState（問答鏈、索引版本、路由器與快取）再整個替換，
+      進行中的請求仍持有舊的 EngineState，不會被中斷，也不會把舊索引的答案存到新版本
+    - 答案快取：相同或近似的問題直接回傳先前的答案，索引版本變更時失效
+    - 共用快取：查詢嵌入、檢索結果與答案存在問答鏈的 QA 快取（rag.cache_backends），
+      使用 sqlite、redis 後端時多個 worker 共用，依索引版本分開
+    - 路由：條款查詢與高信心的 FAQ／標題比對直接以條文回答，不經向量搜尋與 LLM
+    每次回答都記錄服務路徑（clause、faq、cache、llm）與耗時，供比較各路徑的成本。
+    傳入對話記憶（rag.memory）時，提示詞加上摘要與最近幾輪對話，且不使用答案快取。
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, builder=init_qa_system, check_interval=30, **builder_kwargs):
+        self._builder = builder
+        self._builder_kwargs = builder_kwargs
+        self._state = None
+        self._init_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # 每隔 check_interval 秒檢查一次 manifest 是否被其他行程更新
+        self.check_interval = check_interval
+        self._last_check = 0.0
+        self._manifest_mtime = None
+        self.last_error = None
+        self.retrieval_cache_entries = RETRIEVAL_CACHE_MAX_ENTRIES
+        self.path_counts = {'clause': 0, 'faq': 0, 'routed_llm': 0, 'cache': 0, 'llm': 0}
+        self._counts_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """取得行程內共用的 QAEngine"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def configure(cls, **builder_kwargs):
+        """設定共用 QAEngine 建立問答鏈的參數（如 vector_backend），需在第一次使用前呼叫"""
+        engine = cls.instance()
+        engine._builder_kwargs.update(builder_kwargs)
+        return engine
+
+    @property
+    def is_ready(self):
+        return self._state is not None
+
+    @property
+    def index_version(self):
+        state = self._state
+        return state.index_version if state is not None else None
+
+    @property
+    def cache(self):
+        state = self._state
+        return state.cache if state is not None else None
+
+    @property
+    def answer_cache(self):
+        state = self._state
+        return state.answer_cache if state is not None else None
+
+    @property
+    def router(self):
+        state = self._state
+        return state.router if state is not None else None
+
+    def _build(self):
+        """建立新的 EngineState，不修改目前服務中的狀態"""
+        try:
+            chain = self._builder(**self._builder_kwargs)
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        if chain.metadata is None:
+            chain.metadata = {}
+        metadata = chain.metadata
+        index_version = metadata.get('index_version')
+        # 答案、檢索結果與查詢嵌入共用問答鏈的 QA 快取；檢索結果依索引版本分開
+        cache = metadata.get('cache') or get_cache()
+        retrieval_cache = cache.namespace(
+            f"retrieval:{index_version}", self.retrieval_cache_entries, RETRIEVAL_CACHE_TTL
+        )
+        # 第二層答案快取使用與檢索相同的（已快取的）嵌入模型；沿用目前答案快取的設定
+        previous = self.answer_cache
+        settings = {} if previous is None else {
+            'similarity_threshold': previous.similarity_threshold, 'ttl': previous.ttl,
+            'max_entries': previous.max_entries,
+        }
+        answer_cache = AnswerCache(getattr(chain.retriever, 'embeddings', None), cache=cache, **settings)
+        chunk_store = getattr(chain.retriever, 'chunk_store', None)
+        router = QueryRouter.from_chunk_store(
+            chunk_store, answer_cache.embeddings
+        ) if chunk_store is not None else None
+        return EngineState(chain, index_version, metadata.get('manifest_path'), cache, answer_cache,
+                           retrieval_cache, router)
+
+    def _install(self, state):
+        """以單一指派替換服務中的狀態，之後才刪除舊版本的檢索結果"""
+        self._manifest_mtime = self._read_manifest_mtime(state.manifest_path)
+        self._state = state
+        self._last_check = time.monotonic()
+        self.last_error = None
+        state.cache.drop_namespaces("retrieval", keep=f"retrieval:{state.index_version}")
+
+    @staticmethod
+    def _read_manifest_mtime(path):
+        try:
+            return os.stat(path).st_mtime if path else None
+        except OSError:
+            return None
+
+    def get_state(self):
+        """取得目前的 EngineState，尚未初始化時會阻塞直到建立完成"""
+        state = self._state
+        if state is not None:
+            self._check_for_update(state)
+            return state
+        with self._init_lock:
+            if self._state is None:
+                self._install(self._build())
+                print("QA 系統初始化成功")
+            return self._state
+
+    def get_chain(self):
+        """取得目前的問答鏈，尚未初始化時會阻塞直到建立完成"""
+        return self.get_state().chain
+
+    def warm_up(self):
+        """預先初始化（於 AppConfig.ready 呼叫），失敗時留待第一次請求重試"""
+        try:
+            self.get_state()
+        except Exception as e:
+            print(f"QA 系統預熱失敗: {str(e)}")
+
+    def reload(self):
+        """重新建立問答鏈後替換，建立期間既有的問答鏈照常服務"""
+        with self._reload_lock:
+            state = self._build()
+            self._install(state)
+            print(f"QA 系統已重新載入 (索引版本 {state.index_version})")
+            return state.chain
+
+    def _check_for_update(self, state):
+        """manifest 變更時在背景重新載入"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        mtime = self._read_manifest_mtime(state.manifest_path)
+        if mtime is None or mtime == self._manifest_mtime:
+            return
+        if self._reload_lock.locked():
+            return
+        self._manifest_mtime = mtime
+        if read_index_version(state.manifest_path) == state.index_version:
+            return
+        threading.Thread(target=self._reload_quietly, daemon=True).start()
+
+    def _reload_quietly(self):
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"QA 系統重新載入失敗，沿用目前版本: {str(e)}")
+
+    def invoke(self, question):
+        """以目前的問答鏈回答問題"""
+        return self.get_chain().invoke({"query": question})
+
+    def _to_payload(self, result, source_docs):
+        with span("citation"):
+            source_string = get_source_string(source_docs)
+            return {
+                "result": result,
+                "answer": format_answer(result, source_string),
+                "source": source_string,
+                "sources": get_source_names(source_docs),
+            }
+
+    def _build_prompt(self, chain, source_docs, question):
+        with span("prompt_build"):
+            prompt, context = build_prompt(chain, source_docs, question)
+        add_tokens("context", count_tokens(context))
+        add_tokens("prompt", count_tokens(prompt))
+        return prompt
+
+    def _stream_llm(self, chain, prompt):
+        """同步逐段呼叫 LLM，記錄第一個 token 與完成的時間"""
+        started = time.perf_counter()
+        first_token = None
+        for chunk in chain.combine_documents_chain.llm_chain.llm.stream(prompt):
+            if chunk.content:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    record_span("llm_first_token", started, first_token - started)
+                yield chunk.content
+        record_span("llm_completion", started, time.perf_counter() - started)
+
+    @staticmethod
+    def _route(state, question):
+        """路由器的結果（見 QueryRouter.route），沒有路由器或找不到對應條文時回傳 None"""
+        if state.router is None:
+            return None
+        return state.router.route(question)
+
+    def _routed_answer(self, routed):
+        """路由器直接回答的結果"""
+        source_docs = routed['source_documents']
+        return dict(self._to_payload(routed['result'], source_docs), source_documents=source_docs,
+                    cache=None, path=routed['path'], confidence=routed['confidence'])
+
+    def _retrieve(self, state, query):
+        """檢索並以正規化後的查詢快取結果（屬於 state 的索引版本，重新載入期間不會混用）"""
+        chain, namespace = state.chain, state.retrieval_cache
+        if self.retrieval_cache_entries <= 0:
+            return chain.retriever.invoke(query)
+        key = normalize_query(query)
+        with span("retrieval_cache_lookup") as attrs:
+            source_docs = namespace.get(key)
+            attrs["hit"] = source_docs is not None
+        if source_docs is None:
+            source_docs = chain.retriever.invoke(query)
+            namespace.set(key, source_docs)
+        return source_docs
+
+    def path_stats(self):
+        """各服務路徑的回答次數（快照）"""
+        with self._counts_lock:
+            return dict(self.path_counts)
+
+    def _finish(self, payload, started):
+        # WSGI 執行緒、astream 與預熱執行緒共用同一個引擎，計數需加鎖
+        with self._counts_lock:
+            self.path_counts[payload['path']] += 1
+        payload['latency_ms'] = int((time.perf_counter() - started) * 1000)
+        trace = current_trace()
+        if trace is not None:
+            trace.attrs.update(path=payload['path'], cache=payload.get('cache'))
+        return payload
+
+    def summarize(self, summary, turns, max_tokens=DEFAULT_SUMMARY_TOKENS):
+        """以問答鏈的 LLM 將較舊的對話併入摘要"""
+        llm = self.get_chain().combine_documents_chain.llm_chain.llm
+        return summarize_turns(llm, summary, turns, max_tokens)
+
+    def answer(self, question, memory=None):
+        """回答問題並附上參考來源，優先使用答案快取
+
+        memory 為對話記憶 {'summary', 'turns'}（見 rag.memory），有記錄時不使用答案快取。
+        回傳 dict：result（模型原始回答）、answer（附參考來源）、source、sources（來源文件名稱）、
+        source_documents、cache（'exact'、'semantic' 或 None）、
+        path（'clause'、'faq'、'routed_llm'、'cache' 或 'llm'）與 latency_ms。
+        """
+        started = time.perf_counter()
+        state = self.get_state()
+        chain = state.chain
+        with span("route"):
+            routed = self._route(state, question)
+        if routed is not None and routed['direct']:
+            return self._finish(self._routed_answer(routed), started)
+
+        # 追問的答案依賴先前的對話，不能與其他對話共用快取
+        prompt_question = question_with_history(question, memory)
+        use_cache = prompt_question == question
+        if use_cache:
+            with span("cache_lookup"):
+                cached, level = state.answer_cache.get(question, state.index_version)
+            if cached is not None:
+                return self._finish(dict(cached, source_documents=[], cache=level, path='cache'), started)
+
+        # 路由器找到的條文作為唯一的 context，不需向量搜尋
+        if routed is not None:
+            source_docs, path = routed['source_documents'], routed['path']
+        else:
+            source_docs, path = self._retrieve(state, retrieval_query(question, memory)), 'llm'
+        prompt = self._build_prompt(chain, source_docs, prompt_question)
+        result = "".join(self._stream_llm(chain, prompt))
+        add_tokens("completion", count_tokens(result))
+        payload = self._to_payload(result, source_docs)
+        if use_cache:
+            state.answer_cache.put(question, payload, state.index_version)
+        return self._finish(dict(payload, source_documents=source_docs, cache=None, path=path), started)
+
+    async def astream(self, question, memory=None):
+        """逐 token 產生回答
+
+        依序產生 ("token", 文字片段)，最後產生 ("done", 與 answer() 相同格式的結果)。
+        檢索與提示詞與 answer() 相同，只有 LLM 改為非同步串流呼叫；
+        由路由器直接回答或命中答案快取時，整段回答以單一 token 送出。
+        """
+        started = time.perf_counter()
+        state = await asyncio.to_thread(self.get_state)
+        chain = state.chain
+        with span("route"):
+            routed = await asyncio.to_thread(self._route, state, question)
+        if routed is not None and routed['direct']:
+            yield "token", routed["result"]
+            yield "done", self._finish(self._routed_answer(routed), started)
+            return
+
+        # 追問的答案依賴先前的對話，不能與其他對話共用快取
+        prompt_question = question_with_history(question, memory)
+        use_cache = prompt_question == question
+        if use_cache:
+            with span("cache_lookup"):
+                cached, level = await asyncio.to_thread(state.answer_cache.get, question, state.index_version)
+            if cached is not None:
+                yield "token", cached["result"]
+                yield "done", self._finish(dict(cached, source_documents=[], cache=level, path='cache'), started)
+                return
+
+        if routed is not None:
+            source_docs, path = routed['source_documents'], routed['path']
+        else:
+            source_docs = await asyncio.to_thread(self._retrieve, state, retrieval_query(question, memory))
+            path = 'llm'
+        prompt = self._build_prompt(chain, source_docs, prompt_question)
+
+        result = ""
+        llm_started = time.perf_counter()
+        async for chunk in chain.combine_documents_chain.llm_chain.llm.astream(prompt):
+            if chunk.content:
+                if not result:
+                    record_span("llm_first_token", llm_started, time.perf_counter() - llm_started)
+                result += chunk.content
+                yield "token", chunk.content
+        record_span("llm_completion", llm_started, time.perf_counter() - llm_started)
+        add_tokens("completion", count_tokens(result))
+
+        payload = self._to_payload(result, source_docs)
+        if use_cache:
+            await asyncio.to_thread(state.answer_cache.put, question, payload, state.index_version)
+        yield "done", self._finish(dict(payload, source_documents=source_docs, cache=None, path=path), started)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rag.clauses import extract_clauses, is_within
+from rag.engine import build_prompt
+from rag.query import normalize_query
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_QUESTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_questions.jsonl")
+DEFAULT_ANSWER_STORE = os.getenv("EVAL_ANSWER_STORE", os.path.join(BASE_DIR, "eval_cache", "answers.sqlite3"))
+DEFAULT_EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "4"))
+
+
+def load_questions(path=DEFAULT_QUESTIONS_FILE):
+    """讀取評估問題（JSON lines），每行為 {"question", "reference"（選填）, "clauses"（標註的條款編號）}"""
+    items = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                item.setdefault('reference', '')
+                item.setdefault('clauses', [])
+                items.append(item)
+    return items
+
+
+def document_clauses(doc):
+    """文件中出現的條款編號（合併後的段落 metadata 可能只有第一段的編號，另從內文擷取）"""
+    return set(doc.metadata.get('clauses') or []) | set(extract_clauses(doc.page_content))
+
+
+def context_hash(docs):
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(doc.page_content.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def score_retrieval(labels, docs):
+    """單題的 recall（標註條款有幾成出現在結果中）與 reciprocal rank（第一個命中的名次倒數）
+
+    檢索到的條款為標註條款本身或其子條款才算命中。
+    """
+    found = set()
+    reciprocal_rank = 0.0
+    for rank, doc in enumerate(docs, start=1):
+        clauses = document_clauses(doc)
+        hits = {label for label in labels if any(is_within(clause, label) for clause in clauses)}
+        if hits and not reciprocal_rank:
+            reciprocal_rank = 1.0 / rank
+        found |= hits
+    return {
+        'recall': len(found) / len(labels) if labels else None,
+        'reciprocal_rank': reciprocal_rank,
+        'missing': sorted(set(labels) - found),
+    }
+
+
+class AnswerStore:
+    """評估產生的回答快取，以 (模型, 問題, context 雜湊) 為鍵
+
+    檢索結果或模型不變時重跑評估不需再呼叫 LLM；索引或分割設定改變使 context 不同時自然失效。
+    """
+
+    def __init__(self, path=DEFAULT_ANSWER_STORE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT NOT NULL, created_at REAL)"
+            )
+            self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, question, context_digest):
+        return hashlib.sha256(f"{model}\0{question}\0{context_digest}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, answer):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, created_at) VALUES (?, ?, ?)",
+                (key, answer, time.time())
+            )
+            self._conn.commit()
+
+
+def model_name(llm):
+    return getattr(llm, 'model_name', None) or getattr(llm, 'model', None) or type(llm).__name__
+
+
+class EvaluationRunner:
+    """以正式的問答鏈（持久化索引、嵌入快取、同樣的檢索器與提示詞）執行評估
+
+    檢索與生成都以最多 workers 個執行緒並行；生成的回答存入 AnswerStore。
+    """
+
+    def __init__(self, chain, answer_store=None, workers=DEFAULT_EVAL_WORKERS):
+        self.chain = chain
+        self.answer_store = answer_store
+        self.workers = max(1, workers)
+        self.llm = chain.combine_documents_chain.llm_chain.llm
+        self.model = model_name(self.llm)
+
+    def _map(self, func, items):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(func, items))
+
+    def retrieve(self, items):
+        """回傳每題檢索到的文件（與送進提示詞的 context 相同）
+
+        使用正式的檢索器，評估結果與線上服務一致：問題以 embed_query 並行嵌入（經查詢嵌入快取），
+        再疊成一個矩陣以 VectorRetriever.batch_documents 一次計算整個問題集的向量分數。
+        """
+        retriever = self.chain.retriever
+        questions = [normalize_query(item['question']) for item in items]
+        vectors = self._map(retriever.embeddings.embed_query, questions)
+        return retriever.batch_documents(questions, vectors)
+
+    def evaluate_retrieval(self, items, retrieved):
+        """不呼叫 LLM，以標註的條款計算 recall 與 MRR"""
+        rows = []
+        for item, docs in zip(items, retrieved):
+            rows.append(dict(score_retrieval(item['clauses'], docs), question=item['question']))
+        labelled = [row for row in rows if row['recall'] is not None]
+        summary = {
+            'questions': len(rows),
+            'labelled': len(labelled),
+            'recall': round(sum(row['recall'] for row in labelled) / len(labelled), 4) if labelled else None,
+            'mrr': round(sum(row['reciprocal_rank'] for row in labelled) / len(labelled), 4) if labelled else None,
+            'hit_rate': round(sum(1 for row in labelled if row['reciprocal_rank']) / len(labelled), 4)
+            if labelled else None,
+        }
+        return summary, rows
+
+    def _answer(self, args):
+        item, docs = args
+        key = AnswerStore.key(self.model, item['question'], context_hash(docs))
+        if self.answer_store is not None:
+            cached = self.answer_store.get(key)
+            if cached is not None:
+                return cached
+        prompt, _ = build_prompt(self.chain, docs, item['question'])
+        answer = self.llm.invoke(prompt).content
+        if self.answer_store is not None:
+            self.answer_store.put(key, answer)
+        return answer
+
+    def generate(self, items, retrieved):
+        """並行產生回答，已快取的 (模型, 問題, context) 直接沿用"""
+        return self._map(self._answer, list(zip(items, retrieved)))
@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from typing import Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from rag.lexical_index import tokenize
+
+# 離線模型的延遲設定（毫秒、token/秒），供負載測試模擬 API 的回應時間
+FAKE_EMBED_MS = float(os.getenv("FAKE_EMBED_MS", "0"))
+FAKE_LLM_FIRST_TOKEN_MS = float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "300"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50"))
+
+ANSWER_TOKEN_PATTERN = re.compile(r'[一-鿿]|\d+(?:\.\d+)*|[A-Za-z]+')
+
+
+class HashEmbeddings(Embeddings):
+    """以 feature hashing 產生的確定性嵌入，不需 API
+
+    與 BM25 相同的斷詞（中文雙字詞、條款編號）雜湊到 dim 維並正規化，
+    用詞相近的文本向量也相近，檢索結果具參考意義。
+    latency 為每次呼叫的延遲（秒），可模擬嵌入 API 的往返時間。
+    """
+
+    def __init__(self, dim=256, latency=FAKE_EMBED_MS / 1000):
+        self.dim = dim
+        self.latency = latency
+        self.model = f"hash-{dim}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text) or [text]:
+            digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """確定性的離線聊天模型，延遲與輸出速度可設定
+
+    回答由提示詞中的文字（含檢索到的條文）組成，長度為 response_tokens 個 token；
+    第一個 token 前等待 first_token_latency 秒，之後每秒輸出 tokens_per_second 個 token。
+    """
+
+    first_token_latency: float = FAKE_LLM_FIRST_TOKEN_MS / 1000
+    tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND
+    response_tokens: int = 80
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _tokens(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        tokens = ANSWER_TOKEN_PATTERN.findall(prompt)
+        # 取提示詞後段（檢索到的條文），使不同問題得到不同的回答
+        return tokens[-self.response_tokens:] or ["無"]
+
+    def _token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        tokens = self._tokens(messages)
+        time.sleep(self.first_token_latency + self._token_delay() * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        time.sleep(self.first_token_latency)
+        for index, token in enumerate(self._tokens(messages)):
+            if index:
+                time.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.first_token_latency)
+        for index, token in enumerate(self._tokens(messages)):
+            if index:
+                await asyncio.sleep(self._token_delay())
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from rag.ingest import IngestionPipeline
+
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".lock"
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """計算文件內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_chunk_ids(filename, content_hash, count, kind=""):
+    """依文件名與內容雜湊產生穩定的 chunk ID，重複寫入時可保持冪等
+
+    kind 用於區分同一文件的其他記錄（父段落為 "p"）。
+    """
+    prefix = hashlib.sha1(f"{filename}:{content_hash}".encode('utf-8')).hexdigest()[:20]
+    return [f"{prefix}-{kind}{i:05d}" for i in range(count)]
+
+
+@contextmanager
+def index_lock(index_dir):
+    """索引目錄的跨行程排他鎖（<index_dir>/.lock）
+
+    多個 worker 同時啟動時只有一個會同步索引（重設、嵌入、寫入向量檔與 manifest），
+    其他 worker 等待後才開啟同步完成的索引。不支援 fcntl 的平台不加鎖。
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, LOCK_NAME), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_index_version(manifest_path):
+    """只讀取 manifest 中的索引版本，不建立 IndexManager"""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('version')
+    except (OSError, ValueError):
+        return None
+
+
+class IndexManager:
+    """以 manifest 追蹤已索引文件的增量向量索引
+
+    manifest 記錄每個文件的內容雜湊與對應的 chunk ID：
+    啟動時只重新嵌入新增或內容變更的文件，並刪除已移除文件的 chunk，
+    其餘文件直接沿用持久化的向量後端（VectorBackend）與 ChunkStore。
+    """
+
+    def __init__(self, backend, chunk_store, embeddings, persist_directory, text_splitter, loader,
+                 config=None, pipeline=None, lexical_index=None):
+        self.backend = backend
+        self.chunk_store = chunk_store
+        # 選用的 BM25 倒排索引（LexicalIndex），與向量後端同步更新
+        self.lexical_index = lexical_index
+        self.embeddings = embeddings
+        self.persist_directory = persist_directory
+        self.text_splitter = text_splitter
+        self.loader = loader
+        # 影響向量內容的設定（嵌入模型、分割參數），變更時需整個重建
+        self.config = config or {}
+        self.manifest_path = os.path.join(persist_directory, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        # 解析與分割在行程池中平行執行，並批次嵌入
+        self.pipeline = pipeline or IngestionPipeline(loader, text_splitter, embeddings=embeddings)
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"manifest 讀取失敗，將重建索引: {str(e)}")
+            return None
+
+    def _save_manifest(self):
+        """先寫入暫存檔再替換，避免中途中斷留下損壞的 manifest"""
+        self.manifest['version'] = self._compute_version()
+        self.manifest['updated_at'] = time.time()
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _compute_version(self):
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self.config, sort_keys=True).encode('utf-8'))
+        for name in sorted(self.manifest['files']):
+            digest.update(f"{name}:{self.manifest['files'][name]['sha256']}".encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    @property
+    def version(self):
+        """目前索引內容的版本，文件或設定變動時會改變"""
+        return self.manifest.get('version') if self.manifest else None
+
+    @property
+    def chunk_count(self):
+        if not self.manifest:
+            return 0
+        return sum(len(entry['chunk_ids']) for entry in self.manifest['files'].values())
+
+    def _reset(self):
+        """清空向量索引與 chunk 內容（設定變更或 manifest 遺失）"""
+        existing_ids = self.backend.ids()
+        if existing_ids:
+            self.backend.delete(existing_ids)
+            print(f"已清除 {len(existing_ids)} 筆舊的向量資料")
+        self.chunk_store.clear()
+        if self.lexical_index is not None:
+            self.lexical_index.clear()
+        self.manifest = {'config': self.config, 'files': {}}
+
+    def _scan(self, docs_dir):
+        files = {}
+        for filename in sorted(os.listdir(docs_dir)):
+            file_path = os.path.join(docs_dir, filename)
+            if os.path.isfile(file_path):
+                files[filename] = file_path
+        return files
+
+    def _file_changed(self, entry, file_path):
+        """先比對大小與修改時間，相同則不必重新計算雜湊"""
+        stat = os.stat(file_path)
+        if entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            return False, entry['sha256']
+        content_hash = file_sha256(file_path)
+        return content_hash != entry['sha256'], content_hash
+
+    def _store_chunks(self, filename, content_hash, chunks, vectors, parents=()):
+        """寫入單一文件的 chunk、向量與父段落，回傳 (chunk ID, 父段落 ID)"""
+        chunk_ids = make_chunk_ids(filename, content_hash, len(chunks))
+        parent_ids = make_chunk_ids(filename, content_hash, len(parents), kind="p")
+        if parents:
+            self.chunk_store.add_parents(parent_ids, parents)
+            for chunk in chunks:
+                chunk.metadata['parent_id'] = parent_ids[chunk.metadata.pop('parent_index')]
+        if chunks:
+            if vectors is None:
+                vectors = self.embeddings.embed_documents([chunk.page_content for chunk in chunks])
+            self.chunk_store.add(chunk_ids, chunks)
+            self.backend.add(chunk_ids, vectors)
+            if self.lexical_index is not None:
+                self.lexical_index.add(chunk_ids, [chunk.page_content for chunk in chunks])
+        return chunk_ids, parent_ids
+
+    def _delete_chunks(self, chunk_ids, parent_ids=()):
+        if parent_ids:
+            self.chunk_store.delete_parents(parent_ids)
+        if chunk_ids:
+            self.backend.delete(chunk_ids)
+            self.chunk_store.delete(chunk_ids)
+            if self.lexical_index is not None:
+                self.lexical_index.delete(chunk_ids)
+
+    def _backfill_lexical_index(self):
+        """既有索引尚未建立倒排索引時，直接從 ChunkStore 補建，不需重新嵌入"""
+        if self.lexical_index is None or len(self.lexical_index) == len(self.chunk_store):
+            return False
+        self.lexical_index.clear()
+        chunk_ids = self.chunk_store.ids()
+        for start in range(0, len(chunk_ids), 1000):
+            docs = self.chunk_store.get_many(chunk_ids[start:start + 1000])
+            self.lexical_index.add([doc.id for doc in docs], [doc.page_content for doc in docs])
+        print(f"已從 chunk 內容補建倒排索引: {len(chunk_ids)} 個 chunk")
+        return True
+
+    def sync(self, docs_dir):
+        """將向量資料庫與文件目錄同步，回傳各類變動的統計
+
+        多個行程共用同一個索引目錄時，需在 index_lock 內開啟索引（建立後端與 IndexManager）並同步，
+        見 rag.qa_system.build_index。
+        """
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'failed': 0,
+                 'chunks_added': 0, 'chunks_deleted': 0}
+
+        if self.manifest is None or self.manifest.get('config') != self.config:
+            self._reset()
+
+        indexed = self.manifest['files']
+        current = self._scan(docs_dir)
+        # 沒有任何變動時不重寫 manifest，避免其他行程誤判索引已更新
+        dirty = 'version' not in self.manifest
+
+        # 先找出需要（重新）索引的文件，再交給管線平行處理
+        pending = {}
+        for filename, file_path in current.items():
+            entry = indexed.get(filename)
+            if entry is None:
+                content_hash = file_sha256(file_path)
+            else:
+                changed, content_hash = self._file_changed(entry, file_path)
+                if not changed:
+                    # 內容相同但修改時間變了，只更新 stat 資訊
+                    stat = os.stat(file_path)
+                    if (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime):
+                        entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime
+                        dirty = True
+                    stats['unchanged'] += 1
+                    continue
+            pending[file_path] = (filename, content_hash)
+
+        for file_path, chunks, vectors, parents in self.pipeline.run(pending):
+            filename, content_hash = pending[file_path]
+            entry = indexed.get(filename)
+            if chunks is None:
+                # 載入失敗的文件不寫入 manifest（已索引的舊版本保留），下次同步時重試
+                stats['failed'] += 1
+                continue
+
+            # 先寫入新的 chunk 再刪除舊的，中途失敗時不會讓文件整個消失
+            chunk_ids, parent_ids = self._store_chunks(filename, content_hash, chunks, vectors, parents)
+            if entry is not None:
+                new_ids = set(chunk_ids) | set(parent_ids)
+                stale_ids = [cid for cid in entry['chunk_ids'] if cid not in new_ids]
+                stale_parent_ids = [pid for pid in entry.get('parent_ids', []) if pid not in new_ids]
+                self._delete_chunks(stale_ids, stale_parent_ids)
+                stats['chunks_deleted'] += len(stale_ids)
+                stats['updated'] += 1
+            else:
+                stats['added'] += 1
+            stats['chunks_added'] += len(chunk_ids)
+
+            stat = os.stat(file_path)
+            indexed[filename] = {
+                'sha256': content_hash,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'chunk_ids': chunk_ids,
+                'parent_ids': parent_ids,
+            }
+
+        for filename in [name for name in indexed if name not in current]:
+            entry = indexed.pop(filename)
+            chunk_ids = entry['chunk_ids']
+            self._delete_chunks(chunk_ids, entry.get('parent_ids', []))
+            stats['removed'] += 1
+            stats['chunks_deleted'] += len(chunk_ids)
+            dirty = True
+
+        backfilled = self._backfill_lexical_index()
+
+        # 向量後端持久化後才寫入 manifest；中途失敗時下次會重新處理這些文件，
+        # chunk ID 固定且嵌入已在快取中，重做的成本很低
+        if dirty or stats['added'] or stats['updated']:
+            self.backend.commit()
+            if self.lexical_index is not None:
+                self.lexical_index.commit()
+            self._save_manifest()
+        elif backfilled:
+            self.lexical_index.commit()
+        return stats
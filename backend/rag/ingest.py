@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from rag.clauses import annotate_clauses
+from rag.embedding_executor import DEFAULT_CONCURRENCY, DEFAULT_MAX_BATCH_TOKENS, count_tokens
+
+DEFAULT_PARSE_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+# 累積多少 token 的 chunk（可跨文件）才送去嵌入，預設讓每個並行的嵌入批次都能填滿
+DEFAULT_EMBED_GROUP_TOKENS = int(os.getenv("INGEST_EMBED_TOKENS", "0")) or DEFAULT_MAX_BATCH_TOKENS * DEFAULT_CONCURRENCY
+
+
+def parse_and_split(file_path, loader, text_splitter):
+    """在工作行程中載入並分割單一文件，並將條款編號記錄於 chunk metadata
+
+    回傳 (file_path, chunks, parents)；splitter 為父子分割（ParentChildSplitter）時
+    parents 為父段落，否則為空列表。載入失敗時 chunks 與 parents 為 None。
+    """
+    try:
+        docs = loader(file_path)
+    except Exception as e:
+        print(f"無法載入文件 {file_path}: {str(e)}")
+        return file_path, None, None
+    if hasattr(text_splitter, 'split_with_parents'):
+        parents, chunks = text_splitter.split_with_parents(docs)
+    else:
+        parents, chunks = [], text_splitter.split_documents(docs)
+    return file_path, annotate_clauses(chunks), annotate_clauses(parents)
+
+
+class IngestionPipeline:
+    """串流式文件處理管線
+
+    1. 解析 + 清理 + 分割：在行程池中平行執行，同時最多只有 max_pending 個文件在處理中，
+       記憶體用量與文件總數無關
+    2. 批次嵌入：多個文件的 chunk 累積到 embed_group_tokens 個 token 後一起交給 embeddings
+       （CachedEmbeddings 內的 EmbeddingExecutor 會依 token 數分批、並行呼叫並處理速率限制），
+       小文件不會各自送出不滿的批次；嵌入在背景執行緒進行，同時繼續解析後面的文件
+    結果依完成順序逐一產生 (file_path, chunks, vectors, parents)，呼叫端可邊處理邊寫入向量資料庫。
+    """
+
+    def __init__(self, loader, text_splitter, embeddings=None, parse_workers=DEFAULT_PARSE_WORKERS,
+                 max_pending=None, embed_group_tokens=DEFAULT_EMBED_GROUP_TOKENS):
+        self.loader = loader
+        self.text_splitter = text_splitter
+        self.embeddings = embeddings
+        self.parse_workers = max(1, parse_workers)
+        self.max_pending = max_pending or self.parse_workers * 2
+        self.embed_group_tokens = embed_group_tokens
+        self.stats = {'files': 0, 'chunks': 0, 'failed': 0, 'seconds': 0.0}
+
+    def _parsed(self, file_paths):
+        if self.parse_workers == 1 or len(file_paths) <= 1:
+            # 文件很少時不值得啟動行程池
+            for file_path in file_paths:
+                yield parse_and_split(file_path, self.loader, self.text_splitter)
+            return
+
+        # 使用 spawn：伺服器行程中可能已有其他執行緒，fork 並不安全
+        context = multiprocessing.get_context('spawn')
+        workers = min(self.parse_workers, len(file_paths))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            remaining = iter(file_paths)
+            pending = set()
+            for file_path in remaining:
+                pending.add(pool.submit(parse_and_split, file_path, self.loader, self.text_splitter))
+                if len(pending) >= self.max_pending:
+                    break
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    next_path = next(remaining, None)
+                    if next_path is not None:
+                        pending.add(pool.submit(parse_and_split, next_path, self.loader, self.text_splitter))
+
+    def _embed_group(self, group):
+        """一次嵌入多個文件的 chunk，再依文件切回"""
+        texts = [chunk.page_content for _, chunks, _ in group for chunk in chunks or []]
+        vectors = self.embeddings.embed_documents(texts) if texts else []
+        results, offset = [], 0
+        for file_path, chunks, parents in group:
+            count = len(chunks or [])
+            results.append((file_path, chunks, vectors[offset:offset + count] if chunks else None, parents))
+            offset += count
+        return results
+
+    def _groups(self, file_paths):
+        """將解析結果依 token 數分組；未設定 embeddings 時每個文件自成一組"""
+        group, tokens = [], 0
+        for parsed in self._parsed(file_paths):
+            group.append(parsed)
+            if self.embeddings is not None:
+                tokens += sum(count_tokens(chunk.page_content) for chunk in parsed[1] or [])
+            if self.embeddings is None or tokens >= self.embed_group_tokens:
+                yield group
+                group, tokens = [], 0
+        if group:
+            yield group
+
+    def run(self, file_paths):
+        """處理文件並逐一產生 (file_path, chunks, vectors, parents)
+
+        未設定 embeddings 時 vectors 為 None；載入失敗的文件 chunks 為 None。
+        只有 chunks 會被嵌入，父段落不需要向量。
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='embed') as embedder:
+            embedding = None
+            for group in self._groups(list(file_paths)):
+                if self.embeddings is None:
+                    results = [(file_path, chunks, None, parents) for file_path, chunks, parents in group]
+                    yield from self._finish(results, start)
+                    continue
+                # 前一組嵌入完成前不再送出下一組，同時最多一組在嵌入、一組在解析
+                if embedding is not None:
+                    yield from self._finish(embedding.result(), start)
+                embedding = embedder.submit(self._embed_group, group)
+            if embedding is not None:
+                yield from self._finish(embedding.result(), start)
+
+    def _finish(self, results, start):
+        for file_path, chunks, vectors, parents in results:
+            if chunks is None:
+                self.stats['failed'] += 1
+            else:
+                self.stats['files'] += 1
+                self.stats['chunks'] += len(chunks)
+            self.stats['seconds'] = time.perf_counter() - start
+            yield file_path, chunks, vectors, parents
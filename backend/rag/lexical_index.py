@@ -0,0 +1,201 @@
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+# 條款編號（7.5.1）與英數字詞整個保留；中文連續字串切成字元 bigram
+TOKEN_PATTERN = re.compile(r'[0-9]+(?:\.[0-9]+)*|[a-z]+|[㐀-䶿一-鿿豈-﫿]+')
+CJK_PATTERN = re.compile(r'[㐀-䶿一-鿿豈-﫿]')
+
+
+def tokenize(text, expand_clauses=False):
+    """將文字切成 BM25 詞彙
+
+    中文沒有空白分詞，改用字元 bigram（單字成詞時保留單字）。
+    expand_clauses=True 時條款編號另外加入上層編號（7.5.1.2 → 7.5.1、7.5），
+    讓查詢 7.5.1 也能命中其子條款；只在建立索引時使用。
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(unicodedata.normalize('NFKC', text).lower()):
+        token = match.group()
+        if CJK_PATTERN.match(token):
+            if len(token) == 1:
+                tokens.append(token)
+            else:
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        elif expand_clauses and '.' in token:
+            parts = token.split('.')
+            tokens.extend('.'.join(parts[:i]) for i in range(len(parts), 1, -1))
+        else:
+            tokens.append(token)
+    return tokens
+
+
+class LexicalIndex:
+    """以 BM25 評分的倒排索引，與向量後端一起增量更新
+
+    postings 以 CSR 陣列保存（offsets / docs / tfs），整個索引存成單一 .npz。
+    新增的 chunk 先暫存在記憶體，刪除以墓碑標記；搜尋或 commit() 時才合併重建陣列。
+    """
+
+    filename = "lexical.npz"
+
+    def __init__(self, persist_directory, k1=1.2, b=0.75):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.path = os.path.join(persist_directory, self.filename)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._ids = []
+        self._slots = {}
+        self._deleted = set()
+        self._terms = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._docs = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.float32)
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._pending = []
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path) as data:
+            self._ids = data['ids'].tolist()
+            self._terms = {term: i for i, term in enumerate(data['terms'].tolist())}
+            self._offsets = data['offsets']
+            self._docs = data['docs']
+            self._tfs = data['tfs']
+            self._doc_len = data['doc_len']
+        self._slots = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+
+    def add(self, ids, texts):
+        """加入（或覆蓋）chunk 文字"""
+        with self._lock:
+            self._delete([chunk_id for chunk_id in ids if chunk_id in self._slots])
+            for chunk_id, text in zip(ids, texts):
+                self._slots[chunk_id] = len(self._ids)
+                self._ids.append(chunk_id)
+                self._pending.append(tokenize(text, expand_clauses=True))
+            self._dirty = True
+
+    def _delete(self, ids):
+        for chunk_id in ids:
+            slot = self._slots.pop(chunk_id, None)
+            if slot is not None:
+                self._deleted.add(slot)
+                self._dirty = True
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+
+    def clear(self):
+        with self._lock:
+            self._ids, self._slots, self._deleted = [], {}, set()
+            self._terms = {}
+            self._offsets = np.zeros(1, dtype=np.int64)
+            self._docs = np.zeros(0, dtype=np.int32)
+            self._tfs = np.zeros(0, dtype=np.float32)
+            self._doc_len = np.zeros(0, dtype=np.float32)
+            self._pending = []
+            self._dirty = True
+
+    def _rebuild(self):
+        """合併暫存的新增、移除墓碑，重新排列為 CSR postings"""
+        base_count = len(self._doc_len)
+        # 既有 postings 展開為 (term, slot, tf) 三元組
+        term_col = [np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets))]
+        slot_col = [self._docs.astype(np.int64)]
+        tf_col = [self._tfs]
+        doc_len = [self._doc_len]
+
+        for i, tokens in enumerate(self._pending):
+            counts = {}
+            for token in tokens:
+                term_id = self._terms.setdefault(token, len(self._terms))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            term_col.append(np.fromiter(counts.keys(), dtype=np.int64, count=len(counts)))
+            slot_col.append(np.full(len(counts), base_count + i, dtype=np.int64))
+            tf_col.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            doc_len.append(np.array([len(tokens)], dtype=np.float32))
+
+        terms = np.concatenate(term_col)
+        slots = np.concatenate(slot_col)
+        tfs = np.concatenate(tf_col)
+        doc_len = np.concatenate(doc_len)
+
+        # 移除墓碑並將 slot 重新編號為連續整數
+        keep_slots = np.ones(len(self._ids), dtype=bool)
+        keep_slots[list(self._deleted)] = False
+        remap = np.cumsum(keep_slots) - 1
+        keep = keep_slots[slots]
+        terms, slots, tfs = terms[keep], remap[slots[keep]], tfs[keep]
+
+        order = np.lexsort((slots, terms))
+        self._docs = slots[order].astype(np.int32)
+        self._tfs = tfs[order]
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(terms, minlength=len(self._terms))))).astype(np.int64)
+        self._doc_len = doc_len[keep_slots]
+        self._ids = [chunk_id for chunk_id, kept in zip(self._ids, keep_slots) if kept]
+        self._slots = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+        self._deleted = set()
+        self._pending = []
+
+    def commit(self):
+        """合併變更並寫入磁碟（先寫暫存檔再替換）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._rebuild()
+            terms = sorted(self._terms, key=self._terms.get)
+            tmp_path = self.path + '.tmp.npz'
+            np.savez(
+                tmp_path,
+                ids=np.array(self._ids, dtype=str),
+                terms=np.array(terms, dtype=str),
+                offsets=self._offsets,
+                docs=self._docs,
+                tfs=self._tfs,
+                doc_len=self._doc_len
+            )
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def search(self, query, k):
+        """回傳 [(chunk_id, BM25 分數)]，依分數由高到低，只含至少命中一個詞的 chunk"""
+        with self._lock:
+            if self._pending or self._deleted:
+                self._rebuild()
+            count = len(self._ids)
+            term_ids = {self._terms[token] for token in tokenize(query) if token in self._terms}
+            if not count or not term_ids:
+                return []
+
+            avg_len = float(self._doc_len.mean()) or 1.0
+            norm = self.k1 * (1 - self.b + self.b * self._doc_len / avg_len)
+            scores = np.zeros(count, dtype=np.float32)
+            for term_id in term_ids:
+                start, end = self._offsets[term_id], self._offsets[term_id + 1]
+                if start == end:
+                    continue
+                docs, tfs = self._docs[start:end], self._tfs[start:end]
+                df = end - start
+                idf = np.log(1 + (count - df + 0.5) / (df + 0.5))
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+            matched = np.flatnonzero(scores)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            matched = matched[np.argsort(-scores[matched], kind='stable')]
+            return [(self._ids[slot], float(scores[slot])) for slot in matched]
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def nbytes(self):
+        return int(self._offsets.nbytes + self._docs.nbytes + self._tfs.nbytes + self._doc_len.nbytes)
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+def normalize_rows(vectors):
+    """轉為連續的 float32 矩陣並將每列正規化為單位向量"""
+    matrix = np.ascontiguousarray(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class MatrixIndex:
+    """精確 cosine 相似度搜尋
+
+    文件向量預先正規化後存成連續的 float32 矩陣，查詢只需一次矩陣乘法，
+    再以 argpartition 取 top-k，不必排序整個分數陣列。
+    多個查詢可一次以矩陣乘矩陣計算。適合約十萬個 chunk 以下的語料。
+    """
+
+    def __init__(self, vectors=None):
+        self._matrix = None
+        self._size = 0
+        if vectors is not None and len(vectors):
+            self.add(vectors)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dim(self):
+        return self._matrix.shape[1] if self._matrix is not None else None
+
+    @property
+    def matrix(self):
+        """目前有效的（已正規化）向量矩陣"""
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def add(self, vectors):
+        """加入向量，回傳其在索引中的位置"""
+        rows = normalize_rows(vectors)
+        if self._matrix is None:
+            self._matrix = rows.copy()
+        else:
+            needed = self._size + len(rows)
+            if needed > self._matrix.shape[0]:
+                # 容量加倍，避免每次加入都複製整個矩陣
+                grown = np.empty((max(needed, self._matrix.shape[0] * 2), self.dim), dtype=np.float32)
+                grown[:self._size] = self._matrix[:self._size]
+                self._matrix = grown
+            self._matrix[self._size:needed] = rows
+        positions = np.arange(self._size, self._size + len(rows))
+        self._size += len(rows)
+        return positions
+
+    def search_batch(self, queries, k):
+        """一次搜尋多個查詢，回傳 (indices, scores)，形狀皆為 (查詢數, k)，依分數由高到低"""
+        if self._size == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        k = min(k, self._size)
+        scores = normalize_rows(queries) @ self.matrix.T
+        if k < self._size:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(self._size), (len(scores), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def search(self, query, k):
+        """搜尋單一查詢，回傳 (indices, scores)"""
+        indices, scores = self.search_batch([query], k)
+        return indices[0], scores[0]
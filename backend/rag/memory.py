@@ -0,0 +1,73 @@
+import os
+
+from rag.embedding_executor import truncate_tokens
+
+DEFAULT_WINDOW_TURNS = int(os.getenv("MEMORY_WINDOW_TURNS", "3"))
+DEFAULT_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+# 最近對話中每則回答最多保留的 token 數
+DEFAULT_TURN_TOKENS = int(os.getenv("MEMORY_TURN_TOKENS", "200"))
+
+SUMMARY_PROMPT = """請將以下新的對話內容併入既有的對話摘要，保留使用者關心的主題、身分條件與已得到的重要結論（如天數、條款編號），
+摘要不超過 {max_tokens} 個 token，只輸出摘要本身。
+
+既有摘要：
+{summary}
+
+新的對話：
+{turns}
+"""
+
+
+def format_turns(turns, turn_tokens=DEFAULT_TURN_TOKENS):
+    """turns 為 [(問題, 回答)]，回答過長時截斷，使每輪的長度有上限"""
+    lines = []
+    for question, answer in turns:
+        lines.append(f"使用者：{question}")
+        lines.append(f"助理：{truncate_tokens(answer or '', turn_tokens)}")
+    return '\n'.join(lines)
+
+
+def split_turns(turns, window_turns=DEFAULT_WINDOW_TURNS):
+    """回傳 (需併入摘要的較舊對話, 保留原文的最近 window_turns 輪)"""
+    if len(turns) <= window_turns:
+        return [], list(turns)
+    return list(turns[:-window_turns]), list(turns[-window_turns:])
+
+
+def summarize_turns(llm, summary, turns, max_tokens=DEFAULT_SUMMARY_TOKENS):
+    """以 LLM 將對話增量併入摘要，結果截斷至 max_tokens"""
+    prompt = SUMMARY_PROMPT.format(
+        max_tokens=max_tokens,
+        summary=summary or '（無）',
+        turns=format_turns(turns)
+    )
+    result = llm.invoke(prompt)
+    text = getattr(result, 'content', result)
+    return truncate_tokens(text.strip(), max_tokens)
+
+
+def format_history(memory):
+    """將 {'summary', 'turns'} 組成放進提示詞的對話記錄，長度有固定上限"""
+    if not memory:
+        return ''
+    parts = []
+    if memory.get('summary'):
+        parts.append(f"先前對話摘要：{memory['summary']}")
+    if memory.get('turns'):
+        parts.append(f"最近的對話：\n{format_turns(memory['turns'])}")
+    return '\n'.join(parts)
+
+
+def question_with_history(question, memory):
+    """放進提示詞 {question} 的內容：對話記錄加上目前的問題"""
+    history = format_history(memory)
+    if not history:
+        return question
+    return f"{history}\n\n目前的問題：{question}"
+
+
+def retrieval_query(question, memory):
+    """檢索用的查詢：追問（如「那產假呢」）常缺少主題，併入上一輪的問題"""
+    if not memory or not memory.get('turns'):
+        return question
+    return f"{memory['turns'][-1][0]} {question}"
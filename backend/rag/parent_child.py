@@ -0,0 +1,55 @@
+import re
+
+from langchain_core.documents import Document
+
+# 第二層條款（如 7.4）為一個段落的開頭；子條款（7.4.1）留在同一段落
+SECTION_PATTERN = re.compile(r'(?:^|(?<=[\s。；]))\d+\.\d+(?=[^\d.\s])', re.MULTILINE)
+
+
+class ParentChildSplitter:
+    """兩層分割：較大的父段落供生成，較小的子 chunk 供嵌入與檢索
+
+    父段落以第二層條款（x.y，含其全部子條款）為單位，過長時再以 parent_splitter 分割；
+    每個父段落再以 child_splitter 切成子 chunk。子 chunk 的 metadata 記錄
+    parent_index（同一文件中第幾個父段落）與在整份文件中的 start_index。
+    兩個 splitter 都需設定 add_start_index=True。
+    """
+
+    def __init__(self, child_splitter, parent_splitter):
+        self.child_splitter = child_splitter
+        self.parent_splitter = parent_splitter
+
+    def _sections(self, text):
+        """回傳 [(起始位置, 段落文字)]"""
+        starts = [match.start() for match in SECTION_PATTERN.finditer(text)]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        bounds = zip(starts, starts[1:] + [len(text)])
+        return [(start, text[start:end]) for start, end in bounds if text[start:end].strip()]
+
+    def _parents(self, document):
+        parents = []
+        for section_start, section in self._sections(document.page_content):
+            # 未超過長度的段落會原樣成為一個父段落
+            for piece in self.parent_splitter.create_documents([section]):
+                parents.append(Document(
+                    page_content=piece.page_content,
+                    metadata=dict(document.metadata, start_index=section_start + piece.metadata['start_index'])
+                ))
+        return parents
+
+    def split_with_parents(self, documents):
+        """回傳 (父段落, 子 chunk)"""
+        parents, children = [], []
+        for document in documents:
+            for parent in self._parents(document):
+                parent_index = len(parents)
+                parents.append(parent)
+                for child in self.child_splitter.split_documents([parent]):
+                    child.metadata['start_index'] += parent.metadata['start_index']
+                    child.metadata['parent_index'] = parent_index
+                    children.append(child)
+        return parents, children
+
+    def split_documents(self, documents):
+        return self.split_with_parents(documents)[1]
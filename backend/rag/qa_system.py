@@ -1,9 +1,8 @@
 import os
 import re
-from langchain_community.document_loaders import TextLoader, UnstructuredPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import UnstructuredPDFLoader
+from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
 from langchain_openai import ChatOpenAI
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
@@ -11,6 +10,18 @@ from dotenv import load_dotenv
 import docx2txt
 import warnings
 from PyPDF2 import PdfReader
+from rag.index_manager import IndexManager, index_lock
+from rag.embedding_cache import CachedEmbeddings
+from rag.fakes import FakeChatModel, HashEmbeddings
+from rag.cache_backends import DEFAULT_CACHE_BACKEND, get_cache
+from rag.chunk_store import ChunkStore
+from rag.chunking import chunking_config, create_text_splitter
+from rag.clauses import clause_key, extract_clauses
+from rag.context import DEFAULT_CONTEXT_TOKENS
+from rag.lexical_index import LexicalIndex
+from rag.query import QueryEmbeddings
+from rag.retriever import VectorRetriever
+from rag.vector_backends import create_backend
 # from django.conf import settings
 # 忽略警告信息
 warnings.filterwarnings('ignore')
@@ -18,61 +29,56 @@ warnings.filterwarnings('ignore')
 # 載入環境變量
 load_dotenv()
 
+# 預設的向量後端（chroma、faiss-flat、faiss-hnsw、faiss-ivfpq）
+DEFAULT_VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# 嵌入與 LLM：openai，或 fake（rag.fakes 的離線模型，供負載測試，不消耗 API 額度）
+DEFAULT_MODELS = os.getenv("QA_MODELS", "openai")
+MODELS = ('openai', 'fake')
+
+def create_models(models=DEFAULT_MODELS):
+   """回傳 (embeddings, llm)"""
+   if models == 'fake':
+       return HashEmbeddings(), FakeChatModel()
+   if models != 'openai':
+       raise ValueError(f"未知的模型設定: {models}（可用: {', '.join(MODELS)}）")
+   return OpenAIEmbeddings(), ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+
 def clean_text(text):
-    """文本清理"""
-    # 移除多餘空白和特殊字符
-    text = re.sub(r'\s+', ' ', text)
-    # 統一標點符號（適合中文文檔）
-    text = text.replace('，', '。').replace('；', '。').replace('！', '。').replace('？', '。')
-    return text.strip()
+    """文本清理：保留換行與標點（條款分割需要行首的條款編號），只整理每行內的空白"""
+    lines = (re.sub(r'[ \t\u3000\xa0]+', ' ', line).strip() for line in text.splitlines())
+    # 連續空行合併為一個段落分隔
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
 
-def load_single_document(file_path):
-    """載入單個文檔並處理可能的錯誤"""
-    try:
-        file_extension = os.path.splitext(file_path)[1].lower()
+def extract_text(file_path):
+    """直接從文件取得純文字，不經過暫存檔"""
+    file_extension = os.path.splitext(file_path)[1].lower()
+    
+    if file_extension == '.docx':
+        # 處理 Word 文檔
+        return clean_text(docx2txt.process(file_path))
         
-        if file_extension == '.docx':
-            # 處理 Word 文檔
-            text = docx2txt.process(file_path)
-            text = clean_text(text)
-            txt_path = file_path + '.txt'
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                f.write(text)
-            loader = TextLoader(txt_path, encoding='utf-8')
-            docs = loader.load()
-            os.remove(txt_path)
-            return docs
-            
-        elif file_extension == '.pdf':
-            try:
-                # 首先嘗試使用 UnstructuredPDFLoader
-                loader = UnstructuredPDFLoader(file_path)
-                docs = loader.load()
-                return docs
-            except Exception as e:
-                print(f"使用 UnstructuredPDFLoader 失敗，切換到 PdfReader: {str(e)}")
-                # 如果 UnstructuredPDFLoader 失敗，使用 PdfReader
-                pdf_reader = PdfReader(file_path)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                text = clean_text(text)
-                txt_path = file_path + '.txt'
-                with open(txt_path, 'w', encoding='utf-8') as f:
-                    f.write(text)
-                loader = TextLoader(txt_path, encoding='utf-8')
-                docs = loader.load()
-                os.remove(txt_path)
-                return docs
-                
-        else:
-            # 其他類型文件
-            loader = TextLoader(file_path, encoding='utf-8')
-            return loader.load()
-            
-    except Exception as e:
-        print(f"無法載入文件 {file_path}: {str(e)}")
+    elif file_extension == '.pdf':
+        # 先用較快的 PdfReader 取出文字層
+        pdf_reader = PdfReader(file_path)
+        text = "\n".join(page.extract_text() or "" for page in pdf_reader.pages)
+        if text.strip():
+            return clean_text(text)
+        # 沒有文字層（掃描檔）時才改用 UnstructuredPDFLoader
+        print(f"PdfReader 無法取得文字，改用 UnstructuredPDFLoader: {file_path}")
+        docs = UnstructuredPDFLoader(file_path).load()
+        return "\n".join(doc.page_content for doc in docs)
+        
+    else:
+        # 其他類型文件
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+def load_single_document(file_path):
+    """載入單個文檔；沒有文字時回傳空列表，無法讀取時拋出例外（由匯入管線記錄並於下次重試）"""
+    text = extract_text(file_path)
+    if not text:
         return []
+    return [Document(page_content=text, metadata={"source": file_path})]
 
 def format_source(doc):
     """格式化來源文檔內容"""
@@ -82,32 +88,15 @@ def format_source(doc):
     filename = os.path.basename(filename)
     filename = filename.replace('.txt', '').replace('.docx', '')
     
-    # 從內容中提取章節號
-    content = doc.page_content.strip()
-    
-    # 主要匹配完整的章節號，避免部分匹配
-    patterns = [
-        r'\b\d+\.\d+\.\d+\b(?!\.\d)',  # 匹配 x.x.x 格式，但不匹配後面還有數字的情況
-        r'\b\d+\.\d+\b(?!\.\d)',        # 匹配 x.x 格式，但不匹配後面還有數字的情況
-    ]
-    
-    found_sections = set()  # 使用集合來避免重複
-    for pattern in patterns:
-        matches = re.finditer(pattern, content)
-        for match in matches:
-            section = match.group()
-            pos = match.start()
-            # 檢查章節號前後的內容
-            before = content[max(0, pos-5):pos].strip()
-            after = content[pos+len(section):min(len(content), pos+len(section)+10)].strip()
-            
-            # 確認這是一個真實的章節號
-            if (before == '' or before.endswith(' ') or before.endswith('。') or 
-                before.endswith('\n')) and len(after) > 0:
-                found_sections.add(section)
+    # 章節號已於 ingestion 時記錄在 metadata；舊索引的 chunk 才即時擷取
+    sections = metadata.get('clauses') if metadata else None
+    if sections is None:
+        sections = extract_clauses(doc.page_content)
+    # 只列主要條款（x.x、x.x.x），不含 7.5.1.1 這樣的子條款
+    found_sections = {section for section in sections if section.count('.') <= 2}
     
     # 將找到的章節號排序
-    sorted_sections = sorted(list(found_sections))
+    sorted_sections = sorted(found_sections, key=clause_key)
     
     return {
         'filename': filename,
@@ -132,40 +121,119 @@ def get_source_string(source_documents):
         return f'"{filename}"'  # 添加引號
     return '"未知文件"'
 
-def init_qa_system(docs_dir='documents'):
-   """初始化QA系統"""
-   # 1. 載入文檔
+def get_source_names(source_documents):
+    """回傳不重複的來源文件名稱，記錄在訊息上供回饋統計使用"""
+    return sorted({format_source(doc)['filename'] for doc in source_documents})
+
+def format_answer(answer, source_string):
+    """在回答最後附上參考來源"""
+    if source_string:
+        if not answer.endswith('\n'):
+            answer += '\n'
+        answer += f"參考來源：{source_string}"
+    return answer
+
+def build_index(docs_dir='documents', vector_backend=DEFAULT_VECTOR_BACKEND, backend_options=None,
+                embeddings=None, index_dir=None, chunking=None, verbose=True):
+   """開啟持久化的向量索引，並與文件目錄同步（只嵌入新增或變更的文件）
+
+   embeddings 預設為 OpenAIEmbeddings，未包裝 CachedEmbeddings 時會加上共用的磁碟快取；
+   index_dir 預設為 vector_store/<向量後端>；chunking 預設為 rag.chunking 的集中設定。
+   回傳同步後的 IndexManager，其 backend、chunk_store、lexical_index、embeddings 供檢索使用。
+   """
+   # 1. 準備目錄，每種向量後端各自一個子目錄（含 manifest 與 chunk 內容）
    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
    docs_dir = os.path.join(base_dir, docs_dir)
-   vector_store_path = os.path.join(base_dir, "vector_store")
+   index_path = index_dir or os.path.join(base_dir, "vector_store", vector_backend)
    os.makedirs(docs_dir, exist_ok=True)
-   os.makedirs(vector_store_path, exist_ok=True)
-   documents = []
-   for filename in os.listdir(docs_dir):
-       file_path = os.path.join(docs_dir, filename)
-       if os.path.isfile(file_path):
-           docs = load_single_document(file_path)
-           documents.extend(docs)
+   os.makedirs(index_path, exist_ok=True)
    
-   if not documents:
-       raise Exception("沒有成功載入任何文檔")
+   # 2. 分割設定（見 rag.chunking）：小的子 chunk 用於嵌入與檢索，父段落用於生成
+   chunking = chunking or chunking_config()
+   text_splitter = create_text_splitter(chunking)
    
-   # 2. 分割文檔
-   text_splitter = RecursiveCharacterTextSplitter(
-       chunk_size=250,
-       chunk_overlap=125,
-       separators=["\n\n", "\n", "。", "，", " ", ""] # 增加中文分隔符
+   # 3. 開啟向量後端、chunk 內容與 BM25 倒排索引，同步文件目錄
+   if embeddings is None:
+       embeddings = OpenAIEmbeddings()
+   if not isinstance(embeddings, CachedEmbeddings):
+       embeddings = CachedEmbeddings(embeddings)
+   # 其他 worker 同步期間等待，之後開啟同步完成的索引（不會同時重設或重寫同一個目錄）
+   with index_lock(index_path):
+       backend = create_backend(vector_backend, os.path.join(index_path, "vectors"), **(backend_options or {}))
+       index = IndexManager(
+           backend,
+           ChunkStore(os.path.join(index_path, "chunks.sqlite3")),
+           embeddings,
+           index_path,
+           text_splitter,
+           loader=load_single_document,
+           lexical_index=LexicalIndex(index_path),
+           config={
+               "embedding_model": embeddings.model,
+               **chunking,
+               # 文字清理與 chunk metadata 的格式（條款編號、起始位置），變更時需重建索引
+               "metadata_version": 3,
+           }
+       )
+       stats = index.sync(docs_dir)
+   if not verbose:
+       return index
+   print(f"向量索引同步完成 ({vector_backend}): 新增 {stats['added']}、更新 {stats['updated']}、"
+         f"移除 {stats['removed']}、未變更 {stats['unchanged']}、失敗 {stats['failed']} 個文件")
+   cache_stats = embeddings.cache.stats()
+   print(f"嵌入快取: 命中 {cache_stats['hits']}、未命中 {cache_stats['misses']}")
+   if embeddings.executor.stats['chunks']:
+       print(f"嵌入速度: {embeddings.executor.chunks_per_second:.1f} chunks/s "
+             f"({embeddings.executor.stats['chunks']} chunks, 重試 {embeddings.executor.stats['retries']} 次)")
+   return index
+
+def build_retriever(index, cache=None, **overrides):
+   """以索引建立 QA 系統使用的檢索器（overrides 可覆寫 k 等參數，供評估與參數掃描使用）
+
+   cache 為查詢嵌入使用的 QA 快取後端，預設為 rag.cache_backends 的共用設定。
+   """
+   options = dict(
+       # 向量與 BM25 以 RRF 合併，條款編號與專有名詞可由關鍵字命中，
+       # 不再需要以較大的 k 彌補漏檢，送進 LLM 的 context 也較少
+       search_type="hybrid",
+       k=5,
+       fetch_k=20,
+       # 以子 chunk 命中，回傳去除重複的父段落
+       use_parents=True,
+       # 合併相鄰的段落並限制送進提示詞的 token 數
+       context_tokens=DEFAULT_CONTEXT_TOKENS
    )
-   texts = text_splitter.split_documents(documents)
-   
-   # 3. 創建向量數據庫
-   embeddings = OpenAIEmbeddings()
-   vectorstore = Chroma.from_documents(
-       documents=texts,
-       embedding=embeddings,
-       collection_metadata={"hnsw:space": "cosine"},
-       persist_directory=vector_store_path
+   options.update(overrides)
+   return VectorRetriever(
+       # 查詢端另有正規化與行程內 LRU，重複的問題不需再嵌入
+       embeddings=QueryEmbeddings.wrap(index.embeddings, cache),
+       backend=index.backend,
+       chunk_store=index.chunk_store,
+       lexical_index=index.lexical_index,
+       **options
    )
+
+def init_qa_system(docs_dir='documents', vector_backend=DEFAULT_VECTOR_BACKEND, backend_options=None,
+                   models=DEFAULT_MODELS, embeddings=None, llm=None, index_dir=None,
+                   cache_backend=DEFAULT_CACHE_BACKEND, cache_options=None):
+   """初始化QA系統
+
+   models 為 openai 或 fake；也可直接傳入 embeddings、llm（如設定延遲的離線模型）。
+   離線模型的索引另存於 vector_store/<向量後端>-<models>，不影響正式索引。
+   cache_backend 為查詢嵌入、檢索結果與答案共用的快取（memory、sqlite、redis），記錄在問答鏈的 metadata。
+   """
+   cache = get_cache(cache_backend, **(cache_options or {}))
+   if embeddings is None or llm is None:
+       default_embeddings, default_llm = create_models(models)
+       embeddings = embeddings or default_embeddings
+       llm = llm or default_llm
+   if index_dir is None and models != 'openai':
+       base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+       index_dir = os.path.join(base_dir, "vector_store", f"{vector_backend}-{models}")
+   index = build_index(docs_dir, vector_backend, backend_options,
+                       embeddings=embeddings, index_dir=index_dir)
+   if index.chunk_count == 0:
+       raise Exception("沒有成功載入任何文檔")
    
    # 4. 創建自定義提示模板
    prompt_template = """你是一個專業的人資助理，專門回答員工關於請假制度的問題。請提供準確且容易理解的答案。
@@ -193,27 +261,21 @@ def init_qa_system(docs_dir='documents'):
    )
    
    # 5. 創建問答鏈
-   llm = ChatOpenAI(
-       model_name="gpt-3.5-turbo",
-       temperature=0
-   )
    qa_chain = RetrievalQA.from_chain_type(
        llm=llm,
        chain_type="stuff",
-       retriever=vectorstore.as_retriever(
-           search_type="mmr",
-           search_kwargs={
-               "k": 8,
-               "fetch_k": 15,
-               "lambda_mult": 0.8,
-               "score_threshold": 0.6
-           }
-       ),
+       retriever=build_retriever(index, cache),
        return_source_documents=True,
        chain_type_kwargs={
            "prompt": PROMPT
        }
    )
+   # 記錄索引版本，供 QAEngine 判斷是否需要重新載入
+   qa_chain.metadata = {
+       "index_version": index.version,
+       "manifest_path": index.manifest_path,
+       "cache": cache,
+   }
    
    return qa_chain
 
@@ -252,15 +314,9 @@ def main():
             answer = result["result"]
             source_docs = result.get("source_documents", [])
             
-            # Get source information
+            # Get source information and add it at the end
             source_string = get_source_string(source_docs)
-            
-            # Add source information at the end
-            if source_string:
-                # Add a newline if the answer doesn't end with one
-                if not answer.endswith('\n'):
-                    answer += '\n'
-                answer += f"參考來源：{source_string}"
+            answer = format_answer(answer, source_string)
             
             print("\n回答:", answer)
                     
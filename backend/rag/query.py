@@ -0,0 +1,116 @@
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag.cache_backends import get_cache
+from rag.embedding_cache import CachedEmbeddings, cache_key, get_embedding_cache
+from rag.tracing import QUERY_EMBEDDING_CACHE
+
+# QA 快取中查詢嵌入的筆數上限（0 為停用）
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+# QA 快取未命中時是否查詢多個行程共用的磁碟嵌入快取
+QUERY_EMBEDDING_DISK_CACHE = os.getenv("QUERY_EMBEDDING_DISK_CACHE", "1") != "0"
+# 查詢嵌入的磁碟快取筆數上限；與文件嵌入分開存放，問題再多也不會淘汰文件嵌入
+QUERY_EMBEDDING_DISK_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_DISK_CACHE_SIZE", "50000"))
+
+# NFKC 不處理的引號、括號與破折號，統一為半形
+PUNCTUATION_TABLE = str.maketrans({
+    '「': '"', '」': '"', '『': '"', '』': '"', '“': '"', '”': '"', '‘': "'", '’': "'",
+    '【': '(', '】': ')', '〔': '(', '〕': ')', '〈': '<', '〉': '>', '《': '<', '》': '>',
+    '—': '-', '–': '-', '－': '-', '、': ',',
+})
+
+# 未安裝 opencc 時使用的簡繁對照，限人事規章問題的常用字（「后」「发」依規章用法轉為「後」「發」）
+SIMPLIFIED = "请这个时间几吗么还没资给会员问题规办产丧医师护补签证书说话应该发岁长过后续对单关于为钟计数职务调换轮开终转岗级绩迟销审离阶训练经历许复实际满额节国庆劳动险灾伤亲属们样婴儿养检钱"
+TRADITIONAL = "請這個時間幾嗎麼還沒資給會員問題規辦產喪醫師護補簽證書說話應該發歲長過後續對單關於為鐘計數職務調換輪開終轉崗級績遲銷審離階訓練經歷許復實際滿額節國慶勞動險災傷親屬們樣嬰兒養檢錢"
+FALLBACK_TABLE = str.maketrans(SIMPLIFIED, TRADITIONAL)
+
+_converter = None
+_converter_lock = threading.Lock()
+
+
+def to_traditional(text):
+    """簡體轉繁體：有安裝 opencc 時使用台灣用語轉換，否則以內建的常用字對照"""
+    global _converter
+    if _converter is None:
+        with _converter_lock:
+            if _converter is None:
+                try:
+                    import opencc
+                    _converter = opencc.OpenCC('s2twp').convert
+                except ImportError:
+                    _converter = lambda value: value.translate(FALLBACK_TABLE)
+    return _converter(text)
+
+
+def normalize_query(question):
+    """查詢正規化：全形轉半形、統一標點、簡體轉繁體、合併空白、轉小寫並去除句尾標點
+
+    相同意思的不同寫法得到相同的查詢文字，共用嵌入快取與答案快取。
+    """
+    text = unicodedata.normalize('NFKC', question).translate(PUNCTUATION_TABLE)
+    text = to_traditional(text)
+    text = re.sub(r'\s+', ' ', text).strip().lower()
+    return text.rstrip('?。.!~ ')
+
+
+class QueryEmbeddings(Embeddings):
+    """查詢端的嵌入：正規化問題後依序查詢 QA 快取（rag.cache_backends）、共用的磁碟嵌入快取，
+    都未命中才呼叫嵌入模型
+
+    QA 快取的 namespace 為 query_embedding:<模型>，筆數上限為 QUERY_EMBEDDING_CACHE_SIZE；
+    使用 sqlite、redis 後端時各 worker 共用。同一個請求中答案快取、路由與檢索器對同一問題的嵌入也只計算一次。
+    命中的層級記錄在 rag_query_embedding_cache_total（快取後端名稱、disk、miss）。
+    embed_documents 直接交給 document_embeddings（建立索引時的快取嵌入）。
+    disk_cache 只存查詢嵌入，不可與文件嵌入共用：embed_query 與 embed_documents 的向量不同
+    （非對稱模型），相同文字的問題與 chunk 共用鍵會互相取到錯的向量。
+    """
+
+    def __init__(self, embeddings, disk_cache=None, cache=None, max_entries=QUERY_EMBEDDING_CACHE_SIZE,
+                 document_embeddings=None):
+        self.embeddings = embeddings
+        self.disk_cache = disk_cache
+        self.document_embeddings = document_embeddings or embeddings
+        self.model = getattr(self.document_embeddings, 'model', type(embeddings).__name__)
+        cache = cache if cache is not None else get_cache()
+        self.cache = cache.namespace(f"query_embedding:{self.model}", max_entries) if max_entries > 0 else None
+
+    @classmethod
+    def wrap(cls, embeddings, cache=None, max_entries=QUERY_EMBEDDING_CACHE_SIZE,
+             use_disk_cache=QUERY_EMBEDDING_DISK_CACHE):
+        """包裝索引使用的嵌入；為 CachedEmbeddings 時沿用其底層模型，
+        查詢嵌入存在其磁碟快取目錄下的 queries/（獨立的快取與 LRU）"""
+        if isinstance(embeddings, CachedEmbeddings):
+            disk_cache = get_embedding_cache(
+                os.path.join(embeddings.cache.cache_dir, "queries"), QUERY_EMBEDDING_DISK_CACHE_SIZE
+            ) if use_disk_cache else None
+            return cls(embeddings.embeddings, disk_cache, cache, max_entries, document_embeddings=embeddings)
+        return cls(embeddings, None, cache, max_entries)
+
+    def embed_documents(self, texts):
+        return self.document_embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        query = normalize_query(text)
+        vector = self.cache.get(query) if self.cache is not None else None
+        if vector is not None:
+            QUERY_EMBEDDING_CACHE.inc(self.cache.backend.name)
+            return vector.tolist()
+
+        key = cache_key(self.model, query)
+        vector = self.disk_cache.get_many([key])[0] if self.disk_cache is not None else None
+        if vector is not None:
+            QUERY_EMBEDDING_CACHE.inc('disk')
+        else:
+            QUERY_EMBEDDING_CACHE.inc('miss')
+            vector = self.embeddings.embed_query(query)
+            if self.disk_cache is not None:
+                self.disk_cache.put_many([key], [vector])
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.cache is not None:
+            self.cache.set(query, vector)
+        return vector.tolist()
@@ -0,0 +1,124 @@
+from typing import Any, Optional
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from rag.context import pack_context
+from rag.query import normalize_query
+from rag.tracing import span
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """以 RRF 合併多個排序結果：score = Σ 1 / (k + rank)
+
+    rankings 為多個 [(chunk_id, 原始分數)] 列表，只使用名次，不需正規化各自的分數。
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class VectorRetriever(BaseRetriever):
+    """以 VectorBackend 搜尋、從 ChunkStore 取回內容的檢索器
+
+    search_type 與 langchain 的 as_retriever 相同：
+    "similarity"、"mmr" 或 "similarity_score_threshold"；
+    另有 "hybrid"：向量與 BM25（lexical_index）各取 fetch_k 筆，以 RRF 合併後取前 k 筆。
+    use_parents=True 時以子 chunk 檢索、回傳其（去除重複的）父段落；
+    設定 context_tokens 時，結果會合併重疊的 chunk 並裁切至該 token 預算再交給提示詞。
+    batch_documents() 一次檢索多個查詢（評估問題集），向量分數以一次 backend.search_batch 計算。
+    """
+
+    embeddings: Embeddings
+    backend: Any
+    chunk_store: Any
+    search_type: str = "similarity"
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    score_threshold: Optional[float] = None
+    lexical_index: Any = None
+    rrf_k: int = 60
+    use_parents: bool = False
+    context_tokens: Optional[int] = None
+
+    def _dense_k(self):
+        """向量搜尋取回的筆數：hybrid 與 mmr 先取 fetch_k 個候選"""
+        return self.fetch_k if self.search_type in ("hybrid", "mmr") else self.k
+
+    def _search(self, query, query_vector, dense_hits=None):
+        """回傳 [(chunk_id, 分數)]；dense_hits 為已批次算好的向量搜尋結果（取 _dense_k() 筆）"""
+        with span("retrieve", search_type=self.search_type):
+            if dense_hits is None:
+                dense_hits = self.backend.search(query_vector, self._dense_k())
+            if self.search_type == "hybrid" and self.lexical_index is not None:
+                lexical_hits = self.lexical_index.search(query, self.fetch_k)
+
+        if self.search_type == "hybrid":
+            rankings = [dense_hits]
+            if self.lexical_index is not None:
+                rankings.append(lexical_hits)
+            with span("rerank"):
+                return reciprocal_rank_fusion(rankings, self.rrf_k)[:self.k]
+
+        if self.search_type == "mmr":
+            if not dense_hits:
+                return []
+            with span("rerank"):
+                candidate_ids = [chunk_id for chunk_id, _ in dense_hits]
+                selected = maximal_marginal_relevance(
+                    np.asarray(query_vector, dtype=np.float32),
+                    self.backend.get_vectors(candidate_ids),
+                    lambda_mult=self.lambda_mult,
+                    k=self.k
+                )
+                return [dense_hits[i] for i in selected]
+
+        hits = dense_hits
+        if self.search_type == "similarity_score_threshold" and self.score_threshold is not None:
+            hits = [(chunk_id, score) for chunk_id, score in hits if score >= self.score_threshold]
+        return hits
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        # 簡繁、全半形不同的寫法都以相同的文字查詢向量與 BM25
+        query = normalize_query(query)
+        with span("embed"):
+            query_vector = self.embeddings.embed_query(query)
+        return self._documents(self._search(query, query_vector))
+
+    def batch_documents(self, queries, query_vectors=None):
+        """一次檢索多個查詢，回傳與 queries 對齊的文件列表（與逐題 invoke 的結果相同）
+
+        查詢向量疊成一個 float32 矩陣，以一次 backend.search_batch 計算全部的向量分數
+        （flat 後端為一次矩陣乘法）；BM25、RRF、MMR、父段落與 context 裁切仍逐題進行。
+        query_vectors 為已算好的查詢向量（以正規化後的查詢 embed_query），未提供時在此依序嵌入。
+        """
+        if not queries:
+            return []
+        queries = [normalize_query(query) for query in queries]
+        if query_vectors is None:
+            query_vectors = [self.embeddings.embed_query(query) for query in queries]
+        with span("retrieve_batch", search_type=self.search_type, queries=len(queries)):
+            dense = self.backend.search_batch(np.asarray(query_vectors, dtype=np.float32), self._dense_k())
+        return [self._documents(self._search(query, vector, hits))
+                for query, vector, hits in zip(queries, query_vectors, dense)]
+
+    def _documents(self, hits):
+        """從 ChunkStore 取回命中的 chunk（依設定換成父段落、裁切 context）"""
+        scores = dict(hits)
+        with span("fetch_chunks") as attrs:
+            docs = self.chunk_store.get_many([chunk_id for chunk_id, _ in hits])
+            for doc in docs:
+                doc.metadata["score"] = scores[doc.id]
+            if self.use_parents:
+                docs = self.chunk_store.to_parents(docs)
+            attrs["documents"] = len(docs)
+        if self.context_tokens:
+            with span("pack_context"):
+                docs = pack_context(docs, self.context_tokens)
+        return docs
@@ -0,0 +1,158 @@
+import json
+import os
+import re
+
+from langchain_core.documents import Document
+
+from rag.answer_cache import normalize_question
+from rag.clauses import clause_segments, clause_text, match_clause_question
+from rag.matrix_index import MatrixIndex
+
+DEFAULT_CONFIDENCE = float(os.getenv("ROUTER_CONFIDENCE", "0.92"))
+# 選用的 FAQ 檔：[{"question": ..., "answer": ..., "clauses": [...]}]
+DEFAULT_FAQ_FILE = os.getenv("FAQ_FILE")
+
+# 標題型條款（如「7.4婚假」）的標題長度上限
+MAX_HEADING_LENGTH = 15
+QUESTION_WORDS = re.compile(r'(?:請問|的規定|規定|的內容|內容|是什麼|是甚麼|有哪些|為何|怎麼算)')
+
+
+def strip_question_words(question):
+    """移除「請問」、「的規定是什麼」等詞，只留下詢問的主題"""
+    return QUESTION_WORDS.sub('', normalize_question(question))
+
+
+def load_faq(path):
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class QueryRouter:
+    """在問答鏈之前判斷問題能否直接以條文回答，略過向量搜尋與 LLM
+
+    依序嘗試：
+    1. 條款編號查詢（「7.5.1 說什麼」）：信心 1.0
+    2. FAQ 與標題型條款（「婚假」→ 7.4）：正規化後完全相同為 1.0，
+       否則以問題嵌入與條目的 cosine 相似度作為信心
+    信心低於 threshold 時回傳 None，交由完整的問答鏈處理。
+    只有條款編號查詢與完全相同的標題、FAQ 問題會直接回答（direct）；僅相似的問題
+    （「婚假可以分次請嗎」→ 婚假）可能問的是條文中的細節，改以找到的條文作為唯一的 context 交給 LLM，
+    略過向量搜尋（path 為 routed_llm）。
+    標題與條文都限定在同一份文件；條款編號或標題同時出現在多份文件（如兩份手冊都有 7.1）時不直接回答，
+    各文件的條文都交給 LLM 判斷問的是哪一份。
+    """
+
+    def __init__(self, chunk_store, embeddings=None, faq_entries=None, threshold=DEFAULT_CONFIDENCE):
+        self.chunk_store = chunk_store
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.entries = []
+        self._keys = {}
+        self._index = None
+        self._build(faq_entries or [])
+
+    @classmethod
+    def from_chunk_store(cls, chunk_store, embeddings=None, faq_path=DEFAULT_FAQ_FILE, **kwargs):
+        return cls(chunk_store, embeddings, faq_entries=load_faq(faq_path), **kwargs)
+
+    def _headings(self):
+        """從 chunk 找出標題型條款，例如「7.4婚假」後面接著 7.4.1，回傳 {(來源文件, 條款): 標題}"""
+        headings = {}
+        chunk_ids = self.chunk_store.ids()
+        for start in range(0, len(chunk_ids), 1000):
+            for doc in self.chunk_store.get_many(chunk_ids[start:start + 1000]):
+                source = doc.metadata.get('source', '')
+                for clause, segment in clause_segments(doc.page_content):
+                    title = segment[len(clause):].strip().rstrip('：:')
+                    if 0 < len(title) <= MAX_HEADING_LENGTH and '。' not in title:
+                        headings.setdefault((source, clause), title)
+        return headings
+
+    def _build(self, faq_entries):
+        for entry in faq_entries:
+            self.entries.append({
+                'key': entry['question'],
+                'answer': entry.get('answer'),
+                'clauses': entry.get('clauses', []),
+                'source': None,
+            })
+        for (source, clause), title in sorted(self._headings().items()):
+            self.entries.append({'key': title, 'answer': None, 'clauses': [clause], 'source': source})
+
+        # 相同的鍵：FAQ 優先；多份文件的同名標題都保留，比對到時一併交給 LLM
+        for i, entry in enumerate(self.entries):
+            matches = self._keys.setdefault(strip_question_words(entry['key']), [])
+            if not matches or (entry['answer'] is None and self.entries[matches[0]]['answer'] is None):
+                matches.append(i)
+        if self.entries and self.embeddings is not None:
+            vectors = self.embeddings.embed_documents([entry['key'] for entry in self.entries])
+            self._index = MatrixIndex(vectors)
+
+    def _clause_answer(self, clauses, source=None):
+        """組出條文，回傳 (條文, 來源 chunk, 有條文的來源文件)；source 為 None 時查詢所有文件"""
+        docs, texts, sources = [], [], []
+        for clause in clauses:
+            # 不同文件可能使用相同的條款編號，各自組出條文，不混合拼接
+            for doc_source, source_docs in self.chunk_store.get_clause_documents(clause).items():
+                if source is not None and doc_source != source:
+                    continue
+                # 有父段落時以完整段落組出條文，避免條款被子 chunk 邊界截斷
+                clause_docs = self.chunk_store.to_parents(source_docs)
+                text = clause_text(clause, clause_docs)
+                if text:
+                    docs.extend(clause_docs)
+                    texts.append(text)
+                    if doc_source not in sources:
+                        sources.append(doc_source)
+        return '\n'.join(texts), docs, sources
+
+    def _match_entries(self, question):
+        """回傳 (最相符的條目與其同名條目, 信心, 是否完全相同)"""
+        key = strip_question_words(question)
+        if key and key in self._keys:
+            return [self.entries[i] for i in self._keys[key]], 1.0, True
+        if self._index is None:
+            return [], 0.0, False
+        indices, scores = self._index.search(self.embeddings.embed_query(question), 1)
+        if not len(indices):
+            return [], 0.0, False
+        best = int(indices[0])
+        same_key = self._keys.get(strip_question_words(self.entries[best]['key']), [best])
+        return [self.entries[i] for i in same_key], float(scores[0]), False
+
+    def route(self, question):
+        """找到對應的條文時回傳 {path, confidence, direct, result, source_documents}，否則回傳 None
+
+        direct 為 False 時 result 不應直接作為回答，source_documents 供 LLM 作為 context。
+        """
+        clause = match_clause_question(question)
+        if clause is not None:
+            result, docs, sources = self._clause_answer([clause])
+            if result:
+                direct = len(sources) == 1
+                return {'path': 'clause' if direct else 'routed_llm', 'confidence': 1.0, 'direct': direct,
+                        'result': result, 'source_documents': docs}
+
+        entries, confidence, exact = self._match_entries(question)
+        if not entries or confidence < self.threshold:
+            return None
+        result, docs, sources = '', [], []
+        for entry in entries:
+            entry_result, entry_docs, entry_sources = self._clause_answer(entry['clauses'], entry['source'])
+            result = '\n'.join(text for text in (result, entry_result) if text)
+            docs.extend(entry_docs)
+            sources += [source for source in entry_sources if source not in sources]
+        entry = entries[0]
+        # FAQ 的回答是人工整理的，完全相同即可直接回答；標題對應到多份文件時交給 LLM
+        direct = exact and (bool(entry['answer']) or len(sources) <= 1)
+        if entry['answer']:
+            result = entry['answer']
+            faq_doc = Document(page_content=entry['answer'], metadata={'source': 'FAQ'})
+            # 直接回答時 FAQ 未對應到條款，仍以 FAQ 本身作為來源；交給 LLM 時 FAQ 的回答也放進 context
+            docs = (docs or [faq_doc]) if direct else [faq_doc] + docs
+        if not result:
+            return None
+        return {'path': 'faq' if direct else 'routed_llm', 'confidence': confidence, 'direct': direct,
+                'result': result, 'source_documents': docs}
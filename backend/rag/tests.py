@@ -0,0 +1,755 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from rag.answer_cache import AnswerCache, key_terms, normalize_question
+from rag.cache_backends import MemoryCache, RedisCache, SQLiteCache
+from rag.chunk_store import ChunkStore
+from rag.clause_splitter import ClauseSplitter, parse_clauses, subtree_ends
+from rag.clauses import annotate_clauses, clause_text
+from rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+from rag.embedding_executor import EmbeddingExecutor
+from rag.engine import QAEngine
+from rag.fakes import HashEmbeddings
+from rag.index_manager import IndexManager, index_lock
+from rag.lexical_index import LexicalIndex, tokenize
+from rag.ingest import IngestionPipeline
+from rag.query import QueryEmbeddings, normalize_query
+from rag.retriever import VectorRetriever, reciprocal_rank_fusion
+from rag.router import QueryRouter
+from rag.tracing import span, trace, trace_logger
+from rag.vector_backends import FaissFlatBackend, FaissHNSWBackend
+
+
+class FaissBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(40, 8)).astype(np.float32)
+        self.ids = [f"c{i}" for i in range(40)]
+
+    def test_search_sees_only_committed_state(self):
+        backend = FaissHNSWBackend(self.directory)
+        backend.add(self.ids[:20], self.vectors[:20])
+        self.assertEqual(backend.search(self.vectors[0], 3), [])
+        backend.commit()
+        self.assertEqual(backend.search(self.vectors[0], 1)[0][0], 'c0')
+
+        backend.add(self.ids[20:], self.vectors[20:])
+        backend.delete(['c0'])
+        # 尚未 commit 的新增與刪除不影響搜尋
+        self.assertEqual(backend.search(self.vectors[0], 1)[0][0], 'c0')
+        self.assertNotIn('c30', [chunk_id for chunk_id, _ in backend.search(self.vectors[30], 5)])
+        backend.commit()
+        self.assertEqual(backend.search(self.vectors[30], 1)[0][0], 'c30')
+        self.assertNotIn('c0', [chunk_id for chunk_id, _ in backend.search(self.vectors[0], 40)])
+
+    def test_reload_from_disk(self):
+        backend = FaissFlatBackend(self.directory)
+        backend.add(self.ids, self.vectors)
+        backend.commit()
+        reloaded = FaissFlatBackend(self.directory)
+        self.assertEqual(len(reloaded), 40)
+        self.assertEqual(reloaded.search(self.vectors[7], 1)[0][0], 'c7')
+        np.testing.assert_allclose(np.linalg.norm(reloaded.get_vectors(['c7', 'c8']), axis=1), 1.0, rtol=1e-5)
+
+    def test_failed_commit_keeps_previous_files(self):
+        backend = FaissFlatBackend(self.directory)
+        backend.add(self.ids[:20], self.vectors[:20])
+        backend.commit()
+        backend.delete(self.ids[:5])
+        backend.add(self.ids[20:], self.vectors[20:])
+        with mock.patch.object(backend.faiss, 'write_index', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                backend.commit()
+        reloaded = FaissFlatBackend(self.directory)
+        self.assertEqual(sorted(reloaded.ids()), sorted(self.ids[:20]))
+        self.assertEqual(reloaded.search(self.vectors[3], 1)[0][0], 'c3')
+
+    def test_concurrent_search_during_commit(self):
+        backend = FaissHNSWBackend(self.directory)
+        backend.add(self.ids[:10], self.vectors[:10])
+        backend.commit()
+        errors = []
+
+        def search():
+            try:
+                for _ in range(200):
+                    results = backend.search_batch(self.vectors[:4], 3)
+                    assert all(len(hits) == 3 for hits in results)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=search) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for start in range(10, 40, 5):
+            backend.add(self.ids[start:start + 5], self.vectors[start:start + 5])
+            backend.delete([self.ids[start - 10]])
+            backend.commit()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(backend), 34)
+
+
+class CountingEmbeddings(HashEmbeddings):
+    def __init__(self):
+        super().__init__(dim=16)
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(len(texts))
+        return super().embed_documents(texts)
+
+
+class AsymmetricEmbeddings(CountingEmbeddings):
+    """查詢向量與相同文字的文件向量不同（如 e5 的 query:／passage: 前綴）"""
+
+    def embed_query(self, text):
+        return [-value for value in self._embed(text)]
+
+
+def load_text(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if text.startswith('損壞'):
+        raise ValueError('無法解析')
+    return [Document(page_content=text, metadata={'source': file_path})]
+
+
+class IngestionTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.docs_dir = os.path.join(self.directory, 'docs')
+        os.makedirs(self.docs_dir)
+        for name, text in (('a.txt', '1.請假\n1.1事假三天'), ('b.txt', '2.加班\n2.1加班費'),
+                           ('c.txt', '損壞的文件')):
+            self.write(name, text)
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=20, chunk_overlap=0)
+
+    def write(self, name, text):
+        with open(os.path.join(self.docs_dir, name), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_chunks_from_several_files_are_embedded_together(self):
+        embeddings = CountingEmbeddings()
+        pipeline = IngestionPipeline(load_text, self.splitter, embeddings=embeddings, parse_workers=1)
+        paths = [os.path.join(self.docs_dir, name) for name in ('a.txt', 'b.txt', 'c.txt')]
+        results = {os.path.basename(path): (chunks, vectors) for path, chunks, vectors, _ in pipeline.run(paths)}
+        self.assertEqual(len(embeddings.calls), 1)
+        self.assertIsNone(results['c.txt'][0])
+        for name in ('a.txt', 'b.txt'):
+            chunks, vectors = results[name]
+            self.assertEqual(len(chunks), len(vectors))
+            self.assertEqual(vectors[0], embeddings.embed_query(chunks[0].page_content))
+        self.assertEqual(pipeline.stats['failed'], 1)
+
+    def test_group_size_is_bounded_by_tokens(self):
+        embeddings = CountingEmbeddings()
+        pipeline = IngestionPipeline(load_text, self.splitter, embeddings=embeddings, parse_workers=1,
+                                     embed_group_tokens=1)
+        list(pipeline.run([os.path.join(self.docs_dir, name) for name in ('a.txt', 'b.txt')]))
+        self.assertEqual(len(embeddings.calls), 2)
+
+    def test_failed_file_is_retried_on_next_sync(self):
+        def make_index():
+            return IndexManager(FaissFlatBackend(os.path.join(self.directory, 'vectors')),
+                                ChunkStore(os.path.join(self.directory, 'chunks.sqlite3')),
+                                CountingEmbeddings(), self.directory, self.splitter, load_text)
+        index = make_index()
+        index.pipeline.parse_workers = 1
+        stats = index.sync(self.docs_dir)
+        self.assertEqual((stats['added'], stats['failed']), (2, 1))
+        self.assertNotIn('c.txt', index.manifest['files'])
+
+        self.write('c.txt', '3.出差\n3.1出差費')
+        index = make_index()
+        index.pipeline.parse_workers = 1
+        stats = index.sync(self.docs_dir)
+        self.assertEqual((stats['added'], stats['unchanged'], stats['failed']), (1, 2, 0))
+        self.assertIn('c.txt', index.manifest['files'])
+
+
+    def test_index_lock_makes_other_workers_wait(self):
+        events = []
+        holding = threading.Event()
+
+        def other_worker():
+            holding.wait()
+            with index_lock(self.directory):
+                events.append('other')
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        with index_lock(self.directory):
+            holding.set()
+            thread.join(0.2)
+            events.append('first')
+        thread.join()
+        self.assertEqual(events, ['first', 'other'])
+
+
+class StubEmbeddings:
+    """依問題的第一個字決定向量：同字開頭的問題相似度為 1"""
+
+    def embed_query(self, text):
+        return [1.0, 0.0] if text.lstrip()[:1] in '產婚' else [0.0, 1.0]
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = AnswerCache(StubEmbeddings(), similarity_threshold=0.95, cache=MemoryCache())
+        self.cache.put('產假幾天?', {'answer': '56 天'}, 'v1')
+
+    def test_exact_match_after_normalization(self):
+        self.assertEqual(self.cache.get('產假幾天？', 'v1'), ({'answer': '56 天'}, 'exact'))
+
+    def test_semantic_match_requires_same_key_terms(self):
+        self.assertEqual(self.cache.get('產假有幾天', 'v1'), ({'answer': '56 天'}, 'semantic'))
+        self.assertEqual(self.cache.get('婚假幾天', 'v1'), (None, None))
+        self.assertEqual(self.cache.get('產假 3 天嗎', 'v1'), (None, None))
+
+    def test_below_threshold_misses(self):
+        self.cache.put('加班費怎麼算', {'answer': '1.34 倍'}, 'v1')
+        self.assertEqual(self.cache.get('加班費幾倍', 'v1'), ({'answer': '1.34 倍'}, 'semantic'))
+        self.cache.similarity_threshold = 1.01
+        self.assertEqual(self.cache.get('加班費幾倍', 'v1'), (None, None))
+
+    def test_index_version_change_drops_entries(self):
+        self.assertEqual(self.cache.get('產假幾天', 'v2'), (None, None))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_evicted_rows_are_reused_in_place(self):
+        cache = AnswerCache(StubEmbeddings(), similarity_threshold=0.95, cache=MemoryCache(), max_entries=2)
+        cache.put('產假幾天', {'answer': '56 天'}, 'v1')
+        cache.put('婚假幾天', {'answer': '8 天'}, 'v1')
+        matrix = cache._matrix
+        cache.put('加班費怎麼算', {'answer': '1.34 倍'}, 'v1')
+        self.assertIs(cache._matrix, matrix)
+        self.assertEqual(list(cache._vectors), ['婚假幾天', '加班費怎麼算'])
+        self.assertEqual(sorted(cache._matrix_keys), ['加班費怎麼算', '婚假幾天'])
+        self.assertEqual(cache.get('婚假有幾天', 'v1'), ({'answer': '8 天'}, 'semantic'))
+        self.assertEqual(cache.get('加班費幾倍', 'v1'), ({'answer': '1.34 倍'}, 'semantic'))
+
+    def test_key_terms(self):
+        self.assertEqual(key_terms(normalize_question('請問產假有幾天？')), {'產假'})
+        self.assertEqual(key_terms(normalize_question('7.1 條的加班費')), {'7.1', '加班費'})
+
+
+class TopicEmbeddings:
+    """依文中第一個出現的主題詞決定向量，同主題的文字相似度為 1"""
+
+    topics = ('補休', '婚', '產', '加班')
+
+    def embed_query(self, text):
+        vector = [0.0] * (len(self.topics) + 1)
+        found = [text.find(topic) for topic in self.topics]
+        candidates = [(position, index) for index, position in enumerate(found) if position >= 0]
+        vector[min(candidates)[1] if candidates else -1] = 1.0
+        return vector
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class QueryRouterTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = ChunkStore(os.path.join(directory, 'chunks.sqlite3'))
+        chunks = annotate_clauses([
+            Document(page_content='7.4婚假\n7.4.1結婚者給婚假八日。', metadata={'source': '手冊.docx'}),
+            Document(page_content='8.1加班\n8.1.1加班費依時薪計算。', metadata={'source': '手冊.docx'}),
+        ])
+        store.add(['c1', 'c2'], chunks)
+        self.router = QueryRouter(store, TopicEmbeddings(), faq_entries=[
+            {'question': '產假幾天', 'answer': '產假八週。', 'clauses': []},
+        ])
+
+    def test_clause_number_is_answered_directly(self):
+        routed = self.router.route('7.4.1 的內容')
+        self.assertEqual((routed['path'], routed['direct']), ('clause', True))
+        self.assertIn('婚假八日', routed['result'])
+
+    def test_exact_heading_is_answered_directly(self):
+        routed = self.router.route('請問婚假的規定')
+        self.assertEqual((routed['path'], routed['direct']), ('faq', True))
+        self.assertIn('7.4.1', routed['result'])
+
+    def test_similar_question_sends_clause_to_llm(self):
+        routed = self.router.route('婚假可以分次請嗎')
+        self.assertEqual((routed['path'], routed['direct']), ('routed_llm', False))
+        self.assertIn('婚假八日', routed['source_documents'][0].page_content)
+
+    def test_similar_faq_question_keeps_faq_answer_as_context(self):
+        routed = self.router.route('產假可以延長嗎')
+        self.assertFalse(routed['direct'])
+        self.assertEqual(routed['source_documents'][0].page_content, '產假八週。')
+
+    def test_unrelated_question_is_not_routed(self):
+        self.assertIsNone(self.router.route('補休怎麼申請'))
+
+    def test_clause_shared_by_two_sources_is_not_answered_directly(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        store = ChunkStore(os.path.join(directory, 'chunks.sqlite3'))
+        store.add(['t1'], annotate_clauses([
+            Document(page_content='7.1公出\n7.1.1公出需事先申請。', metadata={'source': '出差辦法.docx'}),
+        ]))
+        store.add(['l1'], annotate_clauses([
+            Document(page_content='7.1事假\n7.1.1事假全年七日。\n7.2病假\n7.2.1病假全年三十日。',
+                     metadata={'source': '請假辦法.docx'}),
+        ]))
+        router = QueryRouter(store, TopicEmbeddings())
+
+        routed = router.route('7.1說什麼')
+        self.assertEqual((routed['path'], routed['direct']), ('routed_llm', False))
+        self.assertEqual({doc.metadata['source'] for doc in routed['source_documents']},
+                         {'出差辦法.docx', '請假辦法.docx'})
+
+        # 標題只屬於一份文件：條文也只取自該文件
+        routed = router.route('事假')
+        self.assertEqual((routed['path'], routed['direct']), ('faq', True))
+        self.assertIn('事假全年七日', routed['result'])
+        self.assertNotIn('公出', routed['result'])
+        self.assertEqual(router.route('7.2說什麼')['path'], 'clause')
+
+
+class QAEngineReloadTests(SimpleTestCase):
+    def make_chain(self, version):
+        retriever = SimpleNamespace(
+            invoke=lambda query: [Document(page_content=f'索引 {version}', metadata={'source': version})]
+        )
+        return SimpleNamespace(metadata={'index_version': version, 'cache': self.cache}, retriever=retriever)
+
+    def test_in_flight_state_is_untouched_while_new_version_builds(self):
+        self.cache = MemoryCache()
+        versions = iter(['v1', 'v2'])
+        seen_during_build = []
+
+        def builder():
+            version = next(versions)
+            if version == 'v2':
+                seen_during_build.append((engine.index_version, engine.get_state() is old_state))
+            return self.make_chain(version)
+
+        engine = QAEngine(builder=builder, check_interval=3600)
+        old_state = engine.get_state()
+        engine._retrieve(old_state, '請假')
+        engine.reload()
+
+        # 建立新版本期間服務中的狀態不變；替換後舊狀態仍指向舊版本
+        self.assertEqual(seen_during_build, [('v1', True)])
+        self.assertEqual((old_state.index_version, engine.index_version), ('v1', 'v2'))
+        self.assertIsNot(engine.answer_cache, old_state.answer_cache)
+        self.assertEqual(engine._retrieve(engine.get_state(), '請假')[0].page_content, '索引 v2')
+
+
+class ChunkStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.store = ChunkStore(os.path.join(directory, 'chunks.sqlite3'))
+
+    def test_clause_documents_are_grouped_by_source_in_document_order(self):
+        leave = annotate_clauses([
+            Document(page_content='7.1事假\n7.1.1事假全年七日。', metadata={'source': '請假辦法.docx'}),
+            Document(page_content='7.1.2事假不給薪。', metadata={'source': '請假辦法.docx'}),
+        ])
+        trip = annotate_clauses([
+            Document(page_content='7.1公出\n7.1.1公出需事先申請。', metadata={'source': '出差辦法.docx'}),
+        ])
+        # chunk ID 的順序與文件順序相反，結果仍依文件順序排列
+        self.store.add(['z-leave', 'a-leave'], leave)
+        self.store.add(['m-trip'], trip)
+
+        grouped = self.store.get_clause_documents('7.1')
+        self.assertEqual(set(grouped), {'請假辦法.docx', '出差辦法.docx'})
+        self.assertEqual([doc.id for doc in grouped['請假辦法.docx']], ['z-leave', 'a-leave'])
+        self.assertEqual(clause_text('7.1', grouped['請假辦法.docx']),
+                         '7.1事假\n7.1.1事假全年七日。\n7.1.2事假不給薪。')
+        self.assertNotIn('公出', clause_text('7.1', grouped['請假辦法.docx']))
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_round_trip_and_miss(self):
+        cache = EmbeddingCache(self.directory)
+        cache.put_many(['a', 'b'], [[1.0, 0.0], [0.0, 1.0]])
+        a, missing, b = cache.get_many(['a', 'x', 'b'])
+        np.testing.assert_array_equal(a, [1.0, 0.0])
+        np.testing.assert_array_equal(b, [0.0, 1.0])
+        self.assertIsNone(missing)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_reused_slot_is_a_miss(self):
+        cache = EmbeddingCache(self.directory)
+        cache.put_many(['a'], [[1.0, 0.0]])
+        # 模擬其他行程淘汰 a 後把槽位寫成別的向量、尚未提交
+        other = EmbeddingCache(self.directory)
+        other._vectors(2, 1)[0] = [0.5, 0.5]
+        self.assertEqual(cache.get_many(['a']), [None])
+
+    def test_reads_do_not_write_until_batch(self):
+        cache = EmbeddingCache(self.directory, max_entries=2)
+        cache.put_many(['old', 'new'], [[1.0, 0.0], [0.0, 1.0]])
+        cache.get_many(['old'])
+        last_used = dict(cache._conn.execute("SELECT key, last_used FROM entries").fetchall())
+        self.assertLess(last_used['old'], last_used['new'])
+        # 寫入新項目前先寫入累積的使用時間，最近讀過的 old 不會被淘汰
+        cache.put_many(['third'], [[0.6, 0.8]])
+        self.assertIsNotNone(cache.get_many(['old'])[0])
+        self.assertIsNone(cache.get_many(['new'])[0])
+
+    def test_entry_count_is_kept_without_counting_rows(self):
+        cache = EmbeddingCache(self.directory, max_entries=2)
+        cache.put_many(['a', 'b'], [[1.0, 0.0], [0.0, 1.0]])
+        cache.put_many(['a'], [[0.6, 0.8]])
+        self.assertEqual(len(cache), 2)
+        cache.put_many(['c'], [[0.8, 0.6]])
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(len(EmbeddingCache(self.directory)), 2)
+
+    def test_changed_dimension_frees_old_slot(self):
+        cache = EmbeddingCache(self.directory)
+        cache.put_many(['a'], [[1.0, 0.0]])
+        cache.put_many(['a'], [[1.0, 0.0, 0.0]])
+        self.assertEqual(len(cache), 1)
+        np.testing.assert_array_equal(cache.get_many(['a'])[0], [1.0, 0.0, 0.0])
+        cache.put_many(['b'], [[0.0, 1.0]])
+        self.assertEqual(cache._conn.execute("SELECT slot FROM entries WHERE key = 'b'").fetchone(), (0,))
+
+    def test_adds_checksums_to_old_cache(self):
+        cache = EmbeddingCache(self.directory)
+        cache.put_many(['a'], [[1.0, 0.0]])
+        cache._conn.execute("ALTER TABLE entries DROP COLUMN checksum")
+        reopened = EmbeddingCache(self.directory)
+        np.testing.assert_array_equal(reopened.get_many(['a'])[0], [1.0, 0.0])
+
+
+class APIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FlakyEmbeddings:
+    """依序拋出 errors 中的錯誤，之後正常嵌入"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return [[float(len(text))] for text in texts]
+
+
+class EmbeddingExecutorTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('rag.embedding_executor.asyncio.sleep', new=mock.AsyncMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_rate_limit_server_error_and_timeout(self):
+        embeddings = FlakyEmbeddings(APIError(429), APIError(503), TimeoutError())
+        executor = EmbeddingExecutor(embeddings, max_retries=3)
+        with mock.patch('builtins.print'):
+            self.assertEqual(executor.embed(['ab']), [[2.0]])
+        self.assertEqual((embeddings.calls, executor.stats['retries']), (4, 3))
+
+    def test_client_errors_are_not_retried(self):
+        for error in (APIError(400), APIError(401), ValueError('invalid input')):
+            embeddings = FlakyEmbeddings(error)
+            executor = EmbeddingExecutor(embeddings, max_retries=3)
+            with self.assertRaises(type(error)):
+                executor.embed(['ab'])
+            self.assertEqual((embeddings.calls, executor.stats['retries']), (1, 0))
+
+
+class TracingTests(SimpleTestCase):
+    def test_trace_is_logged_only_when_enabled(self):
+        self.assertFalse(trace_logger.isEnabledFor(logging.INFO))
+        with self.assertLogs('rag.trace', 'INFO') as logs:
+            with trace('chat', path='llm'):
+                with span('retrieval'):
+                    pass
+        record = json.loads(logs.output[0].split(':', 2)[2])
+        self.assertEqual((record['name'], record['path']), ('chat', 'llm'))
+        self.assertEqual([item['name'] for item in record['spans']], ['retrieval'])
+
+
+class CacheBackendTestMixin:
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('rag.cache_backends.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backend = self.make_backend()
+
+    def set(self, key, ttl=None):
+        self.now += 1
+        self.backend.set('answer:v1', key, {'answer': key}, ttl=ttl, max_entries=2)
+
+    def test_evicts_least_recently_used(self):
+        self.set('a')
+        self.set('b')
+        self.now += 1
+        self.assertEqual(self.backend.get('answer:v1', 'a'), {'answer': 'a'})
+        self.set('c')
+        self.assertIsNone(self.backend.get('answer:v1', 'b'))
+        self.assertEqual(self.backend.get('answer:v1', 'a'), {'answer': 'a'})
+        self.assertEqual(self.backend.namespaces(), {'answer:v1': 2})
+
+    def test_drop_namespaces_keeps_current_version(self):
+        self.set('a')
+        self.backend.set('answer:v2', 'a', 1)
+        self.backend.set('retrieval:v1', 'a', 1)
+        self.backend.drop_namespaces('answer', keep='answer:v2')
+        self.assertEqual(self.backend.namespaces(), {'answer:v2': 1, 'retrieval:v1': 1})
+
+
+class MemoryCacheTests(CacheBackendTestMixin, SimpleTestCase):
+    def make_backend(self):
+        return MemoryCache()
+
+    def test_expired_entries_miss(self):
+        self.set('a', ttl=10)
+        self.now += 11
+        self.assertIsNone(self.backend.get('answer:v1', 'a'))
+
+
+class SQLiteCacheTests(CacheBackendTestMixin, SimpleTestCase):
+    def make_backend(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        return SQLiteCache(os.path.join(directory, 'cache.sqlite3'))
+
+    def test_hits_do_not_write(self):
+        self.set('a')
+        statements = []
+        self.backend._conn.set_trace_callback(statements.append)
+        self.assertEqual(self.backend.get('answer:v1', 'a'), {'answer': 'a'})
+        self.assertTrue(all(statement.startswith('SELECT') for statement in statements))
+
+    def test_expired_entries_are_not_counted(self):
+        self.set('a', ttl=10)
+        self.set('b')
+        self.now += 11
+        self.assertIsNone(self.backend.get('answer:v1', 'a'))
+        self.assertEqual(self.backend.namespaces(), {'answer:v1': 1})
+        self.set('c')
+        count = self.backend._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        self.assertEqual(count, 2)
+
+
+@unittest.skipIf(fakeredis is None, "需要 fakeredis")
+class RedisCacheTests(CacheBackendTestMixin, SimpleTestCase):
+    def make_backend(self):
+        return RedisCache(client=fakeredis.FakeRedis())
+
+    def lru_members(self):
+        return self.backend.client.zrange(self.backend._lru_key('answer:v1'), 0, -1)
+
+    def test_expired_entries_are_pruned(self):
+        self.set('a', ttl=10)
+        self.set('b')
+        # 模擬 Redis 已因 EXPIRE 刪除值
+        self.backend.client.delete(self.backend._value_key('answer:v1', 'a'))
+        self.now += 11
+        self.assertEqual(self.backend.namespaces(), {'answer:v1': 1})
+        self.assertEqual(self.lru_members(), [b'b'])
+
+    def test_miss_removes_lru_member(self):
+        self.set('a')
+        self.backend.client.delete(self.backend._value_key('answer:v1', 'a'))
+        self.assertIsNone(self.backend.get('answer:v1', 'a'))
+        self.assertEqual(self.lru_members(), [])
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_tokenize_cjk_bigrams_and_clause_numbers(self):
+        self.assertEqual(tokenize('特休假 7.5.1 ABC'), ['特休', '休假', '7.5.1', 'abc'])
+        self.assertEqual(tokenize('假'), ['假'])
+        # 全形字元經 NFKC 正規化
+        self.assertEqual(tokenize('７．５'), ['7.5'])
+        self.assertEqual(tokenize('7.5.1.2', expand_clauses=True), ['7.5.1.2', '7.5.1', '7.5'])
+
+    def test_bm25_ranks_matching_chunks(self):
+        index = LexicalIndex(self.directory)
+        index.add(['leave', 'travel', 'clause'], ['特休假的申請流程', '出差旅費報支', '7.5.1.2 加班費的計算'])
+        self.assertEqual([chunk_id for chunk_id, _ in index.search('特休假怎麼申請', 5)], ['leave'])
+        # 查詢上層條款編號也能命中子條款
+        self.assertEqual(index.search('7.5.1', 5)[0][0], 'clause')
+        self.assertEqual(index.search('不相關', 5), [])
+
+    def test_delete_and_reload(self):
+        index = LexicalIndex(self.directory)
+        index.add(['a', 'b'], ['請假規定', '請假與加班'])
+        index.commit()
+        index.delete(['a'])
+        index.commit()
+        reloaded = LexicalIndex(self.directory)
+        self.assertEqual([chunk_id for chunk_id, _ in reloaded.search('請假', 5)], ['b'])
+        self.assertEqual(len(reloaded), 1)
+
+
+class VectorRetrieverTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        texts = ['特休假的申請流程', '出差旅費報支', '7.5.1 加班費的計算', '婚假八日', '產假八週', '病假全年三十日']
+        ids = [f'c{i}' for i in range(len(texts))]
+        self.embeddings = HashEmbeddings(dim=32, latency=0)
+        self.backend = FaissFlatBackend(os.path.join(directory, 'vectors'))
+        self.backend.add(ids, self.embeddings.embed_documents(texts))
+        self.backend.commit()
+        self.chunk_store = ChunkStore(os.path.join(directory, 'chunks.sqlite3'))
+        self.chunk_store.add(ids, [Document(page_content=text, metadata={'source': 'a.txt'}) for text in texts])
+        self.lexical_index = LexicalIndex(directory)
+        self.lexical_index.add(ids, texts)
+
+    def test_batch_matches_single_queries(self):
+        questions = ['特休假怎麼申請', '加班費', '婚假幾天']
+        for search_type in ('similarity', 'hybrid', 'mmr'):
+            retriever = VectorRetriever(embeddings=self.embeddings, backend=self.backend, chunk_store=self.chunk_store,
+                                        lexical_index=self.lexical_index, search_type=search_type, k=2, fetch_k=4)
+            with mock.patch.object(self.backend, 'search_batch', wraps=self.backend.search_batch) as search_batch:
+                batched = retriever.batch_documents(questions)
+            search_batch.assert_called_once()
+            single = [retriever.invoke(question) for question in questions]
+            self.assertEqual([[doc.id for doc in docs] for docs in batched],
+                             [[doc.id for doc in docs] for docs in single], search_type)
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    def test_fuses_by_rank_only(self):
+        vector = [('a', 0.9), ('b', 0.8), ('c', 0.1)]
+        lexical = [('c', 30.0), ('b', 12.0)]
+        fused = reciprocal_rank_fusion([vector, lexical], k=60)
+        # 兩邊都出現的排在只出現一次的前面，與原始分數的尺度無關
+        self.assertEqual([chunk_id for chunk_id, _ in fused], ['c', 'b', 'a'])
+        self.assertAlmostEqual(dict(fused)['c'], 1 / 63 + 1 / 61)
+        self.assertAlmostEqual(dict(fused)['b'], 1 / 62 + 1 / 62)
+        self.assertAlmostEqual(dict(fused)['a'], 1 / 61)
+
+
+class ClauseSplitterTests(SimpleTestCase):
+    separators = ["\n\n", "\n", "。", ""]
+
+    def make_text(self):
+        chapters = []
+        for chapter in range(1, 4):
+            lines = [f"{chapter}.第{chapter}章"]
+            for clause in range(1, 5):
+                lines.append(f"{chapter}.{clause}條款{'內容' * clause * 6}")
+                lines += [f"{chapter}.{clause}.{item}.細則{'說明' * item * 9}。補充" for item in range(1, 4)]
+            chapters.append('\n'.join(lines))
+        return "前言\n" + '\n'.join(chapters)
+
+    def split(self, chunk_size=120, parent_chunk_size=400):
+        text = self.make_text()
+        splitter = ClauseSplitter(chunk_size, 20, parent_chunk_size, self.separators)
+        parents, children = splitter.split_with_parents([Document(page_content=text)])
+        return text, parents, children
+
+    def test_subtree_ends(self):
+        segments = parse_clauses("前言\n1.總則\n1.1目的\n1.1.1.範圍\n1.2定義\n2.工時\n")
+        self.assertEqual([number for number, _, _ in segments], ['', '1', '1.1', '1.1.1', '1.2', '2'])
+        self.assertEqual(subtree_ends(segments), [1, 5, 4, 4, 5, 6])
+
+    def test_chunks_respect_size_bounds(self):
+        for chunk_size, parent_chunk_size in ((120, 400), (60, 200), (300, 300)):
+            _, parents, children = self.split(chunk_size, parent_chunk_size)
+            self.assertTrue(all(len(doc.page_content) <= parent_chunk_size for doc in parents))
+            self.assertTrue(all(len(doc.page_content) <= chunk_size for doc in children))
+
+    def test_children_cover_text_within_parents(self):
+        text, parents, children = self.split()
+        covered = [False] * len(text)
+        for child in children:
+            start = child.metadata['start_index']
+            self.assertEqual(text[start:start + len(child.page_content)], child.page_content)
+            parent = parents[child.metadata['parent_index']]
+            self.assertGreaterEqual(start, parent.metadata['start_index'])
+            self.assertLessEqual(start + len(child.page_content),
+                                 parent.metadata['start_index'] + len(parent.page_content))
+            covered[start:start + len(child.page_content)] = [True] * len(child.page_content)
+        self.assertTrue(all(covered[i] for i, char in enumerate(text) if not char.isspace()))
+
+    def test_small_clause_stays_with_its_items(self):
+        _, _, children = self.split(chunk_size=200, parent_chunk_size=1200)
+        # 條款連同其細則放得進一個 chunk 時不拆開，也不與下一條款合併
+        clause = next(doc.page_content for doc in children if '1.1條款' in doc.page_content)
+        self.assertIn('1.1.3.細則', clause)
+        self.assertNotIn('1.2條款', clause)
+
+
+class NormalizeQueryTests(SimpleTestCase):
+    def test_variants_share_one_form(self):
+        expected = normalize_query('請假幾天')
+        for variant in ('请假几天？', ' 請假幾天。', '請假幾天?!', '請假幾天～'):
+            self.assertEqual(normalize_query(variant), expected)
+        # 字詞間的空白合併為一個，不刪除
+        self.assertEqual(normalize_query('特休\u3000 Days\n'), '特休 days')
+
+    def test_width_punctuation_and_case(self):
+        self.assertEqual(normalize_query('「ＡＢＣ」第７．５條'), '"abc"第7.5條')
+        self.assertEqual(normalize_query('特休、病假'), '特休,病假')
+
+    def test_query_embeddings_reuse_cached_vector(self):
+        embeddings = mock.Mock(spec=StubEmbeddings, wraps=StubEmbeddings())
+        query_embeddings = QueryEmbeddings(embeddings, cache=MemoryCache())
+        first = query_embeddings.embed_query('请假几天？')
+        self.assertEqual(query_embeddings.embed_query(' 請假幾天 '), first)
+        embeddings.embed_query.assert_called_once_with('請假幾天')
+
+    def test_query_and_document_with_same_text_keep_own_vectors(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        embeddings = AsymmetricEmbeddings()
+        documents = CachedEmbeddings(embeddings, cache=EmbeddingCache(directory))
+        query_embeddings = QueryEmbeddings.wrap(documents, cache=MemoryCache())
+
+        document_vector = documents.embed_documents(['請假幾天'])[0]
+        query_vector = query_embeddings.embed_query('請假幾天')
+        np.testing.assert_allclose(query_vector, embeddings.embed_query('請假幾天'), rtol=1e-6)
+        self.assertFalse(np.allclose(query_vector, document_vector))
+        # 查詢嵌入不佔用文件嵌入快取的筆數，文件嵌入也不被查詢向量覆蓋
+        self.assertEqual(len(documents.cache), 1)
+        np.testing.assert_allclose(documents.embed_documents(['請假幾天'])[0], document_vector)
+        self.assertEqual(embeddings.calls, [1])
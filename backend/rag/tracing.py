@@ -0,0 +1,200 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# 每個請求的追蹤記錄（JSON lines）以 INFO 等級寫入 rag.trace logger，預設不輸出；
+# 設定 TRACE_LOG_FILE 時寫入該檔案，或在 Django 的 LOGGING 設定中為 rag.trace 加上 handler
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", "")
+
+trace_logger = logging.getLogger("rag.trace")
+if TRACE_LOG_FILE and TRACE_LOG_FILE != 'off':
+    _handler = logging.FileHandler(TRACE_LOG_FILE, encoding='utf-8')
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    trace_logger.addHandler(_handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Prometheus 格式的累積直方圖，依 label 值分組"""
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label 值 -> [各 bucket 的次數..., 總和, 次數]
+        self._series = {}
+
+    def observe(self, label_value, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(value) for key, value in self._series.items()}
+        for label_value, values in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{label}}} {values[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{label}}} {values[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_value, value in sorted(values.items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "QA 流程各階段耗時", "stage")
+REQUEST_SECONDS = Histogram("rag_request_duration_seconds", "整個請求的耗時（依回答路徑）", "path")
+TOKENS = Counter("rag_tokens_total", "各類 token 的累計數量", "kind")
+QUERY_EMBEDDING_CACHE = Counter(
+    "rag_query_embedding_cache_total", "查詢嵌入的來源（快取後端名稱、disk 或 miss）", "result"
+)
+CACHE_REQUESTS = Counter("rag_cache_requests_total", "QA 快取各種類的命中與未命中次數", "result")
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, TOKENS, QUERY_EMBEDDING_CACHE, CACHE_REQUESTS]
+
+
+def render_metrics():
+    """以 Prometheus 文字格式輸出（每個行程各自累計，多 worker 部署時需分別抓取）"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """一個請求的追蹤記錄：各階段的 span（名稱、相對起點、耗時）與 token 數"""
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+        self.tokens = {}
+        self.attrs = {}
+
+    def add_span(self, name, started, duration, **attrs):
+        span = {
+            'name': name,
+            'start_ms': round((started - self._started) * 1000, 2),
+            'duration_ms': round(duration * 1000, 2),
+        }
+        span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    def add_tokens(self, kind, count):
+        with self._lock:
+            self.tokens[kind] = self.tokens.get(kind, 0) + count
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._started
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start_ms'])
+            return dict(self.attrs, trace_id=self.id, name=self.name, started_at=self.started_at,
+                        duration_ms=round(self.elapsed * 1000, 2), tokens=dict(self.tokens), spans=spans)
+
+
+_current = contextvars.ContextVar('rag_trace', default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+def record_span(name, started, duration, **attrs):
+    """記錄已量測好的階段耗時（例如串流時第一個 token 的延遲）"""
+    STAGE_SECONDS.observe(name, duration)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(name, started, duration, **attrs)
+
+
+@contextmanager
+def span(name, **attrs):
+    """量測一個階段；可在 with 區塊內修改回傳的 dict 補上屬性（如筆數）"""
+    started = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        record_span(name, started, time.perf_counter() - started, **attrs)
+
+
+def add_tokens(kind, count):
+    TOKENS.inc(kind, count)
+    trace = _current.get()
+    if trace is not None:
+        trace.add_tokens(kind, count)
+
+
+def write_trace(record):
+    # 未啟用時不序列化
+    if trace_logger.isEnabledFor(logging.INFO):
+        trace_logger.info(json.dumps(record, ensure_ascii=False))
+
+
+@contextmanager
+def trace(name, **attrs):
+    """追蹤一個請求：區塊內（含 asyncio.to_thread、sync_to_async 的執行緒）的 span 都記錄在同一筆
+
+    結束時依 attrs['path']（回答路徑）記錄請求耗時，並以一行 JSON 寫入 rag.trace logger。
+    """
+    current = Trace(name)
+    current.attrs.update(attrs)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs.setdefault('error', str(e) or type(e).__name__)
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # 非同步產生器在其他 context 中被關閉（如用戶端中斷連線）
+            pass
+        REQUEST_SECONDS.observe(current.attrs.get('path') or 'error', current.elapsed)
+        write_trace(current.to_dict())
@@ -0,0 +1,359 @@
+import json
+import math
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from rag.matrix_index import MatrixIndex, normalize_rows
+
+
+# FaissBackend 搜尋時讀取的不可變快照
+SearchSnapshot = namedtuple('SearchSnapshot', ['index', 'ids', 'positions', 'matrix'])
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            total += os.path.getsize(os.path.join(root, filename))
+    return total
+
+
+class VectorBackend:
+    """向量索引後端的共同介面
+
+    後端只保存 chunk ID 與向量，以 cosine 相似度搜尋；chunk 內容另存於 ChunkStore。
+    add / delete 之後需呼叫 commit() 才會持久化（部分後端會在此時重建索引）。
+    """
+
+    name = None
+
+    def __init__(self, persist_directory, **options):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.persist_directory = persist_directory
+        self.options = options
+
+    def add(self, ids, vectors):
+        """加入（或覆蓋）向量"""
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def search(self, query, k):
+        """回傳 [(chunk_id, 相似度)]，依相似度由高到低"""
+        return self.search_batch([query], k)[0]
+
+    def search_batch(self, queries, k):
+        raise NotImplementedError
+
+    def get_vectors(self, ids):
+        """回傳與 ids 對齊的（正規化）向量矩陣，供 MMR 等重新排序使用"""
+        raise NotImplementedError
+
+    def ids(self):
+        raise NotImplementedError
+
+    def commit(self):
+        """持久化目前狀態"""
+
+    def __len__(self):
+        return len(self.ids())
+
+    @property
+    def nbytes(self):
+        """索引佔用的記憶體（或磁碟）大小估計"""
+        return directory_size(self.persist_directory)
+
+
+class ChromaBackend(VectorBackend):
+    """Chroma 持久化 collection（HNSW, cosine）"""
+
+    name = "chroma"
+    batch_size = 5000
+
+    def __init__(self, persist_directory, collection_name="hr_chunks", **options):
+        super().__init__(persist_directory, **options)
+        import chromadb
+        from chromadb.config import Settings
+        self.client = chromadb.PersistentClient(
+            path=persist_directory, settings=Settings(anonymized_telemetry=False)
+        )
+        self.collection = self.client.get_or_create_collection(
+            collection_name, metadata={"hnsw:space": "cosine"}
+        )
+
+    def add(self, ids, vectors):
+        vectors = normalize_rows(vectors)
+        for start in range(0, len(ids), self.batch_size):
+            self.collection.upsert(
+                ids=list(ids[start:start + self.batch_size]),
+                embeddings=vectors[start:start + self.batch_size].tolist()
+            )
+
+    def delete(self, ids):
+        for start in range(0, len(ids), self.batch_size):
+            self.collection.delete(ids=list(ids[start:start + self.batch_size]))
+
+    def search_batch(self, queries, k):
+        count = self.collection.count()
+        if count == 0:
+            return [[] for _ in queries]
+        result = self.collection.query(
+            query_embeddings=normalize_rows(queries).tolist(),
+            n_results=min(k, count),
+            include=["distances"]
+        )
+        return [
+            [(chunk_id, 1.0 - distance) for chunk_id, distance in zip(ids, distances)]
+            for ids, distances in zip(result["ids"], result["distances"])
+        ]
+
+    def get_vectors(self, ids):
+        result = self.collection.get(ids=list(ids), include=["embeddings"])
+        by_id = dict(zip(result["ids"], result["embeddings"]))
+        return normalize_rows([by_id[chunk_id] for chunk_id in ids])
+
+    def ids(self):
+        return self.collection.get(include=[])["ids"]
+
+    def __len__(self):
+        return self.collection.count()
+
+
+class FaissBackend(VectorBackend):
+    """FAISS 後端的共同實作
+
+    正規化後的原始向量另存為 vectors.npy（以 MatrixIndex 保存），用來：
+    - 取回向量（MMR）
+    - 刪除後壓縮、或需要訓練的索引（IVF-PQ）在 commit() 時重建
+    刪除先以墓碑標記，commit() 時才真正移除。
+    搜尋只讀取上一次 commit() 發布的快照（索引、ID、向量），add / delete 不影響進行中的查詢；
+    commit() 在鎖內建立完整的新索引（可增量加入時複製現有索引再加入）後一次替換快照。
+    """
+
+    def __init__(self, persist_directory, **options):
+        super().__init__(persist_directory, **options)
+        import faiss
+        self.faiss = faiss
+        self.store = MatrixIndex()
+        self._ids = []
+        self._positions = {}
+        self._deleted = set()
+        # 已加入、尚未進入索引的向量位置（可增量加入時於 commit() 加入複製的索引）
+        self._unindexed = []
+        self.index = None
+        self._needs_rebuild = False
+        self._lock = threading.Lock()
+        self._snapshot = SearchSnapshot(None, [], {}, np.empty((0, 0), dtype=np.float32))
+        self._load()
+
+    def _path(self, filename):
+        return os.path.join(self.persist_directory, filename)
+
+    def _load(self):
+        if not os.path.exists(self._path("ids.json")):
+            return
+        with open(self._path("ids.json"), 'r', encoding='utf-8') as f:
+            self._ids = json.load(f)
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+        if self._ids:
+            self.store = MatrixIndex(np.load(self._path("vectors.npy")))
+            self.index = self.faiss.read_index(self._path("index.faiss"))
+            self._configure_search(self.index)
+        self._publish()
+
+    def build_index(self, vectors):
+        """依全部向量建立新的索引（子類別實作）"""
+        raise NotImplementedError
+
+    def _configure_search(self, index):
+        """設定搜尋參數（如 efSearch、nprobe）"""
+
+    def _publish(self):
+        self._snapshot = SearchSnapshot(self.index, list(self._ids), dict(self._positions), self.store.matrix)
+
+    def _rebuild(self):
+        live = [i for i in range(len(self._ids)) if i not in self._deleted]
+        vectors = self.store.matrix[live]
+        ids = [self._ids[i] for i in live]
+        index = self.build_index(vectors) if len(vectors) else None
+        if index is not None:
+            self._configure_search(index)
+        self._ids = ids
+        self._positions = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        self._deleted = set()
+        self.store = MatrixIndex(vectors) if len(vectors) else MatrixIndex()
+        self.index = index
+
+    def _extend(self):
+        """複製現有索引並加入新向量，不修改搜尋中的索引"""
+        index = self.faiss.clone_index(self.index)
+        index.add(self.store.matrix[self._unindexed])
+        self._configure_search(index)
+        self.index = index
+
+    def supports_incremental_add(self):
+        return True
+
+    def add(self, ids, vectors):
+        with self._lock:
+            self._delete([chunk_id for chunk_id in ids if chunk_id in self._positions])
+            positions = self.store.add(normalize_rows(vectors))
+            for chunk_id, position in zip(ids, positions):
+                self._ids.append(chunk_id)
+                self._positions[chunk_id] = int(position)
+            self._unindexed.extend(int(position) for position in positions)
+            if self.index is None or not self.supports_incremental_add():
+                self._needs_rebuild = True
+
+    def delete(self, ids):
+        with self._lock:
+            self._delete(ids)
+
+    def _delete(self, ids):
+        for chunk_id in ids:
+            position = self._positions.pop(chunk_id, None)
+            if position is not None:
+                self._deleted.add(position)
+        if self._deleted:
+            self._needs_rebuild = True
+
+    def search_batch(self, queries, k):
+        snapshot = self._snapshot
+        if snapshot.index is None:
+            return [[] for _ in queries]
+        scores, positions = snapshot.index.search(normalize_rows(queries), min(len(snapshot.ids), k))
+        return [
+            [(snapshot.ids[position], float(score))
+             for score, position in zip(row_scores, row_positions) if position >= 0]
+            for row_scores, row_positions in zip(scores, positions)
+        ]
+
+    def get_vectors(self, ids):
+        snapshot = self._snapshot
+        return snapshot.matrix[[snapshot.positions[chunk_id] for chunk_id in ids]]
+
+    def ids(self):
+        return list(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def commit(self):
+        with self._lock:
+            if self._needs_rebuild:
+                self._rebuild()
+            elif self._unindexed:
+                self._extend()
+            self._unindexed = []
+            self._needs_rebuild = False
+            self._publish()
+            if self.index is None:
+                # ids.json 先刪除，讀取端看到的是空索引而不是缺檔的索引
+                for filename in ("ids.json", "vectors.npy", "index.faiss"):
+                    if os.path.exists(self._path(filename)):
+                        os.remove(self._path(filename))
+                return
+            # 三個檔案都寫完暫存檔後才依序替換，寫入失敗時磁碟上仍是上一版的完整索引；
+            # _load 以 ids.json 判斷索引是否存在並先讀取它，因此最後才替換
+            with open(self._path("vectors.npy.tmp"), 'wb') as f:
+                # 以檔案物件寫入，np.save 才不會在檔名後再加上 .npy
+                np.save(f, self.store.matrix)
+            self.faiss.write_index(self.index, self._path("index.faiss.tmp"))
+            with open(self._path("ids.json.tmp"), 'w', encoding='utf-8') as f:
+                json.dump(self._ids, f)
+            for filename in ("vectors.npy", "index.faiss", "ids.json"):
+                os.replace(self._path(filename + ".tmp"), self._path(filename))
+
+    @property
+    def nbytes(self):
+        if self.index is None:
+            return 0
+        return int(self.faiss.serialize_index(self.index).nbytes)
+
+
+class FaissFlatBackend(FaissBackend):
+    """FAISS 暴力搜尋（精確結果），適合小型語料"""
+
+    name = "faiss-flat"
+
+    def build_index(self, vectors):
+        index = self.faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        return index
+
+
+class FaissHNSWBackend(FaissBackend):
+    """FAISS HNSW 圖索引：近似搜尋，可增量加入，刪除時需重建"""
+
+    name = "faiss-hnsw"
+
+    def build_index(self, vectors):
+        index = self.faiss.IndexHNSWFlat(
+            vectors.shape[1], self.options.get("m", 32), self.faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = self.options.get("ef_construction", 200)
+        index.add(vectors)
+        return index
+
+    def _configure_search(self, index):
+        index.hnsw.efSearch = self.options.get("ef_search", 64)
+
+
+class FaissIVFPQBackend(FaissBackend):
+    """FAISS IVF-PQ：分群 + 乘積量化壓縮，記憶體最省
+
+    需要以全部向量訓練，因此每次 commit() 有新增或刪除時都會重新訓練建立；
+    向量數太少無法訓練時退回暴力搜尋。
+    """
+
+    name = "faiss-ivfpq"
+    min_train_size = 1000
+
+    def supports_incremental_add(self):
+        return False
+
+    def _subquantizers(self, dim):
+        """取不超過設定值且能整除維度的子量化器數量"""
+        m = min(self.options.get("pq_m", 64), dim)
+        while dim % m:
+            m -= 1
+        return m
+
+    def build_index(self, vectors):
+        count, dim = vectors.shape
+        if count < self.min_train_size:
+            index = self.faiss.IndexFlatIP(dim)
+            index.add(vectors)
+            return index
+        nlist = self.options.get("nlist") or int(4 * math.sqrt(count))
+        nlist = max(1, min(nlist, count // 39))
+        # 每個 PQ 碼本需約 39 * 2^nbits 筆訓練向量
+        nbits = min(8, int(math.log2(count // 39)))
+        quantizer = self.faiss.IndexFlatIP(dim)
+        index = self.faiss.IndexIVFPQ(
+            quantizer, dim, nlist, self._subquantizers(dim), nbits, self.faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(vectors)
+        index.add(vectors)
+        return index
+
+    def _configure_search(self, index):
+        if hasattr(index, "nprobe"):
+            index.nprobe = self.options.get("nprobe", 16)
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (ChromaBackend, FaissFlatBackend, FaissHNSWBackend, FaissIVFPQBackend)
+}
+
+
+def create_backend(name, persist_directory, **options):
+    """依名稱建立向量後端"""
+    if name not in BACKENDS:
+        raise ValueError(f"未知的向量後端: {name}（可用: {', '.join(BACKENDS)}）")
+    return BACKENDS[name](persist_directory, **options)
@@ -25,6 +25,8 @@ export default function BotScreen() {
   const [inputText, setInputText] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const flatListRef = useRef<FlatList>(null);
+  // 後端回傳的對話 ID，之後的問題帶回去以延續對話記憶
+  const conversationIdRef = useRef<string | null>(null);
 
   useEffect(() => {
     const initialMessage: Message = {
@@ -74,9 +76,11 @@ export default function BotScreen() {
       // Send message to chat endpoint
       const response = await axiosClient.post("/chat/", {
         question: inputText,
+        ...(conversationIdRef.current && { conversation_id: conversationIdRef.current }),
       });
 
       if (response.data.status === "success") {
+        conversationIdRef.current = response.data.data.conversation_id;
         const botMessage: Message = {
           id: response.data.data.id,
           text: response.data.data.answer,